@@ -88,6 +88,7 @@ setup_args = dict(
     entry_points={
         "console_scripts": [
             "pii-transform = pii_transform.app.transform:main",
+            "pii-detransform = pii_transform.app.detransform:main",
             "pii-process = pii_transform.app.process:main",
             "pii-process-jsonl = pii_transform.app.multi:main",
         ]
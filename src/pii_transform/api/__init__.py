@@ -1 +1,2 @@
 from .transform import PiiTransformer, format_policy   # noqa: F401
+from .detransform import PiiDetransformer   # noqa: F401
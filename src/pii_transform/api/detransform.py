@@ -0,0 +1,99 @@
+"""
+Restore transformed documents to their original values, using the
+substitutions recorded in a vault
+"""
+from itertools import islice
+from collections import Counter
+
+from typing import Dict, List, Union
+from pathlib import Path
+
+from pii_data.helper.exception import ProcException
+from pii_data.types.doc import SrcDocument, DocumentChunk, LocalSrcDocument
+
+from ..helper.vault import PiiVault, TYPE_VAULT_EDIT
+from ..helper.splice import SplicedText
+
+
+# Number of chunks to look up in the vault in a single batch
+DEFAULT_LOOKUP_SIZE = 1000
+
+
+class PiiDetransformer:
+
+    def __init__(self, vault: Union[str, Path, PiiVault], strict: bool = True,
+                 lookup_size: int = None):
+        """
+         :param vault: the vault holding the substitutions (or its directory)
+         :param strict: raise an exception if a recorded substitution is not
+           found in the document (else leave that substitution untouched)
+         :param lookup_size: number of chunks to fetch from the vault at once
+        """
+        self.vault = vault if isinstance(vault, PiiVault) else PiiVault(vault, "r")
+        self._strict = strict
+        self._lookup_size = lookup_size or DEFAULT_LOOKUP_SIZE
+        self._stats = Counter()
+
+
+    def __repr__(self) -> str:
+        return f"<PiiDetransformer {self.vault.path}>"
+
+
+    def stats(self) -> Dict:
+        """
+        Return processing statistics: number of documents, chunks, restored
+        entities & mismatched substitutions
+        """
+        return dict(self._stats)
+
+
+    def restore_chunk(self, chunk: DocumentChunk,
+                      edits: List[TYPE_VAULT_EDIT]) -> DocumentChunk:
+        """
+        Restore the original values in a chunk
+         :param chunk: the transformed chunk
+         :param edits: the substitutions recorded for the chunk, as a list of
+           (start, end, substitution, original) tuples
+        """
+        data = str(chunk.data)
+        restore = []
+        for start, end, subst, orig in edits:
+            if data[start:end] != subst:
+                if self._strict:
+                    raise ProcException("substitution mismatch in chunk {} at {}: '{}'",
+                                        chunk.id, start, subst)
+                self._stats["mismatches"] += 1
+                continue
+            restore.append((start, end, orig))
+        self._stats["entities"] += len(restore)
+        return DocumentChunk(chunk.id, str(SplicedText(data, restore)),
+                             chunk.context)
+
+
+    def __call__(self, document: SrcDocument) -> SrcDocument:
+        """
+        Restore the original PII values in a transformed document
+         :param document: the transformed document
+         :return: a local document with all recorded substitutions reverted
+        """
+        self._stats["documents"] += 1
+        docid = document.id
+
+        meta = document.metadata
+        dtype = meta.get("document", {}).get("type", "sequence")
+        out = LocalSrcDocument(dtype)
+        out.add_metadata(**meta)
+
+        # Fetch the substitutions from the vault in batches of chunks
+        it = iter(document)
+        while True:
+            chunks = list(islice(it, self._lookup_size))
+            if not chunks:
+                break
+            self._stats["chunks"] += len(chunks)
+            edits = self.vault.lookup_many((docid, c.id) for c in chunks)
+            for chunk in chunks:
+                e = edits.get((docid, chunk.id))
+                out.add_chunk(self.restore_chunk(chunk, e) if e else chunk)
+
+        return out
@@ -1,26 +1,58 @@
 """
 Transform documents by replacing PII instances according to a policy
 """
-from operator import attrgetter
+import os
+import mmap
+import time
+import asyncio
+import weakref
+from itertools import groupby, chain, islice
+from collections import Counter
+from concurrent.futures import Executor
 
-from typing import Dict, Union
+from typing import Dict, Union, List, Tuple, Iterable, Iterator, AsyncIterator, \
+    BinaryIO, Callable
 
 from pii_data.helper.config import load_config
-from pii_data.helper.exception import InvArgException
+from pii_data.helper.exception import InvArgException, ProcException
+from pii_data.helper.io import openfile
 from pii_data.types import PiiCollection, PiiEntity
 from pii_data.types.doc import SrcDocument, DocumentChunk, LocalSrcDocument
-from pii_data.types.piicollection import PiiChunkIterator
 try:
     from pii_decide.defs import ACT_DISCARD
 except ImportError:
     ACT_DISCARD = "discard"
 
 from ..helper import PiiSubstitutionValue
+from ..helper.splice import SplicedText
+from ..helper.vault import PiiVault
+from ..helper.piistream import PiiStreamReader
+from ..helper.piibin import PiiBinaryCollection
+from ..helper.memory import MemoryBudget
+from ..helper.metrics import TransformMetrics
+from ..helper.spans import SpanResolver
+from ..helper.spantable import SpanTable, SpanSlice
+from ..helper.mmaptext import CharOffsets, RangeCopier
+from ..helper.docstream import load_csv
+from ..out.csv import write_csv_stream
 from .. import defs
 
+TYPE_PIIC = Union[PiiCollection, PiiStreamReader, PiiBinaryCollection]
+
 # Reset all assigment caches for each new document
 DEFAULT_RESET = "document"
 
+# Asynchronous processing: maximum number of documents being processed at
+# the same time, and number of chunks (or table rows) in each slice
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_SLICE_SIZE = 64
+
+# With a memory budget, number of units (chunks or table rows) between checks
+MEMORY_CHECK_INTERVAL = 32
+
+# Plain text fast path: number of entities substituted in each batch
+TEXTFILE_BATCH = 1024
+
 
 def format_policy(name: str, param: str = None) -> Dict:
     """
@@ -37,6 +69,10 @@ def format_policy(name: str, param: str = None) -> Dict:
         if param is None:
             raise InvArgException("custom policy needs a template")
         return {"name": "custom", "template": param}
+    elif name == "dictionary":
+        if param is None:
+            raise InvArgException("dictionary policy needs a path")
+        return {"name": "dictionary", "path": param}
     else:
         return name
 
@@ -51,18 +87,59 @@ def discard_pii(pii: PiiEntity) -> bool:
     action = prc.get("action")
     return action == ACT_DISCARD
 
+
+def chunk_row(chunk: DocumentChunk):
+    """
+    Return the row a table chunk belongs to
+    """
+    return chunk.context.get("row") if chunk.context else None
+
+
+def doc_type(document: SrcDocument) -> str:
+    """
+    Return the type of a document
+    """
+    return document.metadata.get("document", {}).get("type", "sequence")
+
+
+def run_all(funcs: List[Callable[[], None]]) -> Callable[[], None]:
+    """
+    Return a function that calls all the passed functions in order
+    """
+    def run():
+        for func in funcs:
+            func()
+    return run
+
+
+def output_document(document: SrcDocument) -> LocalSrcDocument:
+    """
+    Create an empty output document, cloning all the metadata from the
+    original one
+    """
+    out = LocalSrcDocument(doc_type(document))
+    out.add_metadata(**document.metadata)
+    return out
+
 # --------------------------------------------------------------------------
 
 
 class PiiTransformer:
 
     def __init__(self, default_policy: Union[str, Dict] = None,
-                 config: Dict = None, debug: bool = False):
+                 config: Dict = None, debug: bool = False,
+                 budget: MemoryBudget = None,
+                 policy_sets: Dict[str, Union[str, Dict]] = None):
         """
          :param default_policy: a default policy value to apply to all entities
             that do not have a specific policy
          :param config: object configuration to apply
          :param debug: print out debug messages
+         :param budget: a memory budget to apply (if not given, it can also be
+            defined in the configuration)
+         :param policy_sets: named policy sets, to produce several outputs in
+            a single pass with transform_multi() (if not given, they can also
+            be defined in the configuration)
         """
         self._debug = debug
         all_config = load_config(config, [defs.FMT_CONFIG_TRANSFORM,
@@ -72,55 +149,585 @@ class PiiTransformer:
         if default_policy is None:
             default_policy = trf_config.get("default_policy")
         self.subst = PiiSubstitutionValue(default_policy, all_config)
+        self.policy_sets = self._policy_sets(
+            policy_sets or trf_config.get("policy_sets") or {},
+            default_policy, all_config)
+        self._spans = SpanResolver(trf_config.get("overlap"))
+        self._stats = Counter()
+        self.metrics = TransformMetrics(trf_config.get("slow_chunk"))
+
+        # Parameters for asynchronous processing
+        self._max_concurrency = trf_config.get("max_concurrency",
+                                               DEFAULT_MAX_CONCURRENCY)
+        self._slice_size = trf_config.get("slice_size", DEFAULT_SLICE_SIZE)
+        self._async = weakref.WeakKeyDictionary()
+
+        # Memory budget
+        if budget is None and trf_config.get("memory_budget"):
+            budget = MemoryBudget(trf_config["memory_budget"])
+        self.budget = budget
+        if budget is not None:
+            self._pressure_handlers(budget)
 
 
     def __repr__(self) -> str:
         return "<PiiTransformer>"
 
 
-    def transform_chunk(self, chunk: DocumentChunk, piic: PiiCollection):
+    @staticmethod
+    def _policy_sets(policy_sets: Dict[str, Union[str, Dict]],
+                     default_policy: Union[str, Dict],
+                     config: Dict) -> Dict[str, PiiSubstitutionValue]:
+        """
+        Create the substitution objects for a set of named policy sets. Each
+        policy set is either a policy (used as default policy), or a dict of
+        transform configuration fields (e.g. `default_policy`, `policy`,
+        `seed`, `vault`) overriding the ones in the main configuration. The
+        vault in the main configuration is not inherited
+        """
+        base = config.get(defs.FMT_CONFIG_TRANSFORM) or {}
+        out = {}
+        for name, pset in policy_sets.items():
+            if not isinstance(pset, (str, dict)):
+                raise InvArgException("invalid policy set '{}': {}", name, pset)
+            if isinstance(pset, str) or "name" in pset:
+                pset = {"default_policy": pset}
+            cfg = {**base, "vault": None, **pset}
+            out[name] = PiiSubstitutionValue(
+                cfg.pop("default_policy", None) or default_policy,
+                {**config, defs.FMT_CONFIG_TRANSFORM: cfg})
+        return out
+
+
+    def _substs(self, multi: bool = False) -> List[PiiSubstitutionValue]:
+        """
+        Return the substitution objects in use: the main one, or the ones for
+        all the policy sets
+        """
+        return list(self.policy_sets.values()) if multi else [self.subst]
+
+
+    def _pressure_handlers(self, budget: MemoryBudget):
+        """
+        Register the actions to take under memory pressure, from the least to
+        the most disruptive: flush the vault, clear the substitution memo and
+        clear the consistency caches (after which the same PII value may get
+        a different substitution)
+        """
+        substs = [self.subst, *self.policy_sets.values()]
+        vaults = [s.vault for s in substs if s.vault is not None]
+        if vaults:
+            budget.add_handler("flush", run_all([v.flush for v in vaults]))
+        budget.add_handler("memo", run_all([s.clear_memo for s in substs]))
+        budget.add_handler("caches", run_all([s.reset for s in substs]))
+
+
+    def stats(self) -> Dict:
+        """
+        Return processing statistics: number of documents, chunks,
+        substituted entities & resolved overlaps, plus the substitution memo statistics (and
+        the memory statistics, if there is a memory budget, and the memo
+        statistics for each policy set, if there are policy sets)
+        """
+        stats = {**self._stats, "overlaps": self._spans.resolved,
+                 **self.subst.stats()}
+        if self.budget is not None:
+            stats.update(self.budget.stats())
+        if self.metrics.slow_chunk is not None:
+            stats["slow_chunks"] = self.metrics.slow_count
+        if self.policy_sets:
+            stats["policy_sets"] = {name: subst.stats()
+                                    for name, subst in self.policy_sets.items()}
+        return stats
+
+
+    def dump_metrics(self, filename: str, format: str = None):
+        """
+        Write the latency & entity-count histograms, plus the processing
+        statistics, to a file
+         :param filename: output file
+         :param format: "json" or "prometheus" (default is to use JSON for
+           `.json` files, and Prometheus for the rest)
+        """
+        self.metrics.dump(filename, self.stats(), format)
+
+
+    def splice_chunks(self, chunks: Iterable[Tuple[DocumentChunk, PiiCollection]],
+                      docid: str = None) -> List[SplicedText]:
+        """
+        Compute the substitutions for a group of DocumentChunks, as lists of
+        edits over the original chunk texts (the texts are not copied). The
+        PII entities in all the chunks are substituted in a single batch.
+        Overlapping entities in a chunk are first resolved according to the
+        `overlap` strategy in the configuration.
+         :param chunks: an iterable of (chunk, piic) tuples, each one giving
+           a chunk and the collection providing the pii for it
+         :param docid: id of the document the chunks belong to (used to
+           record the substitutions in the vault)
+        """
+        return self._splice_chunks(chunks, [self.subst], docid)[0]
+
+
+    def _splice_chunks(self, chunks: Iterable[Tuple[DocumentChunk, PiiCollection]],
+                       substs: List[PiiSubstitutionValue],
+                       docid: str = None) -> List[List[SplicedText]]:
+        """
+        Compute the substitutions for a group of DocumentChunks with a list of
+        substitution objects. The entities are collected & resolved only
+        once, and then substituted by each object in turn
+        """
+        start = time.perf_counter()
+        chunks = list(chunks)
+        spans = [self._spans.resolve_slice(self._span_slice(piic))
+                 for _, piic in chunks]
+        entities = sum(map(len, spans))
+        self._stats["chunks"] += len(chunks)
+        self._stats["entities"] += entities
+        out = []
+        for subst in substs:
+            repl = iter(subst.substitute_spans(spans))
+            spliced = [SplicedText(chunk.data,
+                                   [(start, end, next(repl))
+                                    for start, end in slc.spans()])
+                       for (chunk, _), slc in zip(chunks, spans)]
+            if subst.vault is not None:
+                for (chunk, _), sp in zip(chunks, spliced):
+                    self._record(subst.vault, docid, chunk, sp)
+            out.append(spliced)
+        self.metrics.chunk(time.perf_counter() - start, entities,
+                           [chunk.id for chunk, _ in chunks], docid)
+        return out
+
+
+    @staticmethod
+    def _span_slice(piic: Union[SpanSlice, Iterable[PiiEntity]]) -> SpanSlice:
+        """
+        Get the span table rows for the entities in a chunk, leaving out the
+        ones marked for removal
+        """
+        if isinstance(piic, SpanSlice):
+            return piic
+        return SpanTable(piic, exclude=discard_pii).all()
+
+
+    @staticmethod
+    def _record(vault: PiiVault, docid: str, chunk: DocumentChunk,
+                spliced: SplicedText):
+        """
+        Record in the vault the substitutions done in a chunk, with their
+        positions in the transformed text
+        """
+        if not spliced.changed():
+            return
+        edits = []
+        shift = 0
+        for start, end, repl in spliced.edits:
+            pos = start + shift
+            edits.append((pos, pos + len(repl), repl, chunk.data[start:end]))
+            shift += len(repl) - (end - start)
+        vault.add(docid, chunk.id, edits)
+
+
+    def close(self):
+        """
+        Finish processing, flushing all pending substitution records to the
+        vault (if there is one)
+        """
+        self.subst.close()
+        for subst in self.policy_sets.values():
+            subst.close()
+
+
+    def splice_chunk(self, chunk: DocumentChunk, piic: PiiCollection,
+                     docid: str = None) -> SplicedText:
+        """
+        Compute the substitutions for a DocumentChunk, as a list of edits over
+        the original chunk text (the chunk text is not copied)
+         :param chunk: original chunk
+         :param piic: a collection providing the piic for this chunk
+         :param docid: id of the document the chunk belongs to
+        """
+        return self.splice_chunks([(chunk, piic)], docid)[0]
+
+
+    def transform_chunks(self, chunks: Iterable[Tuple[DocumentChunk, PiiCollection]],
+                         lazy: bool = False,
+                         docid: str = None) -> List[DocumentChunk]:
+        """
+        Perform a transformation on a group of DocumentChunks, substituting
+        all their PII entities in a single batch
+         :param chunks: an iterable of (chunk, piic) tuples
+         :param lazy: leave the chunk data as SplicedText objects, to be
+           materialised only when needed
+         :param docid: id of the document the chunks belong to
+        """
+        chunks = list(chunks)
+        return self._output_chunks(chunks, self.splice_chunks(chunks, docid),
+                                   lazy)
+
+
+    def transform_chunks_multi(self, chunks: Iterable[Tuple[DocumentChunk, PiiCollection]],
+                               lazy: bool = False,
+                               docid: str = None) -> Dict[str, List[DocumentChunk]]:
+        """
+        Perform a transformation on a group of DocumentChunks with each one of
+        the policy sets. The PII entities are collected & resolved only once
+         :param chunks: an iterable of (chunk, piic) tuples
+         :param lazy: leave the chunk data as SplicedText objects
+         :param docid: id of the document the chunks belong to
+         :return: a dict with the transformed chunks for each policy set
+        """
+        if not self.policy_sets:
+            raise InvArgException("no policy sets defined")
+        chunks = list(chunks)
+        spliced = self._splice_chunks(chunks, self._substs(True), docid)
+        return {name: self._output_chunks(chunks, sp, lazy)
+                for name, sp in zip(self.policy_sets, spliced)}
+
+
+    @staticmethod
+    def _output_chunks(chunks: List[Tuple[DocumentChunk, PiiCollection]],
+                       spliced: List[SplicedText],
+                       lazy: bool) -> List[DocumentChunk]:
+        """
+        Create the output chunks for a list of spliced chunk texts
+        """
+        out = []
+        for (chunk, _), sp in zip(chunks, spliced):
+            if not sp.changed():
+                chunk_data = chunk.data     # unchanged chunk: no copy
+            else:
+                chunk_data = sp if lazy else str(sp)
+            out.append(DocumentChunk(chunk.id, chunk_data, chunk.context))
+        return out
+
+
+    def transform_chunk(self, chunk: DocumentChunk, piic: PiiCollection,
+                        lazy: bool = False, docid: str = None) -> DocumentChunk:
         """
         Perform a transformation on a DocumentChunk
          :param chunk: original chunk
          :param piic: a collection providing the piic for this chunk
+         :param lazy: leave the chunk data as a SplicedText object, to be
+           materialised only when needed
+         :param docid: id of the document the chunk belongs to
+        """
+        return self.transform_chunks([(chunk, piic)], lazy, docid)[0]
+
+
+    def transform_textfile(self, infile: str, piic: Iterable[PiiEntity],
+                           outfile: Union[str, BinaryIO],
+                           byte_offsets: bool = False,
+                           docid: str = None) -> Dict:
+        """
+        Fast path for plain text files: transform a text file (UTF-8) taken
+        as a single chunk, without loading it in memory. The input file is
+        memory-mapped, and unchanged byte ranges are copied by the kernel
+        straight into the output file, interleaved with the substitutions.
+         :param infile: name of the input text file
+         :param piic: the PII entities in the file, with positions relative
+           to the start of the file (they must all belong to a single chunk,
+           and their values must match the text at their positions)
+         :param outfile: name of the output file (or an opened binary file)
+         :param byte_offsets: entity positions are byte offsets (instead of
+           character offsets)
+         :param docid: document id (used to record substitutions in the vault)
+         :return: copy statistics
+        """
+        start = time.perf_counter()
+        vault = self.subst.vault
+        if vault is not None and byte_offsets:
+            raise InvArgException("vault recording needs character offsets")
+        if vault is not None and docid is None:
+            raise InvArgException("vault recording for a plain text file needs a document id")
+        if self._reset in ("document", "chunk"):
+            self.subst.reset()
+        # The whole file is a single chunk: sort all entities by position
+        table = SpanTable(piic, exclude=discard_pii, sort=False)
+        if len(set(table.chunk)) > 1:
+            raise ProcException("plain text fast path needs a PII collection with a single chunk, found {}: {}",
+                                len(set(table.chunk)), infile)
+        rows = sorted(range(len(table)), key=table.pos.__getitem__)
+        spans = self._spans.resolve_slice(SpanSlice(table, rows))
+        table, rows = spans.table, spans.rows
+        self._stats["documents"] += 1
+        self._stats["chunks"] += 1
+        self._stats["entities"] += len(rows)
+
+        out = openfile(outfile, "wb")
+        with open(infile, "rb") as src:
+            size = os.fstat(src.fileno()).st_size
+            buf = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) \
+                if size else b""
+            try:
+                to_byte = (lambda pos: pos) if byte_offsets else CharOffsets(buf)
+                copier = RangeCopier(src, buf, out)
+                edits = []
+                pos = shift = 0
+                for n in range(0, len(rows), TEXTFILE_BATCH):
+                    batch = SpanSlice(table, rows[n:n + TEXTFILE_BATCH])
+                    subst = self.subst.substitute_spans([batch])
+                    for row, repl in zip(batch.rows, subst):
+                        pii_pos, pii_len = table.pos[row], table.length[row]
+                        start = to_byte(pii_pos)
+                        value = table.value(row).encode("utf-8")
+                        end = start + len(value) if byte_offsets \
+                            else to_byte(pii_pos + pii_len)
+                        if buf[start:end] != value:
+                            raise ProcException("PII value '{}' does not match the text at position {} in {}",
+                                                table.value(row), pii_pos, infile)
+                        copier.copy(pos, start)
+                        copier.write(repl.encode("utf-8"))
+                        pos = end
+                        if vault is not None:
+                            outpos = pii_pos + shift
+                            edits.append((outpos, outpos + len(repl), repl,
+                                          buf[start:end].decode("utf-8")))
+                            shift += len(repl) - pii_len
+                copier.copy(pos, size)
+                copier.close()
+            finally:
+                if size:
+                    buf.close()
+                if out is not outfile:
+                    out.close()
+
+        chunkid = table.chunk_ids[table.chunk[rows[0]]] if rows else None
+        if edits:
+            vault.add(docid, chunkid, edits)
+        elapsed = time.perf_counter() - start
+        self.metrics.chunk(elapsed, len(rows), [chunkid], docid)
+        self.metrics.document(elapsed, len(rows))
+        return copier.stats
+
+
+    def transform_csv(self, infile: str, piic: TYPE_PIIC,
+                      outfile: str, header: bool = True,
+                      delimiter: str = None,
+                      compress: Union[str, Dict] = None) -> int:
+        """
+        Transform a CSV file in a single pass: rows are read, transformed and
+        written one at a time, so memory use does not grow with the number of
+        rows. PII instances refer to cells through chunk ids `R<n>.<m>` (row
+        & column numbers, starting at 1)
+         :param infile: name of the input CSV file
+         :param piic: the PII instances in the file
+         :param outfile: name of the output CSV file
+         :param header: the first row contains the column names (and is
+           copied to the output)
+         :param delimiter: the field delimiter (default is a comma)
+         :param compress: options for block-parallel compression of the output
+         :return: the number of rows written
+        """
+        doc = load_csv(infile, header=header, delimiter=delimiter)
+        return write_csv_stream(outfile, doc.metadata,
+                                self.iter_transform(doc, piic, lazy=True),
+                                header=header, delimiter=delimiter,
+                                compress=compress)
+
+
+    def _units(self, document: SrcDocument, piic: TYPE_PIIC, lazy: bool,
+               multi: bool = False) -> Iterator[List[DocumentChunk]]:
+        """
+        Transform a document, producing the output chunks in units: a table
+        row for table documents, else a single chunk (with `multi`, each unit
+        is a dict with the output chunks for each policy set). The document
+        time recorded in the metrics leaves out the time spent by the
+        consumer between units
+        """
+        clock = time.perf_counter
+        start = clock()
+        elapsed = 0.0
+        entities = 0
+        substs = self._substs(multi)
+        transform = self.transform_chunks_multi if multi else \
+            self.transform_chunks
+        if self._reset == "document":
+            for subst in substs:
+                subst.reset()
+        self._stats["documents"] += 1
+
+        stream = isinstance(piic, PiiStreamReader)
+        # Streamed collections are queried by chunk; the others are turned
+        # into a span table
+        pii_it = piic if stream else SpanTable(piic, exclude=discard_pii)
+        docid = document.id
+        budget = self.budget
+
+        if doc_type(document) == "table" and self._reset != "chunk":
+            # Table documents: substitute all cells in a row in one batch
+            units = ([(chunk, pii_it(chunk.id)) for chunk in row]
+                     for _, row in groupby(document, key=chunk_row))
+        else:
+            units = ([(chunk, pii_it(chunk.id))] for chunk in document)
+
+        for n, chunks in enumerate(units, start=1):
+            if self._reset == "chunk":
+                for subst in substs:
+                    subst.reset()
+            before = self._stats["entities"]
+            out = transform(chunks, lazy, docid)
+            entities += self._stats["entities"] - before
+            elapsed += clock() - start
+            yield out
+            start = clock()
+            if budget is not None and not n % MEMORY_CHECK_INTERVAL:
+                budget.check()
+
+        if budget is not None:
+            budget.check()
+        if stream:
+            pii_it.finish()
+        self.metrics.document(elapsed + clock() - start, entities)
+
+
+    def iter_transform(self, document: SrcDocument, piic: TYPE_PIIC,
+                       lazy: bool = False) -> Iterator[DocumentChunk]:
+        """
+        Replace in a document the passed detected PII values, producing the
+        transformed chunks one by one
+         :param document: the original document
+         :param piic: the list of detected PII instances
+         :param lazy: keep the data for the modified chunks as SplicedText
+           objects
+        """
+        for unit in self._units(document, piic, lazy):
+            yield from unit
+
+
+    def iter_transform_multi(self, document: SrcDocument, piic: TYPE_PIIC,
+                             lazy: bool = False) -> Iterator[Dict[str, List[DocumentChunk]]]:
+        """
+        Replace in a document the passed detected PII values with each one of
+        the policy sets, walking the document & its PII only once
+         :param document: the original document
+         :param piic: the list of detected PII instances
+         :param lazy: keep the data for the modified chunks as SplicedText
+           objects
+         :return: an iterator over document units (table rows or chunks),
+           each one as a dict with the output chunks for each policy set
+        """
+        return self._units(document, piic, lazy, multi=True)
+
+
+    def transform_multi(self, document: SrcDocument, piic: TYPE_PIIC,
+                        lazy: bool = False) -> Dict[str, SrcDocument]:
+        """
+        Replace in a document the passed detected PII values with each one of
+        the policy sets. The document & its PII are parsed, indexed and
+        filtered only once, and each PII instance is substituted once per
+        policy set
+         :param document: the original document
+         :param piic: the list of detected PII instances
+         :param lazy: keep the data for the modified chunks as SplicedText
+           objects
+         :return: a dict with a local document for each policy set
         """
-        # Construct the new content for the chunk
-        output = []
-        pos = 0
-        for pii in sorted(piic, key=attrgetter("pos")):
-            if discard_pii(pii):
-                continue
-            output += [chunk.data[pos:pii.pos], self.subst(pii)]
-            pos = pii.pos + len(pii)
-        chunk_data = "".join(output) + chunk.data[pos:]
-        return DocumentChunk(chunk.id, chunk_data, chunk.context)
+        if not self.policy_sets:
+            raise InvArgException("no policy sets defined")
+        out = {name: output_document(document) for name in self.policy_sets}
+        for unit in self.iter_transform_multi(document, piic, lazy):
+            for name, chunks in unit.items():
+                for chunk in chunks:
+                    out[name].add_chunk(chunk)
+        return out
 
 
-    def __call__(self, document: SrcDocument,
-                 piic: PiiCollection) -> SrcDocument:
+    def __call__(self, document: SrcDocument, piic: TYPE_PIIC,
+                 lazy: bool = False) -> SrcDocument:
         """
         Replace in a document the passed detected PII values, in accordance
         with the policies that have been set
          :param document: the original document
-         :param piic: the list of detected PII instances
+         :param piic: the list of detected PII instances (either a collection,
+           a PiiStreamReader or a PiiBinaryCollection)
+         :param lazy: keep the data for the modified chunks as SplicedText
+           objects (a DocumentWriter will write them without building the
+           full strings)
          :return: a local document with all replacements done
         """
-        if self._reset == "document":
-            self.subst.reset()
+        out = output_document(document)
+        for chunk in self.iter_transform(document, piic, lazy):
+            out.add_chunk(chunk)
+        return out
 
-        pii_it = PiiChunkIterator(piic)
 
-        # Create the output document, and clone all its metadata
-        meta = document.metadata
-        dtype = meta.get("document", {}).get("type", "sequence")
-        out = LocalSrcDocument(dtype)
-        out.add_metadata(**meta)
+    # ---------------------------------------------------------------------
 
-        # Substitute all PII instances in all chunks
-        for chunk in document:
-            if self._reset == "chunk":
-                self.subst.reset()
-            newchunk = self.transform_chunk(chunk, pii_it(chunk.id))
-            out.add_chunk(newchunk)
 
+    def _async_state(self) -> Tuple[asyncio.Semaphore, asyncio.Lock]:
+        """
+        Get the semaphore limiting the number of concurrent documents and the
+        lock serialising access to the transformer state. They are created on
+        first use in each event loop, since they belong to the loop they are
+        used in
+        """
+        loop = asyncio.get_running_loop()
+        state = self._async.get(loop)
+        if state is None:
+            state = asyncio.Semaphore(self._max_concurrency), asyncio.Lock()
+            self._async[loop] = state
+        return state
+
+
+    async def aiter_transform(self, document: SrcDocument, piic: TYPE_PIIC,
+                              lazy: bool = False,
+                              executor: Executor = None
+                              ) -> AsyncIterator[DocumentChunk]:
+        """
+        Asynchronous version of iter_transform(): the transformation runs in
+        an executor, in slices of `slice_size` units (table rows or chunks),
+        so that the event loop is never blocked for long.
+
+        At most `max_concurrency` documents are processed at the same time
+        (the rest wait before starting). Since the transformer state is
+        shared, slices never run concurrently; and when the assignment caches
+        are reset per document, each document holds the transformer until it
+        is finished, so that its substitutions stay consistent.
+         :param document: the original document
+         :param piic: the list of detected PII instances
+         :param lazy: keep the data for the modified chunks as SplicedText
+           objects
+         :param executor: the executor to use (default: the event loop
+           default executor)
+        """
+        loop = asyncio.get_running_loop()
+        limit, lock = self._async_state()
+        per_document = self._reset == "document"
+        units = self._units(document, piic, lazy)
+        size = self._slice_size
+
+        def next_slice() -> List[DocumentChunk]:
+            return list(chain.from_iterable(islice(units, size)))
+
+        async with limit:
+            if per_document:
+                await lock.acquire()
+            try:
+                while True:
+                    if per_document:
+                        chunks = await loop.run_in_executor(executor, next_slice)
+                    else:
+                        async with lock:
+                            chunks = await loop.run_in_executor(executor,
+                                                                next_slice)
+                    if not chunks:
+                        break
+                    for chunk in chunks:
+                        yield chunk
+            finally:
+                if per_document:
+                    lock.release()
+
+
+    async def atransform(self, document: SrcDocument, piic: TYPE_PIIC,
+                         lazy: bool = False,
+                         executor: Executor = None) -> SrcDocument:
+        """
+        Asynchronous version of the transformer call, see aiter_transform()
+         :return: a local document with all replacements done
+        """
+        out = output_document(document)
+        async for chunk in self.aiter_transform(document, piic, lazy, executor):
+            out.add_chunk(chunk)
         return out
@@ -0,0 +1,77 @@
+"""
+Command-line script to materialise a transformed document from the original
+document plus a patch (created with `pii-transform --output-format patch`)
+"""
+
+import sys
+import argparse
+
+from typing import List
+
+from pii_data.types.doc import LocalSrcDocumentFile
+
+from .. import VERSION
+from ..helper.docstream import StreamSrcDocumentFile
+from ..out import DocumentWriter
+from ..out.stream import write_stream
+from ..out.patch import load_patch, apply_patch, iter_apply_patch
+
+
+def process(args: argparse.Namespace):
+    """
+    Apply the patch and write the output document
+    """
+    patch = load_patch(args.patch)
+    if args.verbose:
+        print(f". Loaded patch for {len(patch[1])} chunks: {args.patch}",
+              file=sys.stderr)
+    if args.stream_doc:
+        doc = StreamSrcDocumentFile(args.infile)
+        write_stream(args.outfile, doc.metadata,
+                     iter_apply_patch(doc, patch, lazy=True),
+                     format=args.output_format)
+    else:
+        doc = LocalSrcDocumentFile(args.infile)
+        out = DocumentWriter(apply_patch(doc, patch, lazy=True))
+        out.dump(args.outfile, format=args.output_format)
+    if args.verbose:
+        print(". Written:", args.outfile, file=sys.stderr)
+
+
+def parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="pii-transform apply-patch",
+        description=f"Apply a patch to an original document (v. {VERSION})")
+
+    parser.add_argument("infile", help="original document")
+    parser.add_argument("patch", help="patch file")
+    parser.add_argument("outfile", help="destination document file")
+    parser.add_argument("--output-format", "-of",
+                        choices=("txt", "yaml", "csv", "jsonl"),
+                        help="output format")
+    parser.add_argument("--stream-doc", action="store_true",
+                        help="read the original document (YAML or JSON Lines) and write the output incrementally")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print progress messages")
+    parser.add_argument('--reraise', action='store_true',
+                        help='re-raise exceptions on errors')
+
+    return parser.parse_args(args)
+
+
+def main(args: List[str] = None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_args(args)
+    try:
+        process(args)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        if args.reraise:
+            raise
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Command-line script to compile a substitution dictionary index (for the
+`dictionary` policy) from CSV or TSV source files
+"""
+
+import sys
+import argparse
+
+from typing import List
+
+from .. import VERSION
+from ..helper.dictionary import build_dictionary
+
+
+def process(args: argparse.Namespace):
+    """
+    Build the dictionary index
+    """
+    delimiter = "\t" if args.delimiter == "tab" else args.delimiter
+    count = build_dictionary(args.infile, args.outfile, delimiter)
+    if args.verbose:
+        print(f". Written {count} entries:", args.outfile, file=sys.stderr)
+
+
+def parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="pii-transform build-dict",
+        description=f"Build a substitution dictionary index (v. {VERSION})")
+
+    parser.add_argument("infile", nargs="+",
+                        help="source file(s), with three columns: PII type, value and replacement")
+    parser.add_argument("outfile", help="destination index file")
+    parser.add_argument("--delimiter",
+                        help="field delimiter in the source files (use 'tab' for a tab; default is a tab for .tsv files, else a comma)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print progress messages")
+    parser.add_argument('--reraise', action='store_true',
+                        help='re-raise exceptions on errors')
+
+    return parser.parse_args(args)
+
+
+def main(args: List[str] = None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_args(args)
+    try:
+        process(args)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        if args.reraise:
+            raise
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
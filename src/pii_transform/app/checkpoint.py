@@ -0,0 +1,154 @@
+"""
+Checkpointing for batch runs. A checkpoint directory contains:
+ * `journal.jsonl`: one record per completed document, appended as soon as
+   the document has been written
+ * `state.json`: a periodic snapshot of the substitution state (consistency
+   caches, rotation indices, memo & random state), plus the number of
+   journal records it covers
+
+When resuming, the documents covered by the last snapshot are skipped and
+the substitution state is restored. Documents completed after the snapshot
+are processed again: since the restored state is exactly the one they saw,
+they get the same substitutions as in the interrupted run.
+"""
+
+import os
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from typing import Dict, List, Tuple, Union
+
+from pii_data.helper.exception import InvArgException, ProcException
+
+from ..api import PiiTransformer
+
+
+FMT_CHECKPOINT = "pii-transform:checkpoint:v1"
+
+# Default number of completed documents between state snapshots
+DEFAULT_INTERVAL = 10
+
+
+def job_key(job: SimpleNamespace) -> Tuple[str, str, str]:
+    return job.infile, job.pii, job.outfile
+
+
+class Checkpoint:
+
+    def __init__(self, path: Union[str, Path], interval: int = None,
+                 resume: bool = False):
+        """
+         :param path: checkpoint directory
+         :param interval: number of completed documents between snapshots
+         :param resume: resume from the existing checkpoint (if not, the
+           directory must not contain a journal)
+        """
+        self.path = Path(path)
+        self.interval = interval or DEFAULT_INTERVAL
+        self._journal = self.path / "journal.jsonl"
+        self._statefile = self.path / "state.json"
+        self._done = set()
+        self._state = None
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        records = self._read_journal()
+        if records and not resume:
+            raise InvArgException("checkpoint directory {} contains a previous run: resume it, or use a new one",
+                                  self.path)
+        if resume and self._statefile.exists():
+            with open(self._statefile, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if snapshot.get("format") != FMT_CHECKPOINT:
+                raise ProcException("invalid checkpoint state: {}",
+                                    self._statefile)
+            records = records[:snapshot["done"]]
+            self._state = snapshot["state"]
+        else:
+            records = []
+        self._done = set(tuple(r["job"]) for r in records)
+        self.count = len(records)
+
+        # Rewrite the journal, dropping the records not in the snapshot
+        tmpname = self._journal.with_suffix(".tmp")
+        with open(tmpname, "w", encoding="utf-8") as f:
+            for r in records:
+                print(json.dumps(r, ensure_ascii=False), file=f)
+        os.replace(tmpname, self._journal)
+        self._out = open(self._journal, "a", encoding="utf-8")
+
+
+    def __repr__(self) -> str:
+        return f"<Checkpoint {self.path} #{self.count}>"
+
+
+    def _read_journal(self) -> List[Dict]:
+        """
+        Read the journal records (ignoring a truncated last line)
+        """
+        if not self._journal.exists():
+            return []
+        records = []
+        with open(self._journal, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+
+    def pending(self, jobs: List[SimpleNamespace]) -> List[SimpleNamespace]:
+        """
+        Return the jobs not yet completed
+        """
+        return [job for job in jobs if job_key(job) not in self._done]
+
+
+    def restore(self, trf: PiiTransformer) -> bool:
+        """
+        Restore the substitution state from the last snapshot, if any
+        """
+        if self._state is None:
+            return False
+        trf.subst.set_state(self._state)
+        return True
+
+
+    def add(self, job: SimpleNamespace, trf: PiiTransformer):
+        """
+        Record a completed job, taking a snapshot if it is due
+        """
+        record = {"job": list(job_key(job)), "time": time.time()}
+        print(json.dumps(record, ensure_ascii=False), file=self._out)
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        self.count += 1
+        if not self.count % self.interval:
+            self.snapshot(trf)
+
+
+    def snapshot(self, trf: PiiTransformer):
+        """
+        Persist the substitution state, covering all the journal records
+        """
+        if trf.subst.vault is not None:
+            trf.subst.vault.flush()
+        snapshot = {"format": FMT_CHECKPOINT, "done": self.count,
+                    "time": time.time(), "state": trf.subst.get_state()}
+        tmpname = self._statefile.with_suffix(".tmp")
+        with open(tmpname, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpname, self._statefile)
+
+
+    def close(self, trf: PiiTransformer = None):
+        """
+        Close the journal, taking a final snapshot
+        """
+        if trf is not None:
+            self.snapshot(trf)
+        self._out.close()
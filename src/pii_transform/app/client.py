@@ -0,0 +1,161 @@
+"""
+A thin client for the local transform server
+"""
+
+import json
+import socket
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+from collections import Counter
+
+from typing import Dict, List, Union
+
+from pii_data.helper.config import load_config
+from pii_data.helper.exception import InvArgException, ProcException
+from pii_data.types import PiiCollection
+from pii_data.types.doc import SrcDocument
+
+from ..helper.io import doc_fromdict, doc_todict, piic_todict
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """
+    An HTTP connection over a Unix socket
+    """
+
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class TransformClient:
+
+    def __init__(self, url: str, timeout: float = None):
+        """
+         :param url: server address, either `http://host:port` or
+           `unix:/path/to/socket`
+         :param timeout: timeout for server requests, in seconds
+        """
+        self.url = url
+        self._timeout = timeout
+        parts = urlsplit(url)
+        if parts.scheme == "unix":
+            self._socket = parts.path
+        elif parts.scheme == "http" and parts.hostname:
+            self._socket = None
+            self._host, self._port = parts.hostname, parts.port
+        else:
+            raise InvArgException("invalid server address: {}", url)
+
+
+    def __repr__(self) -> str:
+        return f"<TransformClient {self.url}>"
+
+
+    def _connection(self) -> HTTPConnection:
+        if self._socket:
+            return UnixHTTPConnection(self._socket, self._timeout)
+        return HTTPConnection(self._host, self._port, timeout=self._timeout)
+
+
+    def request(self, method: str, path: str, payload: Dict = None) -> Dict:
+        """
+        Send a request to the server and return the decoded response
+        """
+        conn = self._connection()
+        try:
+            body = None if payload is None else \
+                json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            headers = {"Content-Type": "application/json"} if body else {}
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = json.loads(resp.read())
+        except OSError as e:
+            raise ProcException("cannot contact server {}: {}", self.url, e) from e
+        finally:
+            conn.close()
+        if resp.status != 200:
+            raise ProcException("server error {}: {}", resp.status,
+                                data.get("error"))
+        return data
+
+
+    def transform(self, document: Dict, pii: Dict,
+                  policy: Union[str, Dict] = None, config: Dict = None) -> Dict:
+        """
+        Transform a document
+         :param document: the document, as a dict
+         :param pii: the PII collection, as a dict
+         :param policy: default policy to apply
+         :param config: PIISA configuration to apply
+         :return: the transformed document, as a dict
+        """
+        payload = {"document": document, "pii": pii, "policy": policy,
+                   "config": config}
+        return self.request("POST", "/transform", payload)["document"]
+
+
+    def transform_batch(self, items: List[Dict], policy: Union[str, Dict] = None,
+                        config: Dict = None) -> List[Dict]:
+        """
+        Transform a list of documents in a single request
+         :param items: list of dicts, each one with `document` & `pii` fields
+         :return: the list of transformed documents
+        """
+        payload = {"items": items, "policy": policy, "config": config}
+        return self.request("POST", "/transform/batch", payload)["documents"]
+
+
+    def health(self) -> Dict:
+        return self.request("GET", "/health")
+
+
+    def metrics(self) -> Dict:
+        return self.request("GET", "/metrics")
+
+
+class RemoteTransformer:
+    """
+    An object with the same calling interface as PiiTransformer, that sends
+    all documents to a transform server
+    """
+
+    def __init__(self, url: str, default_policy: Union[str, Dict] = None,
+                 config: List = None):
+        """
+         :param url: server address
+         :param default_policy: default policy to apply
+         :param config: configuration to apply (files or dicts); it is loaded
+           locally and sent to the server
+        """
+        self.client = TransformClient(url)
+        self._policy = default_policy
+        self._config = json.loads(json.dumps(load_config(config))) \
+            if config else None
+        self._stats = Counter()
+
+
+    def __repr__(self) -> str:
+        return f"<RemoteTransformer {self.client.url}>"
+
+
+    def __call__(self, document: SrcDocument, piic: PiiCollection,
+                 lazy: bool = False) -> SrcDocument:
+        result = self.client.transform(doc_todict(document), piic_todict(piic),
+                                       self._policy, self._config)
+        self._stats["documents"] += 1
+        return doc_fromdict(result, self.client.url)
+
+
+    def stats(self) -> Dict:
+        return dict(self._stats)
+
+
+    def close(self):
+        pass
@@ -0,0 +1,314 @@
+"""
+Multi-node processing of a corpus, coordinated only through files on shared
+storage:
+ * `pii-transform plan` scans a corpus (given as a batch file) and writes a
+   plan: a JSON manifest splitting the documents into shards balanced by
+   size in bytes and number of PII instances
+ * `pii-transform run --shard i/N` processes one shard of a plan (each node
+   runs a different shard), and writes a result manifest for the shard with
+   its processing statistics & output files
+ * `pii-transform merge` combines the result manifests of all shards
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import argparse
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+from typing import Dict, List, Tuple
+
+from pii_data.helper.io import openfile, base_extension
+from pii_data.helper.exception import InvArgException, ProcException
+
+from .. import VERSION
+from ..helper.piibin import PiiBinaryCollection, load_pii
+from ..out.shard import manifest_name
+
+
+FMT_PLAN = "pii-transform:plan:v1"
+FMT_SHARD_RESULT = "pii-transform:shard-result:v1"
+FMT_MERGED = "pii-transform:merged-result:v1"
+
+# Statistics that are combined across shards by taking the maximum value
+MAX_STATS = frozenset(("memo_size", "memory_budget", "memory_peak",
+                       "memory_peak_reserved"))
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _write_json(filename: str, data: Dict):
+    """
+    Write a JSON file atomically (readers on other nodes never see a
+    partially written file)
+    """
+    tmpname = f"{filename}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmpname, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmpname, filename)
+
+
+def _read_json(filename: str, fmt: str) -> Dict:
+    try:
+        with open(filename, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ProcException("cannot read {}: {}", filename, e) from e
+    if data.get("format") != fmt:
+        raise ProcException("invalid format in {}", filename)
+    return data
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parse a shard specification `i/N` (with i starting at 0)
+    """
+    try:
+        index, num = map(int, str(value).split("/"))
+    except ValueError as e:
+        raise InvArgException("invalid shard specification: {}", value) from e
+    if num < 1 or not 0 <= index < num:
+        raise InvArgException("invalid shard specification: {}", value)
+    return index, num
+
+
+def count_pii(filename: str) -> int:
+    """
+    Count the PII instances in a collection file (without loading it, for
+    NDJSON & binary collections)
+    """
+    ext = base_extension(filename)
+    if ext == ".piib":
+        piic = PiiBinaryCollection(filename)
+        num = len(piic)
+        piic.close()
+        return num
+    elif ext in (".ndjson", ".jsonl"):
+        with openfile(filename, encoding="utf-8") as f:
+            return max(sum(1 for line in f if line.strip()) - 1, 0)
+    return len(load_pii(filename).pii)
+
+
+def result_name(planfile: str, index: int) -> str:
+    """
+    Return the name of the result manifest for a shard of a plan
+    """
+    base = planfile[:-5] if planfile.endswith(".json") else planfile
+    return f"{base}.result-{index:05d}.json"
+
+
+def merged_name(planfile: str) -> str:
+    """
+    Return the default name of the merged result manifest for a plan
+    """
+    base = planfile[:-5] if planfile.endswith(".json") else planfile
+    return f"{base}.merged.json"
+
+
+# --------------------------------------------------------------------------
+
+
+def make_plan(jobs: List[SimpleNamespace], shards: int) -> Dict:
+    """
+    Split a list of jobs into shards, balanced by input size and number of
+    PII instances: each job costs its fraction of the total bytes plus its
+    fraction of the total PII, and jobs are assigned (from the most costly)
+    to the shard with the smallest cost so far
+     :param jobs: the jobs, with `infile`, `pii` & `outfile` attributes
+     :param shards: number of shards
+    """
+    if shards < 1:
+        raise InvArgException("invalid number of shards: {}", shards)
+    items = []
+    for n, job in enumerate(jobs):
+        items.append({"infile": job.infile, "pii": job.pii,
+                      "outfile": job.outfile,
+                      "bytes": os.path.getsize(job.infile),
+                      "pii_count": count_pii(job.pii),
+                      "seq": n})
+    total_bytes = sum(i["bytes"] for i in items) or 1
+    total_pii = sum(i["pii_count"] for i in items) or 1
+
+    def cost(item: Dict) -> float:
+        return item["bytes"]/total_bytes + item["pii_count"]/total_pii
+
+    out = [{"index": i, "bytes": 0, "pii_count": 0, "jobs": []}
+           for i in range(shards)]
+    heap = [(0.0, i) for i in range(shards)]
+    for item in sorted(items, key=lambda i: (-cost(i), i["seq"])):
+        load, i = heapq.heappop(heap)
+        shard = out[i]
+        shard["jobs"].append(item)
+        shard["bytes"] += item["bytes"]
+        shard["pii_count"] += item["pii_count"]
+        heapq.heappush(heap, (load + cost(item), i))
+    # Keep the original job order within each shard
+    for shard in out:
+        shard["jobs"].sort(key=lambda i: i["seq"])
+        for item in shard["jobs"]:
+            del item["seq"]
+
+    return {"format": FMT_PLAN, "created": _now(), "shards": shards,
+            "jobs": len(items), "bytes": sum(i["bytes"] for i in items),
+            "pii_count": sum(i["pii_count"] for i in items),
+            "shard_list": out}
+
+
+def load_plan(planfile: str) -> Dict:
+    """
+    Read a plan file
+    """
+    return _read_json(planfile, FMT_PLAN)
+
+
+def shard_jobs(plan: Dict, index: int, num: int) -> List[SimpleNamespace]:
+    """
+    Return the jobs in a shard of a plan
+    """
+    if num != plan["shards"]:
+        raise InvArgException("shard count {} does not match the plan ({})",
+                              num, plan["shards"])
+    return [SimpleNamespace(infile=j["infile"], pii=j["pii"],
+                            outfile=j["outfile"])
+            for j in plan["shard_list"][index]["jobs"]]
+
+
+def write_result(planfile: str, index: int, num: int,
+                 jobs: List[SimpleNamespace], stats: Dict,
+                 started: float) -> str:
+    """
+    Write the result manifest for a processed shard
+     :return: the manifest file name
+    """
+    outputs = []
+    for job in jobs:
+        out = {"infile": job.infile, "outfile": job.outfile}
+        if os.path.isfile(job.outfile):
+            out["bytes"] = os.path.getsize(job.outfile)
+        manifest = manifest_name(job.outfile)
+        if os.path.isfile(manifest):
+            out["manifest"] = manifest
+        outputs.append(out)
+    result = {"format": FMT_SHARD_RESULT, "plan": planfile, "shard": index,
+              "shards": num, "host": socket.gethostname(), "pid": os.getpid(),
+              "finished": _now(), "elapsed": time.time() - started,
+              "stats": stats, "outputs": outputs}
+    name = result_name(planfile, index)
+    _write_json(name, result)
+    return name
+
+
+def merge_stats(stats: List[Dict]) -> Dict:
+    """
+    Combine the processing statistics of several shards: counters are added,
+    peak values take the maximum, and rates are recomputed
+    """
+    out = {}
+    for st in stats:
+        for k, v in st.items():
+            if not isinstance(v, (int, float)) or isinstance(v, bool):
+                continue
+            if k in MAX_STATS:
+                out[k] = max(out.get(k, v), v)
+            else:
+                out[k] = out.get(k, 0) + v
+    if "memo_hit_rate" in out:
+        lookups = out.get("memo_hits", 0) + out.get("memo_misses", 0)
+        out["memo_hit_rate"] = out.get("memo_hits", 0)/lookups if lookups else 0.0
+    return out
+
+
+def merge_results(planfile: str, partial: bool = False) -> Dict:
+    """
+    Combine the result manifests of all shards in a plan
+     :param planfile: the plan file
+     :param partial: allow missing shards
+    """
+    plan = load_plan(planfile)
+    results, missing = [], []
+    for i in range(plan["shards"]):
+        name = result_name(planfile, i)
+        if os.path.exists(name):
+            results.append(_read_json(name, FMT_SHARD_RESULT))
+        else:
+            missing.append(i)
+    if missing and not partial:
+        raise ProcException("missing results for shards: {}",
+                            ", ".join(map(str, missing)))
+    return {"format": FMT_MERGED, "plan": planfile, "created": _now(),
+            "shards": plan["shards"], "complete": not missing,
+            "missing": missing,
+            "elapsed": max((r["elapsed"] for r in results), default=0),
+            "stats": merge_stats([r["stats"] for r in results]),
+            "outputs": [o for r in results for o in r["outputs"]]}
+
+
+# --------------------------------------------------------------------------
+
+
+def plan_main(args: List[str]):
+    parser = argparse.ArgumentParser(
+        prog="pii-transform plan",
+        description=f"Split a corpus into shards for multi-node processing (v. {VERSION})")
+    parser.add_argument("batch",
+                        help="batch file: one line per document, containing source document, PII collection and destination file")
+    parser.add_argument("planfile", help="output plan file (JSON)")
+    parser.add_argument("--shards", type=int, required=True,
+                        help="number of shards")
+    parser.add_argument('--reraise', action='store_true',
+                        help='re-raise exceptions on errors')
+    args = parser.parse_args(args)
+
+    from .jobs import read_batch
+    try:
+        plan = make_plan(read_batch(args.batch), args.shards)
+        _write_json(args.planfile, plan)
+        for shard in plan["shard_list"]:
+            print(f". shard {shard['index']}: {len(shard['jobs'])} documents,",
+                  f"{shard['bytes']} bytes, {shard['pii_count']} PII",
+                  file=sys.stderr)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        if args.reraise:
+            raise
+        sys.exit(1)
+
+
+def run_main(args: List[str]):
+    from .transform import parse_args, run
+    args = parse_args(args, prog="pii-transform run")
+    if not (args.plan and args.shard):
+        print("Error: 'run' needs --plan and --shard", file=sys.stderr)
+        sys.exit(1)
+    run(args)
+
+
+def merge_main(args: List[str]):
+    parser = argparse.ArgumentParser(
+        prog="pii-transform merge",
+        description=f"Combine the results of all shards in a plan (v. {VERSION})")
+    parser.add_argument("planfile", help="plan file")
+    parser.add_argument("--output", "-o",
+                        help="merged result file (default is <plan>.merged.json)")
+    parser.add_argument("--partial", action="store_true",
+                        help="allow shards with no results")
+    parser.add_argument('--reraise', action='store_true',
+                        help='re-raise exceptions on errors')
+    args = parser.parse_args(args)
+
+    try:
+        result = merge_results(args.planfile, args.partial)
+        _write_json(args.output or merged_name(args.planfile), result)
+        if result["missing"]:
+            print(". Missing shards:", result["missing"], file=sys.stderr)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        if args.reraise:
+            raise
+        sys.exit(1)
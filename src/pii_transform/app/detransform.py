@@ -0,0 +1,110 @@
+"""
+Command-line script to restore transformed documents to their original PII
+values, using a substitution vault
+"""
+
+import sys
+import argparse
+
+from typing import List, Tuple
+
+from pii_data.helper.exception import InvArgException
+from pii_data.helper.io import openfile
+from pii_data.types.doc import LocalSrcDocumentFile
+
+from .. import VERSION
+from ..api import PiiDetransformer
+from ..out import DocumentWriter
+from .jobs import Log
+from .transform import print_stats
+
+
+def read_batch(filename: str) -> List[Tuple[str, str]]:
+    """
+    Read a batch file: each line contains the names of the transformed
+    document and the destination file, separated by whitespace
+    """
+    jobs = []
+    with openfile(filename, encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            fields = line.split()
+            if len(fields) != 2:
+                raise InvArgException("invalid line {} in batch file {}",
+                                      n, filename)
+            jobs.append(tuple(fields))
+    return jobs
+
+
+def process(args: argparse.Namespace):
+
+    log = Log(args.verbose)
+
+    log(". Opening vault:", args.vault)
+    dtrf = PiiDetransformer(args.vault, strict=not args.lenient)
+
+    if args.batch:
+        log(". Reading batch file:", args.batch)
+        jobs = read_batch(args.batch)
+    elif args.infile and args.outfile:
+        jobs = [(args.infile, args.outfile)]
+    else:
+        raise InvArgException("either a batch file or input & output files are needed")
+
+    for infile, outfile in jobs:
+        log(". Loading document:", infile)
+        doc = LocalSrcDocumentFile(infile)
+        log(". Restoring:", infile)
+        result = dtrf(doc)
+        log(". Dumping to:", outfile)
+        DocumentWriter(result).dump(outfile, format=args.output_format)
+
+    if args.show_stats:
+        print_stats(dtrf.stats())
+
+
+def parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=f"Restore original PII values in transformed documents (v. {VERSION})")
+
+    g0 = parser.add_argument_group("Input/output paths")
+    g0.add_argument("infile", nargs="?", help="transformed document file (YAML)")
+    g0.add_argument("outfile", nargs="?", help="destination document file")
+    g0.add_argument("--batch",
+                    help="file with a list of input & output files, one pair per line")
+    g0.add_argument("--vault", required=True,
+                    help="vault directory with the recorded substitutions")
+
+    g2 = parser.add_argument_group("Processing options")
+    g2.add_argument("--lenient", action="store_true",
+                    help="skip substitutions not found in the document, instead of failing")
+    g2.add_argument("--output-format", "-of", choices=("txt", "yaml", "csv"),
+                    help="output format")
+
+    g3 = parser.add_argument_group("Other")
+    g3.add_argument("-q", "--quiet", action="store_false", dest="verbose")
+    g3.add_argument('--reraise', action='store_true',
+                    help='re-raise exceptions on errors')
+    g3.add_argument("--show-stats", action="store_true", help="show statistics")
+
+    return parser.parse_args(args)
+
+
+def main(args: List[str] = None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_args(args)
+    try:
+        process(args)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        if args.reraise:
+            raise
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
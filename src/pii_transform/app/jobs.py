@@ -0,0 +1,303 @@
+"""
+The processing stages for pii-transform jobs: load the document & its PII
+collection, transform it and write the output
+"""
+
+import os
+import sys
+import argparse
+from types import SimpleNamespace
+
+from typing import List, Iterable
+
+from pii_data.helper.exception import InvArgException
+from pii_data.helper.io import openfile, base_extension
+from pii_data.types.doc import LocalSrcDocumentFile
+
+from ..helper.piistream import PiiStreamReader
+from ..helper.piibin import load_pii
+from ..api import PiiTransformer
+from ..helper.docstream import StreamSrcDocumentFile, load_csv
+from ..out import DocumentWriter
+from ..out.stream import write_stream
+from ..out.patch import write_patch
+from ..out.csv import write_csv_stream
+from ..out.shard import write_shards
+from ..out.compress import strip_codec, open_compressed
+from .pipeline import Pipeline
+
+# Estimated ratio between the memory used by a loaded document (plus its PII
+# collection) and its file size
+MEMORY_EXPANSION = 8
+
+# Estimated working memory for a streamed document (the chunks being
+# transformed & written, and the output buffers)
+STREAM_MEMORY = 16 * 1024**2
+
+
+class Log:
+    """
+    A very simple class to conditionally log messages to console_scripts
+    """
+    def __init__(self, verbose: bool):
+        self._v = verbose
+
+    def __call__(self, msg: str, *args):
+        if self._v:
+            print(msg, *args, file=sys.stderr)
+
+
+def read_batch(filename: str) -> List[SimpleNamespace]:
+    """
+    Read a batch file: each line contains the names of the source document,
+    the PII collection and the destination file, separated by whitespace
+    """
+    jobs = []
+    with openfile(filename, encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            fields = line.split()
+            if len(fields) != 3:
+                raise InvArgException("invalid line {} in batch file {}",
+                                      n, filename)
+            jobs.append(SimpleNamespace(infile=fields[0], pii=fields[1],
+                                        outfile=fields[2]))
+    return jobs
+
+
+def policy_set_output(outfile: str, name: str) -> str:
+    """
+    Return the output file name for a policy set
+    """
+    return outfile.replace("{name}", name)
+
+
+class JobStages:
+    """
+    The processing stages for one job: load, transform & write
+    """
+
+    def __init__(self, trf: PiiTransformer, args: argparse.Namespace,
+                 log: Log):
+        self.trf = trf
+        self.args = args
+        self.log = log
+        self.multi = bool(getattr(trf, "policy_sets", None))
+        self.compress = None
+        if args.compress:
+            self.compress = {"codec": args.compress, "level": args.compress_level,
+                             "block_size": args.block_size,
+                             "threads": args.compress_threads,
+                             "index": args.compress_index}
+
+    def _csv_output(self, outfile: str) -> bool:
+        """
+        Check if the output is written as CSV
+        """
+        fmt = self.args.output_format
+        return fmt == "csv" or \
+            (fmt is None and base_extension(strip_codec(outfile)) == ".csv")
+
+    def _plan(self, job: SimpleNamespace):
+        """
+        Decide how to process a job. With a memory budget, switch to
+        streaming if its estimated size does not fit in the available budget,
+        and reserve memory for it (waiting if needed): its full size, or only
+        its working memory for streamed documents
+        """
+        job.stream_doc, job.stream_pii = self.args.stream_doc, self.args.stream_pii
+        job.reserved = 0
+        job.written = False
+        job.textfile = self.args.text_fast_path
+        if not job.textfile and \
+           os.path.splitext(job.infile)[1] in (".txt", ".text"):
+            raise InvArgException("plain text input needs --text-fast-path (and a single-chunk PII collection): {}",
+                                  job.infile)
+        if self.multi:
+            if "{name}" not in job.outfile:
+                raise InvArgException("output file name needs a {{name}} field for policy sets: {}",
+                                      job.outfile)
+            if job.textfile or job.stream_doc:
+                raise InvArgException("policy sets cannot be used with plain text input or document streaming: {}",
+                                      job.infile)
+        job.csv = base_extension(job.infile) == ".csv"
+        streaming = hasattr(self.trf, "iter_transform")
+        if job.csv and streaming and not self.multi and \
+           self._csv_output(job.outfile):
+            # CSV to CSV: a single pass, one row at a time
+            job.stream_doc = True
+        if job.stream_doc and not streaming:
+            raise InvArgException("document streaming is not available for a transform server: {}",
+                                  job.infile)
+        if job.textfile:
+            # Plain text fast path: constant memory, no need for a budget
+            if not hasattr(self.trf, "transform_textfile") or \
+               self.args.stream_pii or self.args.shard_mode or \
+               self.args.output_format == "patch":
+                raise InvArgException("plain text input cannot be used with a server, PII streaming, sharding or patch output: {}",
+                                      job.infile)
+            return
+        budget = getattr(self.trf, "budget", None)
+        if budget is None:
+            return
+        doc_size, pii_size = (os.path.getsize(f) * MEMORY_EXPANSION
+                              if os.path.isfile(f) else 0
+                              for f in (job.infile, job.pii))
+        size = doc_size + pii_size
+        if size > budget.available():
+            if not job.stream_doc and not self.multi and \
+               self.args.output_format != "txt":
+                self.log(". Switching to streaming for:", job.infile)
+                job.stream_doc = True
+            if base_extension(job.pii) in (".ndjson", ".jsonl"):
+                job.stream_pii = True
+        if job.stream_doc:
+            # Only the chunks in flight and the PII collection (if it is not
+            # streamed too) are held in memory
+            size = STREAM_MEMORY + (0 if job.stream_pii else pii_size)
+        budget.acquire(size)
+        job.reserved = size
+
+    def load(self, job: SimpleNamespace) -> SimpleNamespace:
+        self._plan(job)
+        if job.textfile:
+            job.doc = None
+        elif job.csv:
+            self.log(". Reading CSV document:", job.infile)
+            job.doc = load_csv(job.infile, header=not self.args.csv_no_header,
+                               delimiter=self.args.csv_delimiter)
+        elif job.stream_doc:
+            self.log(". Streaming document:", job.infile)
+            job.doc = StreamSrcDocumentFile(job.infile)
+        else:
+            self.log(". Loading document:", job.infile)
+            job.doc = LocalSrcDocumentFile(job.infile)
+        if job.stream_pii:
+            self.log(". Streaming Pii collection:", job.pii)
+            job.piic = PiiStreamReader(job.pii, spill=self.args.pii_spill)
+        else:
+            self.log(". Loading Pii collection:", job.pii)
+            job.piic = load_pii(job.pii)
+        return job
+
+    def transform(self, job: SimpleNamespace) -> SimpleNamespace:
+        self.log(". Processing:", job.infile)
+        if job.textfile:
+            self.transform_textfile(job)
+            return job
+        elif job.stream_doc:
+            # Chunks are transformed as the output is written
+            job.result = job.doc.metadata, \
+                self.trf.iter_transform(job.doc, job.piic, lazy=True)
+            if self.args.pipeline:
+                # Write in this stage, so that the transformer is not used by
+                # the write stage at the same time as by the next job
+                self._write(job)
+                job.written = True
+            return job
+        try:
+            if self.multi:
+                job.result = self.trf.transform_multi(job.doc, job.piic,
+                                                      lazy=True)
+            else:
+                job.result = self.trf(job.doc, job.piic, lazy=True)
+        finally:
+            if isinstance(job.piic, PiiStreamReader):
+                job.piic.close()
+        job.doc = job.piic = None
+        return job
+
+    def transform_textfile(self, job: SimpleNamespace):
+        """
+        Transform a plain text file, writing the output directly
+        """
+        self.log(". Writing to:", job.outfile)
+        with open_compressed(job.outfile, self.compress, binary=True) as out:
+            # The input file name is the document id in the vault
+            self.trf.transform_textfile(job.infile, job.piic, out,
+                                        byte_offsets=self.args.byte_offsets,
+                                        docid=job.infile)
+        job.piic = None
+
+    def write(self, job: SimpleNamespace) -> SimpleNamespace:
+        if job.textfile or job.written:
+            return job
+        self._write(job)
+        return job
+
+    def _write(self, job: SimpleNamespace):
+        """
+        Write the job output, and release its resources
+        """
+        try:
+            if self.multi:
+                for name, result in job.result.items():
+                    self.write_output(policy_set_output(job.outfile, name),
+                                      result, job.stream_doc)
+            else:
+                self.write_output(job.outfile, job.result, job.stream_doc)
+        finally:
+            if isinstance(job.piic, PiiStreamReader):
+                job.piic.close()
+            if job.reserved:
+                self.trf.budget.release(job.reserved)
+        job.doc = job.piic = job.result = None
+
+    def write_output(self, outfile: str, result, stream_doc: bool):
+        """
+        Write an output document
+        """
+        self.log(". Dumping to:", outfile)
+        if self.args.output_format == "patch":
+            metadata, chunks = result if stream_doc else \
+                (result.metadata, result.iter_full())
+            num = write_patch(outfile, metadata, chunks, compress=self.compress)
+            self.log(". Modified chunks:", num)
+        elif self.args.shard_mode:
+            self.write_shards(outfile, result, stream_doc)
+        elif self._csv_output(outfile):
+            metadata, chunks = result if stream_doc else \
+                (result.metadata, result.iter_full())
+            write_csv_stream(outfile, metadata, chunks,
+                             header=not self.args.csv_no_header,
+                             delimiter=self.args.csv_delimiter,
+                             compress=self.compress)
+        elif stream_doc:
+            write_stream(outfile, *result, format=self.args.output_format,
+                         compress=self.compress)
+        else:
+            out = DocumentWriter(result)
+            out.dump(outfile, format=self.args.output_format,
+                     compress=self.compress)
+
+    def write_shards(self, outfile: str, result, stream_doc: bool):
+        """
+        Write the output document as a set of shards
+        """
+        if stream_doc:
+            metadata, chunks = result
+        else:
+            metadata, chunks = result.metadata, result.iter_full()
+        args = self.args
+        manifest = write_shards(outfile, metadata, chunks,
+                                mode=args.shard_mode, limit=args.shard_limit,
+                                shards=args.shards, key=args.shard_key,
+                                format=args.output_format,
+                                compress=self.compress)
+        self.log(". Shards written:", len(manifest["shards"]))
+
+    def __call__(self, jobs: Iterable[SimpleNamespace]) -> Iterable[SimpleNamespace]:
+        """
+        Run all jobs, either sequentially or as a pipeline (in which the
+        loading, transforming & writing stages run concurrently). Since the
+        transformer is used by one stage only, streamed documents are
+        transformed and written in the transforming stage
+        """
+        if self.args.pipeline:
+            pipe = Pipeline(self.load, self.transform, self.write,
+                            queue_size=self.args.queue_size)
+            return pipe(jobs)
+        else:
+            return (self.write(self.transform(self.load(job))) for job in jobs)
@@ -0,0 +1,70 @@
+"""
+Command-line script to convert PII collections between the text formats
+(JSON, NDJSON, YAML) and the compact binary format (`.piib`)
+"""
+
+import sys
+import argparse
+
+from typing import List
+
+from pii_data.helper.io import openfile, base_extension
+
+from .. import VERSION
+from ..helper.piibin import load_pii, dump_binary, PiiBinaryCollection
+
+
+def convert(infile: str, outfile: str, verbose: bool = False):
+    """
+    Convert a PII collection file. The output format is decided by the
+    output file extension: `.piib` for binary, `.ndjson`/`.jsonl` or `.json`
+    """
+    piic = load_pii(infile)
+    if verbose:
+        print(f". Loaded {len(piic)} PII instances from: {infile}",
+              file=sys.stderr)
+    ext = base_extension(outfile)
+    if ext == ".piib":
+        dump_binary(piic, outfile)
+    else:
+        if isinstance(piic, PiiBinaryCollection):
+            piic = piic.to_collection()
+        fmt = "json" if ext == ".json" else "ndjson"
+        with openfile(outfile, "wt", encoding="utf-8") as out:
+            piic.dump(out, format=fmt)
+    if verbose:
+        print(". Written:", outfile, file=sys.stderr)
+
+
+def parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="pii-transform convert-pii",
+        description=f"Convert PII collection files (v. {VERSION})")
+
+    parser.add_argument("infile", help="input PII collection")
+    parser.add_argument("outfile",
+                        help="output PII collection (format is decided by the extension: .piib, .json or .ndjson)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print progress messages")
+    parser.add_argument('--reraise', action='store_true',
+                        help='re-raise exceptions on errors')
+
+    return parser.parse_args(args)
+
+
+def main(args: List[str] = None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_args(args)
+    try:
+        convert(args.infile, args.outfile, args.verbose)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        if args.reraise:
+            raise
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
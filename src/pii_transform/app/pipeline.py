@@ -0,0 +1,120 @@
+"""
+Run a sequence of processing stages as a pipeline: each stage runs in its own
+thread, and stages are connected by bounded queues, so that all of them can
+work at the same time on consecutive items
+"""
+
+import threading
+from queue import Queue
+
+from typing import Callable, Iterable, Iterator, Any
+
+
+# Default size of the queues between stages
+DEFAULT_QUEUE_SIZE = 2
+
+# End-of-stream marker
+_END = object()
+
+
+class _Failure:
+    """
+    An exception raised in a stage, to be passed down the pipeline
+    """
+    __slots__ = "exc",
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class Pipeline:
+
+    def __init__(self, *stages: Callable, queue_size: int = None):
+        """
+         :param stages: the processing stages. Each one is a callable that
+           receives the item produced by the previous stage, and returns the
+           item for the next one
+         :param queue_size: maximum number of pending items between two
+           consecutive stages
+        """
+        self.stages = stages
+        self.queue_size = queue_size or DEFAULT_QUEUE_SIZE
+
+
+    def __repr__(self) -> str:
+        return f"<Pipeline #{len(self.stages)}>"
+
+
+    @staticmethod
+    def _feed(items: Iterable[Any], qout: Queue, stop: threading.Event):
+        """
+        Push the input items into the first queue
+        """
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                qout.put(item)
+        except BaseException as e:
+            qout.put(_Failure(e))
+        qout.put(_END)
+
+
+    @staticmethod
+    def _work(func: Callable, qin: Queue, qout: Queue):
+        """
+        Execute one stage: take items from the input queue, process them and
+        push the results to the output queue. After an error, keep draining
+        the input queue so that upstream stages do not block
+        """
+        failed = False
+        while True:
+            item = qin.get()
+            if item is _END:
+                qout.put(_END)
+                return
+            elif failed:
+                continue
+            elif isinstance(item, _Failure):
+                failed = True
+                qout.put(item)
+                continue
+            try:
+                qout.put(func(item))
+            except BaseException as e:
+                failed = True
+                qout.put(_Failure(e))
+
+
+    def __call__(self, items: Iterable[Any]) -> Iterator[Any]:
+        """
+        Process a sequence of items through the pipeline
+         :return: an iterator over the results of the last stage, in the same
+           order as the input items
+        """
+        # The last queue is unbounded, so that stages never block if the
+        # consumer stops reading results
+        queues = [Queue(self.queue_size) for _ in range(len(self.stages))]
+        queues.append(Queue())
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._feed, daemon=True,
+                                    args=(items, queues[0], stop))]
+        threads += [threading.Thread(target=self._work, daemon=True,
+                                     args=(func, queues[n], queues[n+1]))
+                    for n, func in enumerate(self.stages)]
+        for t in threads:
+            t.start()
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _END:
+                    break
+                elif isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            stop.set()
+
+        for t in threads:
+            t.join()
@@ -0,0 +1,458 @@
+"""
+A long-running local transform server: it keeps a pool of warm PiiTransformer
+objects (one per policy configuration) and transforms documents sent to it as
+JSON payloads, over HTTP on a local TCP port or on a Unix socket.
+
+Endpoints:
+ * `POST /transform`: transform one document. Payload fields are `document`
+   (a Source Document, as a dict), `pii` (a PII Collection, as a dict) and
+   optionally `policy` (default policy) and `config` (a PIISA configuration
+   dict, added to the server configuration). Requests can only set the
+   policy-related fields in REQUEST_CONFIG_FIELDS, and cannot use policies
+   that access server files
+ * `POST /transform/batch`: transform a list of documents, given in the
+   `items` field (each one with `document` & `pii` fields) with the same
+   policy & configuration, in a single request
+ * `GET /health`: server status
+ * `GET /metrics`: server & transformer statistics
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+from typing import Dict, List, Tuple, Union, Iterator
+
+from pii_data.helper.exception import PiiDataException, InvArgException
+
+from .. import VERSION, defs
+from ..helper.substitution import POLICIES
+from ..helper.io import doc_fromdict, doc_todict, piic_fromdict
+from ..api import PiiTransformer
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Maximum number of warm transformers to keep
+DEFAULT_POOL_SIZE = 8
+
+# Transform configuration fields that a request can set
+REQUEST_CONFIG_FIELDS = ("policy", "default_policy", "reset", "seed",
+                         "deterministic_key", "synthetic_engine", "overlap",
+                         "memo", "iban")
+
+# Configuration sections that a request can set
+REQUEST_CONFIG_SECTIONS = (defs.FMT_CONFIG_TRANSFORM,
+                           defs.FMT_CONFIG_PLACEHOLDER)
+
+# Policy parameters that a request can set (the dictionary policy is not
+# available, since it reads a server file)
+REQUEST_POLICY_FIELDS = ("name", "key", "size", "template", "engine")
+
+
+class NotFound(Exception):
+    """
+    An unknown endpoint
+    """
+    pass
+
+
+def check_request_policy(policy: Union[str, Dict, None]):
+    """
+    Check that a policy sent in a request uses only allowed fields
+    """
+    if policy is None:
+        return
+    name = policy.get("name") if isinstance(policy, dict) else policy
+    if name not in POLICIES or name == "dictionary":
+        raise InvArgException("policy not allowed in a request: {}", name)
+    if isinstance(policy, dict):
+        extra = set(policy) - set(REQUEST_POLICY_FIELDS)
+        if extra:
+            raise InvArgException("policy fields not allowed in a request: {}",
+                                  ", ".join(sorted(extra)))
+
+
+def check_request_config(config: Union[Dict, None]):
+    """
+    Check that a configuration sent in a request contains only the allowed
+    sections & fields (so that clients cannot make the server read or write
+    arbitrary files)
+    """
+    if config is None:
+        return
+    if not isinstance(config, dict):
+        raise InvArgException("invalid request config: not a dict")
+    for section, value in config.items():
+        if section not in REQUEST_CONFIG_SECTIONS:
+            raise InvArgException("config section not allowed in a request: {}",
+                                  section)
+        if not isinstance(value, dict):
+            raise InvArgException("invalid request config section: {}", section)
+    cfg = config.get(defs.FMT_CONFIG_TRANSFORM) or {}
+    extra = set(cfg) - set(REQUEST_CONFIG_FIELDS)
+    if extra:
+        raise InvArgException("config fields not allowed in a request: {}",
+                              ", ".join(sorted(extra)))
+    check_request_policy(cfg.get("default_policy"))
+    policy = cfg.get("policy") or {}
+    if not isinstance(policy, dict):
+        raise InvArgException("invalid request config: policy is not a dict")
+    for p in policy.values():
+        check_request_policy(p)
+
+
+class _PoolEntry:
+    """
+    A transformer in the pool, with the lock that serialises its use and the
+    number of requests using it
+    """
+    __slots__ = "trf", "lock", "users", "evicted"
+
+    def __init__(self, trf: PiiTransformer):
+        self.trf = trf
+        self.lock = threading.Lock()
+        self.users = 0
+        self.evicted = False
+
+
+class TransformerPool:
+    """
+    A pool of PiiTransformer objects, indexed by policy configuration. The
+    least recently used one is dropped when the pool is full; it is closed
+    when the last request using it finishes.
+    """
+
+    def __init__(self, config: List = None, default_policy: Union[str, Dict] = None,
+                 size: int = None):
+        """
+         :param config: base configuration for all transformers
+         :param default_policy: default policy, for requests that do not
+           specify one
+         :param size: maximum number of transformers in the pool
+        """
+        self._config = list(config or [])
+        self._policy = default_policy
+        self._size = size or DEFAULT_POOL_SIZE
+        self._pool = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def __len__(self) -> int:
+        return len(self._pool)
+
+
+    def _acquire(self, policy: Union[str, Dict],
+                 config: Dict) -> _PoolEntry:
+        """
+        Get the pool entry for a policy & configuration (creating it if
+        needed), and register a new user for it
+        """
+        if policy is None:
+            policy = self._policy
+        key = json.dumps([policy, config], sort_keys=True)
+        idle = None
+        with self._lock:
+            entry = self._pool.get(key)
+            if entry is not None:
+                self._pool.move_to_end(key)
+            else:
+                cfg = self._config + [config] if config else self._config
+                entry = _PoolEntry(PiiTransformer(default_policy=policy,
+                                                  config=cfg or None))
+                self._pool[key] = entry
+                if len(self._pool) > self._size:
+                    _, dropped = self._pool.popitem(last=False)
+                    dropped.evicted = True
+                    if not dropped.users:
+                        idle = dropped
+            entry.users += 1
+        # Close outside the pool lock (it may flush a vault)
+        if idle is not None:
+            idle.trf.close()
+        return entry
+
+
+    def _release(self, entry: _PoolEntry):
+        """
+        Unregister a user of a pool entry, closing its transformer if it was
+        the last user of an evicted entry
+        """
+        with self._lock:
+            entry.users -= 1
+            done = entry.evicted and not entry.users
+        if done:
+            entry.trf.close()
+
+
+    @contextmanager
+    def use(self, policy: Union[str, Dict] = None,
+            config: Dict = None) -> Iterator[Tuple[PiiTransformer, threading.Lock]]:
+        """
+        Use the transformer for a policy & configuration (creating it if
+        needed). It is not closed while in use, even if it gets evicted
+         :return: a context manager producing the transformer, together with
+           the lock that serialises its use
+        """
+        entry = self._acquire(policy, config)
+        try:
+            yield entry.trf, entry.lock
+        finally:
+            self._release(entry)
+
+
+    def stats(self) -> List[Dict]:
+        """
+        Return the statistics for all transformers in the pool
+        """
+        with self._lock:
+            return [{"key": k, **e.trf.stats(),
+                     "metrics": e.trf.metrics.to_json()}
+                    for k, e in self._pool.items()]
+
+
+    def close(self):
+        """
+        Close all transformers (the ones in use are closed when their last
+        request finishes)
+        """
+        with self._lock:
+            entries = list(self._pool.values())
+            self._pool.clear()
+            for entry in entries:
+                entry.evicted = True
+            idle = [e for e in entries if not e.users]
+        for entry in idle:
+            entry.trf.close()
+
+
+class TransformService:
+    """
+    Process server requests, independently of the transport
+    """
+
+    def __init__(self, pool: TransformerPool):
+        self.pool = pool
+        self._start = time.time()
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+
+    def _count(self, **kwargs):
+        with self._lock:
+            self._counters.update(kwargs)
+
+
+    def transform_batch(self, request: Dict) -> Dict:
+        """
+        Transform a list of documents, all of them with the same transformer
+        """
+        try:
+            items = [(doc_fromdict(it["document"], "request"),
+                      piic_fromdict(it["pii"], "request"))
+                     for it in request["items"]]
+        except (KeyError, TypeError) as e:
+            raise InvArgException("invalid request: missing field {}", e) from e
+        check_request_policy(request.get("policy"))
+        check_request_config(request.get("config"))
+
+        start = time.perf_counter()
+        policy, config = request.get("policy"), request.get("config")
+        with self.pool.use(policy, config) as (trf, lock):
+            with lock:
+                result = [doc_todict(trf(doc, piic, lazy=True))
+                          for doc, piic in items]
+        self._count(documents=len(items),
+                    transform_time=time.perf_counter() - start)
+        return {"documents": result}
+
+
+    def transform(self, request: Dict) -> Dict:
+        """
+        Transform a single document
+        """
+        batch = {**request, "items": [request]}
+        return {"document": self.transform_batch(batch)["documents"][0]}
+
+
+    def health(self) -> Dict:
+        return {"status": "ok", "version": VERSION,
+                "uptime": time.time() - self._start,
+                "transformers": len(self.pool)}
+
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+        return {"server": counters, "transformers": self.pool.stats()}
+
+
+    def __call__(self, method: str, path: str, request: Dict = None) -> Dict:
+        """
+        Dispatch a request
+         :return: the response payload
+        """
+        self._count(**{"requests " + path: 1})
+        if method == "POST" and not isinstance(request, dict):
+            raise InvArgException("invalid request: the body must be a JSON object")
+        if method == "GET" and path == "/health":
+            return self.health()
+        elif method == "GET" and path == "/metrics":
+            return self.metrics()
+        elif method == "POST" and path == "/transform":
+            return self.transform(request)
+        elif method == "POST" and path == "/transform/batch":
+            return self.transform_batch(request)
+        raise NotFound(path)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handle HTTP requests, passing them to the transform service
+    """
+
+    def address_string(self) -> str:
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "local"
+
+
+    def log_message(self, format: str, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+    def _reply(self, code: int, data: Dict):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _process(self, method: str):
+        service = self.server.service
+        try:
+            request = None
+            if method == "POST":
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+            self._reply(200, service(method, self.path, request))
+        except NotFound:
+            self._reply(404, {"error": f"not found: {self.path}"})
+        except (PiiDataException, ValueError) as e:
+            service._count(errors=1)
+            self._reply(400, {"error": str(e)})
+        except Exception as e:
+            service._count(errors=1)
+            self._reply(500, {"error": f"{e.__class__.__name__}: {e}"})
+
+
+    def do_GET(self):
+        self._process("GET")
+
+
+    def do_POST(self):
+        self._process("POST")
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service: TransformService, host: str = None, port: int = None,
+                socket: str = None, verbose: bool = False):
+    """
+    Create the HTTP server, either on a TCP port or on a Unix socket
+    """
+    if socket:
+        server = ThreadingUnixHTTPServer(socket, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host or DEFAULT_HOST,
+                                      DEFAULT_PORT if port is None else port),
+                                     RequestHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+# --------------------------------------------------------------------------
+
+
+def process(args: argparse.Namespace):
+
+    if args.hash_key and args.default_policy == "hash":
+        args.default_policy = {"name": "hash", "key": args.hash_key}
+    pool = TransformerPool(args.config, args.default_policy, args.pool_size)
+
+    # Warm up the default transformer
+    with pool.use():
+        pass
+
+    server = make_server(TransformService(pool), args.host, args.port,
+                         args.socket, args.verbose)
+    where = args.socket or "{}:{}".format(*server.server_address[:2])
+    print(f". pii-transform server v. {VERSION} listening on {where}",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+
+def parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="pii-transform serve",
+        description=f"Run a local PII transform server (v. {VERSION})")
+
+    g0 = parser.add_argument_group("Endpoint")
+    g0.add_argument("--host", default=DEFAULT_HOST, help="host address to bind")
+    g0.add_argument("--port", type=int, default=DEFAULT_PORT,
+                    help="TCP port to listen on")
+    g0.add_argument("--socket", help="listen on this Unix socket instead")
+
+    g2 = parser.add_argument_group("Processing options")
+    g2.add_argument("--default-policy", choices=POLICIES,
+                    help="Default policy, for requests not specifying one")
+    g2.add_argument("--config", nargs="+",
+                    help="Configuration file for policies and/or placeholder")
+    g2.add_argument("--hash-key",
+                    help="key value for the hash policy")
+    g2.add_argument("--pool-size", type=int,
+                    help="maximum number of warm transformers to keep")
+
+    g3 = parser.add_argument_group("Other")
+    g3.add_argument("-v", "--verbose", action="store_true",
+                    help="log all requests")
+    g3.add_argument('--reraise', action='store_true',
+                    help='re-raise exceptions on errors')
+
+    return parser.parse_args(args)
+
+
+def main(args: List[str] = None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_args(args)
+    try:
+        process(args)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        if args.reraise:
+            raise
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
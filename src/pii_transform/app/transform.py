@@ -3,28 +3,75 @@ Command-line script to process data and perform PII substitutions
 """
 
 import sys
+import time
 import argparse
+import importlib
+from types import SimpleNamespace
 
-from typing import List
+from typing import List, Dict
 
-from pii_data.types.piicollection import PiiCollectionLoader
-from pii_data.types.doc import LocalSrcDocumentFile
+from pii_data.helper.exception import InvArgException
 
-from .. import VERSION
+from .. import VERSION, defs
 from ..helper.substitution import POLICIES
-from ..api import PiiTransformer
-from ..out import DocumentWriter
+from ..helper.memory import MemoryBudget, format_size
+from ..api import PiiTransformer, format_policy
+from ..out.shard import SHARD_MODES
+from ..out.compress import CODECS
+from .client import RemoteTransformer
+from .corpus import load_plan, shard_jobs, parse_shard, write_result
+from .checkpoint import Checkpoint
+from .jobs import Log, JobStages, read_batch
 
-class Log:
+# Subcommands, as the module & function implementing them
+SUBCOMMANDS = {
+    "serve": ("server", "main"),
+    "apply-patch": ("applypatch", "main"),
+    "build-dict": ("builddict", "main"),
+    "convert-pii": ("piiconvert", "main"),
+    "plan": ("corpus", "plan_main"),
+    "run": ("corpus", "run_main"),
+    "merge": ("corpus", "merge_main"),
+}
+
+
+def print_stats(stats: Dict):
     """
-    A very simple class to conditionally log messages to console_scripts
+    Print out processing statistics
     """
-    def __init__(self, verbose: bool):
-        self._v = verbose
+    print(". Statistics:", file=sys.stderr)
+    for k, v in stats.items():
+        if isinstance(v, float):
+            v = f"{v:.3f}"
+        print(f"  {k:>16}: {v}", file=sys.stderr)
+
+
+def print_slow_chunk(record: Dict):
+    """
+    Print out a slow chunk record
+    """
+    print(". Slow chunk: doc={docid} chunk={chunk} entities={entities} time={seconds:.3f}s".format(**record),
+          file=sys.stderr)
+
 
-    def __call__(self, msg: str, *args):
-        if self._v:
-            print(msg, *args, file=sys.stderr)
+def parse_policy_sets(values: List[str], hash_key: str = None) -> Dict:
+    """
+    Parse policy set definitions, as `name=policy` or `name=policy:param`
+    (where the parameter is the hash key, the dictionary file or the custom
+    template; for the hash policy the key can also come from `--hash-key`)
+    """
+    out = {}
+    for value in values:
+        name, sep, policy = value.partition("=")
+        if not sep or not name or not policy:
+            raise InvArgException("invalid policy set: {}", value)
+        policy, _, param = policy.partition(":")
+        if policy not in POLICIES:
+            raise InvArgException("unsupported policy in policy set: {}", value)
+        if not param and policy == "hash":
+            param = hash_key
+        out[name] = format_policy(policy, param or None)
+    return out
 
 
 def process(args: argparse.Namespace):
@@ -33,34 +80,148 @@ def process(args: argparse.Namespace):
 
     if args.hash_key and args.default_policy == "hash":
         args.default_policy = {"name": "hash", "key": args.hash_key}
+    elif args.default_policy == "dictionary":
+        if not args.dictionary:
+            raise InvArgException("the dictionary policy needs --dictionary")
+        args.default_policy = format_policy("dictionary", args.dictionary)
     if args.config:
         log(". Using config:", args.config)
-    trf = PiiTransformer(default_policy=args.default_policy, config=args.config)
+    config = list(args.config or [])
+    if args.deterministic_key:
+        config.append({defs.FMT_CONFIG_TRANSFORM:
+                       {"deterministic_key": args.deterministic_key}})
+    if args.vault:
+        log(". Recording substitutions in vault:", args.vault)
+        config.append({defs.FMT_CONFIG_TRANSFORM: {"vault": args.vault}})
+    if args.slow_chunk is not None:
+        config.append({defs.FMT_CONFIG_TRANSFORM:
+                       {"slow_chunk": args.slow_chunk}})
+    if args.output_format == "jsonl" and not (args.stream_doc or args.shard_mode):
+        raise InvArgException("JSON Lines output is only available with --stream-doc or --shard-mode")
+    if args.output_format == "patch" and args.shard_mode:
+        raise InvArgException("patch output cannot be sharded")
+    if args.server:
+        if args.stream_pii or args.stream_doc or args.memory_budget:
+            raise InvArgException("streaming & memory budgets are not available for a transform server")
+        if args.policy_set:
+            raise InvArgException("policy sets are not available for a transform server")
+        if args.metrics_file or args.slow_chunk is not None:
+            raise InvArgException("metrics are not available for a transform server (use its /metrics endpoint)")
+        log(". Using transform server:", args.server)
+        trf = RemoteTransformer(args.server, args.default_policy, config)
+    else:
+        budget = None
+        if args.memory_budget:
+            budget = MemoryBudget(args.memory_budget)
+            log(". Memory budget:", format_size(budget.limit))
+        policy_sets = None
+        if args.policy_set:
+            policy_sets = parse_policy_sets(args.policy_set, args.hash_key)
+            log(". Policy sets:", ", ".join(policy_sets))
+        trf = PiiTransformer(default_policy=args.default_policy, config=config,
+                             budget=budget, policy_sets=policy_sets)
+        if trf.policy_sets and (args.vault or args.checkpoint):
+            raise InvArgException("policy sets cannot be used with a vault or checkpoints")
+        trf.metrics.log = print_slow_chunk
 
-    log(". Loading document:", args.infile)
-    doc = LocalSrcDocumentFile(args.infile)
+    # Define the list of jobs to do
+    started = time.time()
+    if args.plan:
+        if not args.shard:
+            raise InvArgException("running a plan needs a shard (--shard i/N)")
+        shard = parse_shard(args.shard)
+        log(". Running shard {}/{} of plan:".format(*shard), args.plan)
+        jobs = shard_jobs(load_plan(args.plan), *shard)
+    elif args.batch:
+        log(". Reading batch file:", args.batch)
+        jobs = read_batch(args.batch)
+    elif args.infile and args.pii and args.outfile:
+        jobs = [SimpleNamespace(infile=args.infile, pii=args.pii,
+                                outfile=args.outfile)]
+    else:
+        raise InvArgException("either a batch file or input, pii & output files are needed")
 
-    log(". Loading Pii collection:", args.pii)
-    pii = PiiCollectionLoader()
-    pii.load(args.pii)
+    # Skip the jobs already done in a previous run
+    checkpoint = None
+    if args.checkpoint:
+        if args.server:
+            raise InvArgException("checkpoints are not available for a transform server")
+        if args.pipeline:
+            # The transform stage would run ahead of the journal, so the
+            # snapshots would contain state from unrecorded documents
+            raise InvArgException("checkpoints cannot be used with pipeline execution")
+        checkpoint = Checkpoint(args.checkpoint, args.checkpoint_interval,
+                                args.resume)
+        if checkpoint.restore(trf):
+            log(". Restored substitution state from:", args.checkpoint)
+        pending = checkpoint.pending(jobs)
+        if len(pending) < len(jobs):
+            log(". Skipping completed documents:", len(jobs) - len(pending))
+        jobs = pending
+    elif args.resume:
+        raise InvArgException("resuming needs a checkpoint directory")
 
-    log(". Processing")
-    res = trf(doc, pii)
-
-    log(". Dumping to:", args.outfile)
-    out = DocumentWriter(res)
-    out.dump(args.outfile, format=args.output_format)
+    # Process them
+    last_dump = time.time()
+    try:
+        for job in JobStages(trf, args, log)(jobs):
+            if checkpoint:
+                checkpoint.add(job, trf)
+            if args.metrics_file and args.metrics_interval and \
+               time.time() - last_dump >= args.metrics_interval:
+                trf.dump_metrics(args.metrics_file)
+                last_dump = time.time()
+        if checkpoint:
+            checkpoint.close(trf)
+            checkpoint = None
+    finally:
+        if checkpoint:
+            checkpoint.close()
+        trf.close()
+        if args.metrics_file:
+            trf.dump_metrics(args.metrics_file)
+            log(". Metrics written to:", args.metrics_file)
 
+    budget = getattr(trf, "budget", None)
+    if budget is not None:
+        stats = budget.stats()
+        log(". Memory peak: {} of {}".format(format_size(stats["memory_peak"]),
+                                            format_size(budget.limit)))
+    if args.plan:
+        name = write_result(args.plan, *shard, jobs, trf.stats(), started)
+        log(". Shard result:", name)
+    if args.show_stats:
+        print_stats(trf.stats())
 
 
-def parse_args(args: List[str]) -> argparse.Namespace:
+def parse_args(args: List[str], prog: str = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
-        description=f"Transform detected PII instances in a document (version {VERSION})")
+        prog=prog,
+        description=f"Transform detected PII instances in a document (version {VERSION})",
+        epilog="Subcommands: {}. To use an input file with the name of a subcommand, precede it with '--' or give it as a path (e.g. './run')".format(", ".join(SUBCOMMANDS)))
 
     g0 = parser.add_argument_group("Input/output paths")
-    g0.add_argument("infile", help="source document file (YAML)")
-    g0.add_argument("pii", help="detected PII instances (YAML, JSON)")
-    g0.add_argument("outfile", help="destination document file")
+    g0.add_argument("infile", nargs="?",
+                    help="source document file (YAML, or plain text)")
+    g0.add_argument("pii", nargs="?",
+                    help="detected PII instances (YAML, JSON)")
+    g0.add_argument("outfile", nargs="?", help="destination document file")
+    g0.add_argument("--batch",
+                    help="process a batch of documents: a file with one line per document, containing source document, PII collection and destination file")
+
+    g6 = parser.add_argument_group("Corpus runs (pii-transform run)")
+    g6.add_argument("--plan",
+                    help="process the documents in a shard of a plan (created with 'pii-transform plan')")
+    g6.add_argument("--shard",
+                    help="the shard to process, as i/N (i starts at 0)")
+
+    g7 = parser.add_argument_group("Checkpointing")
+    g7.add_argument("--checkpoint",
+                    help="checkpoint directory: record completed documents and snapshot the substitution state")
+    g7.add_argument("--checkpoint-interval", type=int,
+                    help="number of completed documents between state snapshots")
+    g7.add_argument("--resume", action="store_true",
+                    help="resume a previous run from its checkpoint, skipping completed documents")
 
     g2 = parser.add_argument_group("Processing options")
     g2.add_argument("--default-policy", choices=POLICIES,
@@ -69,8 +230,70 @@ def parse_args(args: List[str]) -> argparse.Namespace:
                     help="Configuration file for policies and/or placeholder")
     g2.add_argument("--hash-key",
                     help="key value for the hash policy")
-    g2.add_argument("--output-format", "-of", choices=("txt", "yaml", "csv"),
-                    help="output format")
+    g2.add_argument("--dictionary",
+                    help="dictionary index file for the dictionary policy (built with `pii-transform build-dict`)")
+    g2.add_argument("--policy-set", action="append", metavar="NAME=POLICY",
+                    help="produce one output per policy set, in a single pass (can be repeated; use NAME=POLICY:PARAM for hash keys, dictionary files or custom templates). The output file name must contain {name}")
+    g2.add_argument("--deterministic-key",
+                    help="key for deterministic placeholder & synthetic assignments")
+    g2.add_argument("--vault",
+                    help="record all substitutions in this vault directory (to allow detransformation)")
+    g2.add_argument("--text-fast-path", action="store_true",
+                    help="process input files as plain text through the memory-mapped fast path (the PII collection must have a single chunk, with positions relative to the start of the file)")
+    g2.add_argument("--byte-offsets", action="store_true",
+                    help="for the plain text fast path, PII positions are byte offsets (instead of character offsets)")
+    g2.add_argument("--csv-delimiter",
+                    help="field delimiter for CSV input & streamed CSV output (default is a comma)")
+    g2.add_argument("--csv-no-header", action="store_true",
+                    help="CSV input has no header row with column names")
+    g2.add_argument("--output-format", "-of",
+                    choices=("txt", "yaml", "csv", "jsonl", "patch"),
+                    help="output format ('patch' writes only the edits, to be applied with 'pii-transform apply-patch')")
+
+    g4 = parser.add_argument_group("Sharded output")
+    g4.add_argument("--shard-mode", choices=SHARD_MODES,
+                    help="write the output as a set of shards (plus a manifest), split by number of rows, text size, or key hash")
+    g4.add_argument("--shard-limit", type=int,
+                    help="for rows & size sharding, maximum number of rows (top-level chunks) or characters per shard")
+    g4.add_argument("--shards", type=int,
+                    help="for hash sharding, number of shards")
+    g4.add_argument("--shard-key",
+                    help="for hash sharding, chunk context field to hash (default is the chunk id)")
+
+    g5 = parser.add_argument_group("Compressed output")
+    g5.add_argument("--compress", choices=CODECS,
+                    help="compress the output in independent blocks, on a thread pool")
+    g5.add_argument("--compress-level", type=int, help="compression level")
+    g5.add_argument("--block-size", type=int,
+                    help="uncompressed size of each compressed block, in bytes")
+    g5.add_argument("--compress-threads", type=int,
+                    help="number of compression threads")
+    g5.add_argument("--compress-index", action="store_true",
+                    help="write a block index (<outfile>.idx) to allow reading from the middle of the file")
+
+    g1 = parser.add_argument_group("Execution options")
+    g1.add_argument("--stream-doc", action="store_true",
+                    help="read the source document (YAML or JSON Lines) and write the output incrementally, chunk by chunk")
+    g1.add_argument("--stream-pii", action="store_true",
+                    help="read the PII collection (NDJSON) as a stream, in lockstep with the document chunks")
+    g1.add_argument("--pii-spill", type=int,
+                    help="for PII streaming, maximum number of out-of-order entities to hold (default is 0: entities must be in document order)")
+    g1.add_argument("--pipeline", action="store_true",
+                    help="overlap reading, transforming and writing of consecutive documents")
+    g1.add_argument("--queue-size", type=int,
+                    help="for pipeline execution, maximum number of pending documents between stages")
+    g1.add_argument("--memory-budget",
+                    help="memory budget (e.g. 2G): apply backpressure, shrink caches or switch to streaming to keep within it")
+    g1.add_argument("--server",
+                    help="send documents to a transform server (started with 'pii-transform serve') at this address: http://host:port or unix:/path")
+
+    g8 = parser.add_argument_group("Metrics")
+    g8.add_argument("--metrics-file",
+                    help="write latency & entity-count histograms to this file (JSON for .json files, else Prometheus text format)")
+    g8.add_argument("--metrics-interval", type=float,
+                    help="also write the metrics file periodically, every this number of seconds")
+    g8.add_argument("--slow-chunk", type=float,
+                    help="log the chunks taking longer than this number of seconds")
 
     g3 = parser.add_argument_group("Other")
     g3.add_argument("-q", "--quiet", action="store_false", dest="verbose")
@@ -82,10 +305,10 @@ def parse_args(args: List[str]) -> argparse.Namespace:
     return parser.parse_args(args)
 
 
-def main(args: List[str] = None):
-    if args is None:
-        args = sys.argv[1:]
-    args = parse_args(args)
+def run(args: argparse.Namespace):
+    """
+    Process with the parsed command-line arguments, reporting errors
+    """
     try:
         process(args)
     except Exception as e:
@@ -96,5 +319,15 @@ def main(args: List[str] = None):
             sys.exit(1)
 
 
+def main(args: List[str] = None):
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] in SUBCOMMANDS:
+        module, func = SUBCOMMANDS[args[0]]
+        module = importlib.import_module("." + module, __package__)
+        return getattr(module, func)(args[1:])
+    run(parse_args(args))
+
+
 if __name__ == "__main__":
     main()
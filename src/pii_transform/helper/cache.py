@@ -0,0 +1,66 @@
+"""
+A simple LRU cache, whose contents can be inspected and updated explicitly
+(as opposed to functools.lru_cache)
+"""
+
+from collections import OrderedDict
+
+from typing import Any, Hashable
+
+
+class LruCache:
+
+    def __init__(self, maxsize: int = 128):
+        """
+         :param maxsize: maximum number of elements to keep (`None` means
+           unlimited)
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+
+    def __repr__(self) -> str:
+        return f"<LruCache #{len(self._data)}/{self.maxsize}>"
+
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Fetch an element from the cache, marking it as recently used
+        """
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Add an element to the cache, evicting the oldest one if needed
+        """
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+    def items(self):
+        """
+        Return the cache contents, from oldest to newest
+        """
+        return self._data.items()
+
+
+    def clear(self):
+        """
+        Remove all elements in the cache
+        """
+        self._data.clear()
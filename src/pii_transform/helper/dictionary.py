@@ -0,0 +1,310 @@
+"""
+A static substitution dictionary: a (possibly very large) mapping of
+(PII type, value) pairs to fixed replacements, stored as a prebuilt on-disk
+hash index (`.piid` files). The file is memory-mapped read-only, so lookups
+do not need to load it and its pages are shared by all the processes using
+it.
+
+File layout (all integers in the byte order recorded in the header):
+ * magic string (8 bytes) and header length (uint64)
+ * JSON header: format, number of entries & slots, source files and the
+   offset of each section
+ * hash slots: an open-addressing table (linear probing, at most half full)
+   with two uint64 per slot: the key hash and the offset of its record in
+   the data section plus one (0 means an empty slot)
+ * data: one record per entry, with the key length & replacement length
+   (uint32) followed by the key (`<type>\\0<value>`) and the replacement, both
+   in UTF-8
+
+Dictionaries are compiled from CSV or TSV files with three columns (PII type,
+value, replacement) by build_dictionary(), also available as the
+`pii-transform build-dict` subcommand.
+"""
+
+import os
+import sys
+import csv
+import json
+import mmap
+import hashlib
+from array import array
+from datetime import datetime, timezone
+
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+from pii_data.types import PiiEnum
+from pii_data.helper.io import openfile, base_extension
+from pii_data.helper.exception import InvArgException, FileException
+
+
+FMT_PII_DICTIONARY = "pii-transform:pii-dictionary:v1"
+
+MAGIC = b"PIID\x01\x00\x00\x00"
+
+# Maximum fraction of used slots in the hash table
+MAX_LOAD = 0.5
+
+
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+def _key(ptype: PiiEnum, value: str) -> bytes:
+    return f"{ptype.name}\0{value}".encode("utf-8")
+
+
+def _hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                          "little")
+
+
+def read_entries(filename: str,
+                 delimiter: str = None) -> Iterator[Tuple[PiiEnum, str, str]]:
+    """
+    Read the entries in a CSV/TSV dictionary source file: three columns with
+    the PII type (a PiiEnum name), the value and its replacement. A first row
+    with `type` in the first column is taken as a header and skipped
+     :param filename: the source file
+     :param delimiter: the field delimiter (default is a tab for `.tsv` files,
+       else a comma)
+    """
+    if delimiter is None:
+        delimiter = "\t" if base_extension(filename) == ".tsv" else ","
+    with openfile(filename, encoding="utf-8") as f:
+        for n, row in enumerate(csv.reader(f, delimiter=delimiter), start=1):
+            if not row or (n == 1 and row[0].strip().lower() == "type"):
+                continue
+            if len(row) != 3:
+                raise InvArgException("invalid line {} in dictionary source {}: expected 3 fields",
+                                      n, filename)
+            try:
+                ptype = PiiEnum[row[0].strip().upper()]
+            except KeyError:
+                raise InvArgException("invalid PII type '{}' in line {} of dictionary source {}",
+                                      row[0], n, filename)
+            yield ptype, row[1], row[2]
+
+
+def build_dictionary(infiles: Union[str, List[str]], outfile: str,
+                     delimiter: str = None) -> int:
+    """
+    Compile a dictionary index file from one or more CSV/TSV source files.
+    Repeated entries must have the same replacement
+     :param infiles: the source file(s)
+     :param outfile: the output index file
+     :param delimiter: the field delimiter in the source files
+     :return: the number of entries
+    """
+    if isinstance(infiles, (str, os.PathLike)):
+        infiles = [infiles]
+    entries = {}
+    for name in infiles:
+        for ptype, value, repl in read_entries(name, delimiter):
+            key = _key(ptype, value)
+            prev = entries.setdefault(key, repl)
+            if prev != repl:
+                raise InvArgException("conflicting replacements for {} '{}': '{}' and '{}'",
+                                      ptype.name, value, prev, repl)
+
+    # Build the data section & the hash slots
+    nslots = 8
+    while len(entries) > nslots * MAX_LOAD:
+        nslots *= 2
+    mask = nslots - 1
+    slots = array("Q", bytes(16 * nslots))
+    data = bytearray()
+    for key, repl in entries.items():
+        rvalue = repl.encode("utf-8")
+        offset = len(data)
+        data += len(key).to_bytes(4, sys.byteorder)
+        data += len(rvalue).to_bytes(4, sys.byteorder)
+        data += key
+        data += rvalue
+        h = _hash(key)
+        i = h & mask
+        while slots[2*i+1]:
+            i = (i + 1) & mask
+        slots[2*i] = h
+        slots[2*i+1] = offset + 1
+
+    # Write the file
+    sections = {}
+    header = {"format": FMT_PII_DICTIONARY, "byteorder": sys.byteorder,
+              "count": len(entries), "slots": nslots,
+              "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+              "source": [os.path.basename(str(n)) for n in infiles],
+              "sections": sections}
+    hlen = len(json.dumps(header)) + 256     # room for the section offsets
+    offset = 16 + hlen + _pad(16 + hlen)
+    for name, size in (("slots", len(slots) * slots.itemsize),
+                       ("data", len(data))):
+        sections[name] = [offset, size]
+        offset += size + _pad(size)
+    hdata = json.dumps(header).encode("utf-8").ljust(hlen)
+
+    outfile = str(outfile)
+    tmpname = outfile + ".tmp"
+    with open(tmpname, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(hdata).to_bytes(8, sys.byteorder))
+        f.write(hdata)
+        f.write(b"\0" * _pad(16 + hlen))
+        for chunk in (slots.tobytes(), bytes(data)):
+            f.write(chunk)
+            f.write(b"\0" * _pad(len(chunk)))
+    os.replace(tmpname, outfile)
+    return len(entries)
+
+
+# --------------------------------------------------------------------------
+
+
+class PiiDictionary:
+    """
+    A read-only substitution dictionary, memory-mapped from an index file
+    """
+
+    def __init__(self, filename: str):
+        """
+         :param filename: name of the index file
+        """
+        self.filename = str(filename)
+        try:
+            with open(self.filename, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise FileException("cannot map dictionary file {}: {}",
+                                self.filename, e) from e
+        mm = self._mm
+        if mm[:8] != MAGIC:
+            raise FileException("not a PII dictionary: {}", self.filename)
+        hlen = int.from_bytes(mm[8:16], sys.byteorder)
+        try:
+            header = json.loads(bytes(mm[16:16+hlen]))
+        except ValueError as e:
+            raise FileException("invalid PII dictionary: {}",
+                                self.filename) from e
+        if header.get("format") != FMT_PII_DICTIONARY:
+            raise FileException("invalid PII dictionary format: {}",
+                                self.filename)
+        self.header = header
+        self._order = header["byteorder"]
+        self._mask = header["slots"] - 1
+
+        view = memoryview(mm)
+        offset, size = header["sections"]["slots"]
+        slots = view[offset:offset+size]
+        if self._order != sys.byteorder:
+            slots = array("Q", slots)
+            slots.byteswap()
+        else:
+            slots = slots.cast("Q")
+        self._slots = slots
+        offset, size = header["sections"]["data"]
+        self._data = view[offset:offset+size]
+
+
+    def __repr__(self) -> str:
+        return f"<PiiDictionary #{len(self)}>"
+
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+
+    def __contains__(self, key: Tuple[PiiEnum, str]) -> bool:
+        return self.get(*key) is not None
+
+
+    def get(self, ptype: PiiEnum, value: str) -> Optional[str]:
+        """
+        Look up the replacement for a PII value
+         :param ptype: the PII type
+         :param value: the PII value
+         :return: the replacement, or None if the value is not in the
+           dictionary
+        """
+        key = _key(ptype, value)
+        h = _hash(key)
+        slots, data, order, mask = self._slots, self._data, self._order, \
+            self._mask
+        i = h & mask
+        while True:
+            offset = slots[2*i+1]
+            if not offset:
+                return None
+            if slots[2*i] == h:
+                rec = offset - 1
+                klen = int.from_bytes(data[rec:rec+4], order)
+                if data[rec+8:rec+8+klen] == key:
+                    vlen = int.from_bytes(data[rec+4:rec+8], order)
+                    start = rec + 8 + klen
+                    return bytes(data[start:start+vlen]).decode("utf-8")
+            i = (i + 1) & mask
+
+
+    def items(self) -> Iterable[Tuple[PiiEnum, str, str]]:
+        """
+        Iterate over all the entries, as (type, value, replacement) tuples
+        """
+        data, order = self._data, self._order
+        slots = self._slots
+        for i in range(0, len(slots), 2):
+            offset = slots[i+1]
+            if not offset:
+                continue
+            rec = offset - 1
+            klen = int.from_bytes(data[rec:rec+4], order)
+            vlen = int.from_bytes(data[rec+4:rec+8], order)
+            key = bytes(data[rec+8:rec+8+klen]).decode("utf-8")
+            ptype, value = key.split("\0", 1)
+            start = rec + 8 + klen
+            yield PiiEnum[ptype], value, \
+                bytes(data[start:start+vlen]).decode("utf-8")
+
+
+    def close(self):
+        """
+        Release the mapping
+        """
+        if self._mm is None:
+            return
+        self._slots = self._data = None
+        self._mm.close()
+        self._mm = None
+
+
+class DictionaryValue:
+    """
+    The `dictionary` substitution policy: a PiiDictionary lookup, with a
+    fallback policy for the values not in the dictionary
+    """
+
+    def __init__(self, filename: str, fallback):
+        """
+         :param filename: name of the dictionary index file
+         :param fallback: the policy processor (template or callable) to use
+           on misses
+        """
+        self.dictionary = PiiDictionary(filename)
+        self.fallback = fallback
+        self.stats = {"hits": 0, "misses": 0}
+
+
+    def __repr__(self) -> str:
+        return f"<DictionaryValue {self.dictionary.filename}>"
+
+
+    def get(self, ptype: PiiEnum, value: str) -> Optional[str]:
+        """
+        Look up a value, updating the statistics
+        """
+        repl = self.dictionary.get(ptype, value)
+        self.stats["misses" if repl is None else "hits"] += 1
+        return repl
+
+
+    def reset(self):
+        if hasattr(self.fallback, "reset"):
+            self.fallback.reset()
+
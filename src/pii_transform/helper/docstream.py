@@ -0,0 +1,208 @@
+"""
+Read Source Documents incrementally: the document header is read when the
+document is opened, and the chunks are parsed one by one while the document
+is being iterated, so that memory use does not grow with the document size.
+
+Two file formats are supported:
+ * the standard YAML Source Document format (the `header` field must
+   appear before the `chunks` field, as written by pii-data)
+ * a JSON Lines format, in which the first line contains the `format` and
+   `header` fields, and each subsequent line contains a top-level chunk
+
+For tree documents, each top-level chunk (together with all its descendants)
+is read at once.
+
+CSV files can also be read directly as table documents, one row at a time.
+
+Note that these documents can be iterated only once.
+"""
+
+from yaml import SafeLoader
+from yaml.events import StreamStartEvent, DocumentStartEvent, \
+    MappingStartEvent, MappingEndEvent, SequenceStartEvent, SequenceEndEvent
+
+import io
+import csv
+import json
+
+from typing import Dict, Iterator, List, TextIO, Tuple, Any
+
+from pii_data.defs import FMT_SRCDOCUMENT
+from pii_data.helper.io import openfile, base_extension
+from pii_data.helper.exception import InvalidDocument
+from pii_data.types.doc.localdoc import BaseLocalSrcDocument
+
+from .io import DOC_CLASS
+
+
+def _yaml_value(loader: SafeLoader) -> Any:
+    """
+    Read the next complete YAML node from the event stream, and construct
+    the corresponding Python object
+    """
+    node = loader.compose_node(None, None)
+    value = loader.construct_object(node, deep=True)
+    # Do not keep references to already constructed nodes
+    loader.constructed_objects = {}
+    loader.recursive_objects = {}
+    loader.anchors = {}
+    return value
+
+
+def _expect(loader: SafeLoader, event: type, filename: str):
+    if not loader.check_event(event):
+        raise InvalidDocument("invalid YAML document structure in {}", filename)
+    loader.get_event()
+
+
+def _yaml_header(src: TextIO, filename: str) -> Tuple[Dict, SafeLoader]:
+    """
+    Read a YAML Source Document up to the start of the chunk list
+     :return: a tuple (top-level fields, loader positioned at the chunks)
+    """
+    loader = SafeLoader(src)
+    for event in (StreamStartEvent, DocumentStartEvent, MappingStartEvent):
+        _expect(loader, event, filename)
+    top = {}
+    while not loader.check_event(MappingEndEvent):
+        key = _yaml_value(loader)
+        if key == "chunks":
+            return top, loader
+        top[key] = _yaml_value(loader)
+    return top, None
+
+
+def _yaml_chunks(src: TextIO, loader: SafeLoader) -> Iterator[Dict]:
+    """
+    Read the chunks in a YAML Source Document, one by one
+    """
+    try:
+        if loader is None or not loader.check_event(SequenceStartEvent):
+            return
+        loader.get_event()
+        while not loader.check_event(SequenceEndEvent):
+            yield _yaml_value(loader)
+    finally:
+        if loader is not None:
+            loader.dispose()
+        src.close()
+
+
+def _jsonl_chunks(src: TextIO) -> Iterator[Dict]:
+    """
+    Read the chunks in a JSON Lines Source Document, one by one
+    """
+    try:
+        for line in src:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        src.close()
+
+
+def _csv_chunks(src: TextIO, reader: Iterator[List[str]],
+                meta: Dict) -> Iterator[Dict]:
+    """
+    Read the rows in a CSV file, one by one, as table rows. When all rows
+    have been read, their number is stored in the `rows` field of the
+    document metadata (so that a writer can reproduce trailing empty rows,
+    which produce no chunks)
+    """
+    n = 0
+    try:
+        for n, row in enumerate(reader, start=1):
+            yield {"id": f"R{n}", "data": row}
+        meta["rows"] = n
+    finally:
+        src.close()
+
+
+def load_csv(filename: str, header: bool = True, delimiter: str = None,
+             docid: str = None,
+             iter_options: Dict = None) -> BaseLocalSrcDocument:
+    """
+    Open a CSV file as a table Source Document, for incremental reading. Each
+    CSV row becomes a table row with id `R<n>` (starting at 1, after the
+    header), and each cell a chunk with id `R<n>.<m>`, so PII instances
+    refer to cells by row & column. Empty rows produce no chunks, but keep
+    their row number
+     :param filename: name of the CSV file
+     :param header: the first row contains the column names
+     :param delimiter: the field delimiter (default is a comma)
+     :param docid: document id to add to the metadata
+     :param iter_options: iteration options for the document
+     :return: a table document, whose rows are read on demand
+    """
+    # The csv module needs the file opened without newline translation, so
+    # that line breaks inside quoted cells are preserved
+    src = io.TextIOWrapper(openfile(filename, "rb"), encoding="utf-8",
+                           newline="")
+    reader = csv.reader(src, delimiter=delimiter or ",")
+    meta = {"type": "table", "origin": "csv"}
+    if docid is not None:
+        meta["id"] = docid
+    hdr = {"document": meta}
+    if header:
+        try:
+            hdr["column"] = {"name": next(reader)}
+        except StopIteration:
+            pass
+        except csv.Error as e:
+            src.close()
+            raise InvalidDocument("cannot read CSV file {}: {}", filename, e) from e
+    doc = DOC_CLASS["table"](metadata=hdr, iter_options=iter_options)
+    doc.set_chunks(_csv_chunks(src, reader, doc.metadata["document"]))
+    return doc
+
+
+def load_stream(filename: str, iter_options: Dict = None) -> BaseLocalSrcDocument:
+    """
+    Open a Source Document file for incremental reading
+     :param filename: name of the file (YAML or JSON Lines)
+     :param iter_options: iteration options for the document
+     :return: a LocalSrcDocument subclass, whose chunks are read on demand
+    """
+    src = openfile(filename, encoding="utf-8")
+    try:
+        if base_extension(filename) in (".jsonl", ".ndjson"):
+            top = json.loads(next(src, "{}"))
+            chunks = _jsonl_chunks(src)
+        else:
+            top, loader = _yaml_header(src, filename)
+            chunks = _yaml_chunks(src, loader)
+    except InvalidDocument:
+        src.close()
+        raise
+    except Exception as e:
+        src.close()
+        raise InvalidDocument("cannot read document {}: {}", filename, e) from e
+
+    # Check format
+    fmt = top.get("format")
+    if fmt != FMT_SRCDOCUMENT:
+        src.close()
+        raise InvalidDocument("invalid format '{}' in {}", fmt, filename)
+
+    # Create the document object
+    hdr = top.get("header") or {}
+    dtype = hdr.get("document", {}).get("type") or "sequence"
+    try:
+        Obj = DOC_CLASS[dtype]
+    except KeyError:
+        src.close()
+        raise InvalidDocument("unknown document type '{}' in {}", dtype, filename)
+    return Obj(chunks=chunks, metadata=hdr, iter_options=iter_options)
+
+
+class StreamSrcDocumentFile:
+    """
+    A dispatcher class that opens a Source Document file for incremental
+    reading
+    """
+
+    def __new__(self, filename: str, iter_options: Dict = None):
+        """
+          :param filename: name of the file to read
+          :param iter_options: iteration options for the object
+        """
+        return load_stream(filename, iter_options=iter_options)
@@ -0,0 +1,108 @@
+"""
+Convert documents and PII collections from/to plain (JSON-serializable)
+dictionaries, using the same structure as their file formats
+"""
+
+import json
+
+from typing import Dict, Iterable
+
+from pii_data.defs import FMT_SRCDOCUMENT
+from pii_data.helper.exception import InvalidDocument
+from pii_data.helper.json_encoder import CustomJSONEncoder
+from pii_data.types.doc import SrcDocument
+from pii_data.types.doc.localdoc import BaseLocalSrcDocument, \
+    SequenceLocalSrcDocument, TreeLocalSrcDocument, TableLocalSrcDocument
+from pii_data.types.doc.defs import CTX_FIELDS
+from pii_data.types.piicollection import PiiCollection, PiiCollectionLoader
+from pii_data.types.piicollection.loader import check_format
+from pii_data.types.piientity import PiiEntity
+from pii_data.dump.json import serialize_chunk
+from pii_data.dump.utils import ChunkIterWrapper
+
+from .splice import materialise
+
+
+DOC_CLASS = {
+    "sequence": SequenceLocalSrcDocument,
+    "tree": TreeLocalSrcDocument,
+    "table": TableLocalSrcDocument
+}
+
+
+def doc_fromdict(data: Dict, source: str = "dict") -> BaseLocalSrcDocument:
+    """
+    Create a document from a dictionary with the Source Document file format
+     :param data: the document data
+     :param source: name of the data source, for error messages
+    """
+    fmt = data.get("format")
+    if fmt != FMT_SRCDOCUMENT:
+        raise InvalidDocument("invalid format '{}' in {}", fmt, source)
+    hdr = data.get("header", {})
+    dtype = hdr.get("document", {}).get("type") or "sequence"
+    try:
+        Obj = DOC_CLASS[dtype]
+    except KeyError:
+        raise InvalidDocument("unknown document type '{}' in {}", dtype, source)
+    return Obj(chunks=data.get("chunks"), metadata=hdr)
+
+
+def materialise_chunk(chunk: Dict) -> Dict:
+    """
+    Ensure the data in a serialized chunk (and its subchunks) is made of
+    plain strings
+    """
+    data = chunk["data"]
+    chunk["data"] = list(map(materialise, data)) if isinstance(data, list) \
+        else materialise(data)
+    for c in chunk.get("chunks", ()):
+        materialise_chunk(c)
+    return chunk
+
+
+def doc_todict(doc: SrcDocument) -> Dict:
+    """
+    Convert a document to a dictionary with the Source Document file format
+    """
+    chunks = ChunkIterWrapper(doc.iter_struct())
+    return {
+        "format": FMT_SRCDOCUMENT,
+        "header": dict(doc.metadata),
+        "chunks": [materialise_chunk(serialize_chunk(c, CTX_FIELDS, False))
+                   for c in chunks]
+    }
+
+
+def piic_build(header: Dict, entities: Iterable[PiiEntity]) -> PiiCollection:
+    """
+    Create a PII collection from its header (including the detectors) and a
+    list of entities
+    """
+    header = {**header, "detectors": header.get("detectors") or {}}
+    piic = PiiCollectionLoader()
+    # Load the header as a single-line NDJSON source
+    piic.load_ndjson(iter([json.dumps(header, cls=CustomJSONEncoder)]))
+    for pii in entities:
+        piic.add(pii)
+    return piic
+
+
+def piic_fromdict(data: Dict, source: str = "dict") -> PiiCollection:
+    """
+    Create a PII collection from a dictionary with the JSON PII Collection
+    file format
+     :param data: the collection data
+     :param source: name of the data source, for error messages
+    """
+    meta = data["metadata"]
+    check_format(meta, source)
+    return piic_build(meta, (PiiEntity.fromdict(d) for d in data["pii_list"]))
+
+
+def piic_todict(piic: PiiCollection) -> Dict:
+    """
+    Convert a PII collection to a dictionary with the JSON PII Collection
+    file format
+    """
+    return json.loads(json.dumps(piic.to_json(), cls=CustomJSONEncoder))
@@ -0,0 +1,208 @@
+"""
+Memory-budgeted execution.
+
+A MemoryBudget object keeps track of two quantities:
+ * the resident set size of the process, measured periodically. When it goes
+   over a soft limit (a fraction of the budget), a sequence of registered
+   pressure handlers is run (e.g. flush pending output, clear the
+   substitution memo, shrink the consistency caches), until it goes back
+   under the soft limit
+ * the estimated size of queued work (e.g. documents loaded but not yet
+   written). Reserving space for new work blocks while the reservations would
+   exceed the available budget, applying backpressure to the producers
+
+The peak values for both are kept, and reported in the statistics.
+"""
+
+import os
+import re
+import sys
+import threading
+from collections import Counter
+
+from typing import Callable, Dict, List, Tuple, Union
+
+from pii_data.helper.exception import InvArgException
+
+
+# Fraction of the budget that triggers the pressure handlers
+DEFAULT_SOFT_LIMIT = 0.8
+
+# After running the pressure handlers, do not run them again until memory
+# has grown by this fraction of the budget
+PRESSURE_STEP = 0.05
+
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+try:
+    _PAGESIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGESIZE = 4096
+
+
+def parse_size(value: Union[str, int]) -> int:
+    """
+    Parse a memory size, as an integer number of bytes or as a string with
+    an optional unit suffix (K, M, G, T), e.g. "512M"
+    """
+    if isinstance(value, int):
+        return value
+    m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", str(value),
+                 flags=re.I)
+    if not m:
+        raise InvArgException("invalid memory size: {}", value)
+    return int(float(m.group(1)) * _UNITS[m.group(2).upper()])
+
+
+def format_size(value: int) -> str:
+    """
+    Format a memory size in human-readable units
+    """
+    for unit in ("B", "K", "M", "G"):
+        if abs(value) < 1024:
+            return f"{value:.1f}{unit}" if unit != "B" else f"{value}B"
+        value /= 1024
+    return f"{value:.1f}T"
+
+
+def rss() -> int:
+    """
+    Return the current resident set size of the process, in bytes. On systems
+    without /proc, the peak resident size is returned instead
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * _PAGESIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    except ImportError:
+        return 0
+
+
+class MemoryBudget:
+
+    def __init__(self, limit: Union[int, str], soft: float = None,
+                 measure: Callable[[], int] = None):
+        """
+         :param limit: the memory budget, in bytes (or as a string with a
+           unit suffix)
+         :param soft: fraction of the budget that triggers memory pressure
+           handlers
+         :param measure: function measuring current memory use (default is
+           the process resident size)
+        """
+        self.limit = parse_size(limit)
+        if self.limit <= 0:
+            raise InvArgException("invalid memory budget: {}", limit)
+        self._soft = int(self.limit * (soft or DEFAULT_SOFT_LIMIT))
+        self._measure = measure or rss
+        self._threshold = self._soft
+        self._handlers: List[Tuple[str, Callable]] = []
+        self._reserved = 0
+        self._cond = threading.Condition()
+        self._stats = Counter()
+        self._peak = self._peak_reserved = 0
+        self.check()
+
+
+    def __repr__(self) -> str:
+        return f"<MemoryBudget {format_size(self.limit)}>"
+
+
+    def add_handler(self, name: str, func: Callable[[], None]):
+        """
+        Add a memory pressure handler. Handlers are run in the order they are
+        added, so they should go from the least to the most disruptive
+        """
+        self._handlers.append((name, func))
+
+
+    def usage(self) -> int:
+        """
+        Measure the current memory use, updating the peak value
+        """
+        value = self._measure()
+        if value > self._peak:
+            self._peak = value
+        return value
+
+
+    def check(self) -> int:
+        """
+        Measure the memory use and, if it is over the soft limit, run the
+        pressure handlers until it goes back under it
+         :return: the number of handlers run
+        """
+        used = self.usage()
+        if used < self._threshold:
+            if used < self._soft:
+                self._threshold = self._soft
+            return 0
+
+        self._stats["pressure"] += 1
+        num = 0
+        for name, func in self._handlers:
+            func()
+            num += 1
+            self._stats[name] += 1
+            used = self.usage()
+            if used < self._soft:
+                break
+        if used > self.limit:
+            self._stats["over_budget"] += 1
+        # Memory freed by the handlers is not necessarily returned to the
+        # system, so wait for further growth before running them again
+        self._threshold = max(self._soft, used + int(self.limit*PRESSURE_STEP))
+        return num
+
+
+    def available(self) -> int:
+        """
+        Return the budget not used by the process nor reserved for queued work
+        """
+        with self._cond:
+            return self.limit - self.usage() - self._reserved
+
+
+    def acquire(self, size: int, timeout: float = None) -> bool:
+        """
+        Reserve budget for a piece of queued work, waiting while it would not
+        fit (a reservation is always granted if nothing else is reserved)
+         :param size: estimated memory size of the work
+         :param timeout: maximum time to wait, in seconds
+         :return: True if the reservation was granted
+        """
+        with self._cond:
+            def fits() -> bool:
+                return not self._reserved or \
+                    self.usage() + self._reserved + size <= self.limit
+            if not fits():
+                self._stats["waits"] += 1
+                if not self._cond.wait_for(fits, timeout):
+                    return False
+            self._reserved += size
+            self._peak_reserved = max(self._peak_reserved, self._reserved)
+            return True
+
+
+    def release(self, size: int):
+        """
+        Release a reservation made with acquire()
+        """
+        with self._cond:
+            self._reserved = max(self._reserved - size, 0)
+            self._cond.notify_all()
+
+
+    def stats(self) -> Dict:
+        """
+        Return the budget, the peak memory use (measured & reserved) and the
+        number of times each pressure handler was run
+        """
+        return {"memory_budget": self.limit, "memory_peak": self._peak,
+                "memory_peak_reserved": self._peak_reserved,
+                **{f"memory_{k}": v for k, v in self._stats.items()}}
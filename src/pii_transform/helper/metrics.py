@@ -0,0 +1,289 @@
+"""
+Processing metrics: latency & entity-count histograms for documents and
+chunks, plus a log of slow chunks.
+
+Histograms use fixed buckets (a 1-2-5 series for latencies, powers of two for
+entity counts), so that adding an observation is a binary search over a
+small tuple plus a counter increment. They can be exported as JSON or in the
+Prometheus text exposition format.
+"""
+
+import os
+import json
+from bisect import bisect_left
+from collections import deque
+
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from pii_data.helper.exception import InvArgException
+
+
+# Latency bucket upper bounds, in seconds: 10 us ... 500 s
+LATENCY_BUCKETS = tuple(m * 10.0**e for e in range(-5, 3) for m in (1, 2, 5))
+
+# Entity-count bucket upper bounds: 0, 1, 2, 4 ... 65536
+COUNT_BUCKETS = (0,) + tuple(2**n for n in range(17))
+
+# Metric name, buckets & description for each histogram
+HISTOGRAMS = (
+    ("document_seconds", LATENCY_BUCKETS, "Document transformation time"),
+    ("chunk_seconds", LATENCY_BUCKETS, "Chunk transformation time"),
+    ("document_entities", COUNT_BUCKETS, "Substituted entities per document"),
+    ("chunk_entities", COUNT_BUCKETS, "Substituted entities per chunk")
+)
+
+# Maximum number of slow chunk records kept
+SLOW_LOG_SIZE = 100
+
+# Prefix for exported metric names
+METRIC_PREFIX = "pii_transform"
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets. Bucket `i` counts the values `v` with
+    `bounds[i-1] < v <= bounds[i]`; an additional last bucket counts the
+    values over the last bound.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, bounds: Iterable[float]):
+        """
+         :param bounds: the bucket upper bounds, in increasing order
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = self.max = None
+
+
+    def __repr__(self) -> str:
+        return f"<Histogram #{self.count}>"
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def add(self, value: float):
+        """
+        Add an observation
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+
+    def merge(self, other: "Histogram"):
+        """
+        Add all the observations in another histogram (with the same buckets)
+        """
+        if other.bounds != self.bounds:
+            raise InvArgException("cannot merge histograms with different buckets")
+        for n, c in enumerate(other.counts):
+            self.counts[n] += c
+        self.count += other.count
+        self.sum += other.sum
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile, as the upper bound of the bucket containing it
+        (clipped to the observed range)
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for n, c in enumerate(self.counts):
+            total += c
+            if c and total >= rank:
+                break
+        value = self.bounds[n] if n < len(self.bounds) else self.max
+        return min(max(value, self.min), self.max)
+
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """
+        Return the cumulative counts, as (upper bound, count) tuples (the
+        last one has an infinite bound)
+        """
+        out = []
+        total = 0
+        for bound, c in zip(self.bounds + (float("inf"),), self.counts):
+            total += c
+            out.append((bound, total))
+        return out
+
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = self.max = None
+
+
+    def asdict(self) -> Dict:
+        """
+        Return the histogram as a dict: summary values, a few quantiles, and
+        the non-empty buckets (as upper bound & count)
+        """
+        out = {"count": self.count, "sum": self.sum,
+               "min": self.min, "max": self.max,
+               "mean": self.sum/self.count if self.count else None}
+        for q in (0.5, 0.9, 0.99):
+            out[f"p{int(q*100)}"] = self.quantile(q)
+        bounds = self.bounds + ("+Inf",)
+        out["buckets"] = [[bounds[n], c] for n, c in enumerate(self.counts)
+                          if c]
+        return out
+
+
+# --------------------------------------------------------------------------
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class TransformMetrics:
+    """
+    The metrics for a transformer: document & chunk histograms, and a log of
+    the chunks slower than a threshold
+    """
+
+    def __init__(self, slow_chunk: float = None,
+                 log: Callable[[Dict], None] = None):
+        """
+         :param slow_chunk: threshold (in seconds) above which a chunk is
+           recorded as slow
+         :param log: a callable that will receive each slow chunk record
+        """
+        self.slow_chunk = slow_chunk
+        self.log = log
+        self.hist = {name: Histogram(buckets)
+                     for name, buckets, _ in HISTOGRAMS}
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+        self.slow_count = 0
+
+
+    def __repr__(self) -> str:
+        return f"<TransformMetrics #{self.hist['document_seconds'].count}>"
+
+
+    def chunk(self, seconds: float, entities: int, chunk_ids: List[str],
+              docid: str = None):
+        """
+        Record a transformed chunk. A group of chunks substituted in a single
+        batch (the cells in a table row) is recorded as one observation.
+         :param seconds: the processing time
+         :param entities: number of substituted entities
+         :param chunk_ids: the ids of the chunks
+         :param docid: the document id
+        """
+        self.hist["chunk_seconds"].add(seconds)
+        self.hist["chunk_entities"].add(entities)
+        if self.slow_chunk is not None and seconds > self.slow_chunk:
+            record = {"docid": docid, "chunk": ",".join(map(str, chunk_ids)),
+                      "entities": entities, "seconds": seconds}
+            self.slow.append(record)
+            self.slow_count += 1
+            if self.log:
+                self.log(record)
+
+
+    def document(self, seconds: float, entities: int):
+        """
+        Record a transformed document
+         :param seconds: the processing time
+         :param entities: number of substituted entities
+        """
+        self.hist["document_seconds"].add(seconds)
+        self.hist["document_entities"].add(entities)
+
+
+    def reset(self):
+        for h in self.hist.values():
+            h.reset()
+        self.slow.clear()
+        self.slow_count = 0
+
+
+    def to_json(self, stats: Dict = None) -> Dict:
+        """
+        Return the metrics as a JSON-serializable dict
+         :param stats: processing statistics to add
+        """
+        out = {"histograms": {k: h.asdict() for k, h in self.hist.items()},
+               "slow_chunks": {"threshold": self.slow_chunk,
+                               "count": self.slow_count,
+                               "last": list(self.slow)}}
+        if stats is not None:
+            out["stats"] = stats
+        return out
+
+
+    def to_prometheus(self, stats: Dict = None,
+                      prefix: str = METRIC_PREFIX) -> str:
+        """
+        Return the metrics in the Prometheus text exposition format
+         :param stats: processing statistics to add (as gauges, except those
+           already exported as a metric)
+         :param prefix: prefix for the metric names
+        """
+        lines = []
+        exported = {"slow_chunks"}
+        for name, _, desc in HISTOGRAMS:
+            exported.add(name)
+            hist = self.hist[name]
+            metric = f"{prefix}_{name}"
+            lines += [f"# HELP {metric} {desc}", f"# TYPE {metric} histogram"]
+            for bound, count in hist.cumulative():
+                lines.append(f'{metric}_bucket{{le="{_format_value(bound)}"}} {count}')
+            lines += [f"{metric}_sum {_format_value(hist.sum)}",
+                      f"{metric}_count {hist.count}"]
+        metric = f"{prefix}_slow_chunks_total"
+        lines += [f"# HELP {metric} Chunks slower than the threshold",
+                  f"# TYPE {metric} counter", f"{metric} {self.slow_count}"]
+        for k, v in (stats or {}).items():
+            if k in exported:
+                continue
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                lines += [f"# TYPE {prefix}_{k} gauge",
+                          f"{prefix}_{k} {_format_value(v)}"]
+        return "\n".join(lines) + "\n"
+
+
+    def dump(self, filename: str, stats: Dict = None, format: str = None):
+        """
+        Write the metrics to a file (atomically, so that a collector never
+        reads a partial file)
+         :param filename: output file
+         :param stats: processing statistics to add
+         :param format: "json" or "prometheus" (default is to use JSON for
+           `.json` files, and Prometheus for the rest)
+        """
+        if format is None:
+            format = "json" if str(filename).endswith(".json") else "prometheus"
+        if format == "json":
+            data = json.dumps(self.to_json(stats), indent=2)
+        elif format == "prometheus":
+            data = self.to_prometheus(stats)
+        else:
+            raise InvArgException("unknown metrics format: {}", format)
+        tmpname = f"{filename}.tmp"
+        with open(tmpname, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmpname, filename)
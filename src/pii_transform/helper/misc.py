@@ -1,6 +1,12 @@
 
+import random
+import hashlib
+
 from typing import Dict, List, Any, Optional
 
+from pii_data.types import PiiEnum
+from pii_data.types.piientity import PiiEntityInfo
+
 
 def get_element(src: Dict, taglist: List[str]) -> Optional[Any]:
     """
@@ -35,3 +41,45 @@ def set_element(src: Dict, taglist: List[str], value: Any) -> bool:
                 src[elem] = value
                 return True
     return False
+
+
+def keyed_hash(key: str, *parts: Any) -> int:
+    """
+    Compute a keyed hash over a number of values, as a 64-bit integer
+    """
+    key = str(key).encode("utf-8")
+    if len(key) > hashlib.blake2b.MAX_KEY_SIZE:
+        key = hashlib.blake2b(key).digest()
+    data = "\x1f".join(map(str, parts)).encode("utf-8")
+    h = hashlib.blake2b(data, key=key, digest_size=8)
+    return int.from_bytes(h.digest(), "big")
+
+
+def info_tolist(info: PiiEntityInfo) -> List:
+    """
+    Convert a PiiEntityInfo object to a JSON-serializable list
+    """
+    return [info.pii.name, info.lang, info.country, info.subtype]
+
+
+def info_fromlist(data: List) -> PiiEntityInfo:
+    """
+    Rebuild a PiiEntityInfo object from the output of info_tolist()
+    """
+    return PiiEntityInfo(PiiEnum[data[0]], *data[1:])
+
+
+def random_state(rng: random.Random = random) -> List:
+    """
+    Return the state of a random number generator, JSON-serializable
+    """
+    version, internal, gauss = rng.getstate()
+    return [version, list(internal), gauss]
+
+
+def set_random_state(state: List, rng: random.Random = random):
+    """
+    Restore the state of a random number generator
+    """
+    version, internal, gauss = state
+    rng.setstate((version, tuple(internal), gauss))
@@ -0,0 +1,173 @@
+"""
+Utilities for the plain text fast path: the input file is memory-mapped, PII
+positions are converted to byte offsets, and the unchanged byte ranges are
+copied to the output file directly by the kernel (via copy_file_range() or
+sendfile(), where available), with the substitutions interleaved.
+
+Memory use does not depend on the file size: character offsets are converted
+by scanning the mapping in bounded windows, and ranges that cannot be copied
+by the kernel are also written in bounded windows.
+"""
+
+import io
+import os
+import errno
+
+from typing import BinaryIO
+
+
+# Size of the windows used to scan or copy the input
+WINDOW_SIZE = 1024*1024
+
+# Ranges smaller than this are copied through the output buffer, instead of
+# with a system call
+SMALL_COPY = 64*1024
+
+# Byte values for the start of a UTF-8 character (all but continuation bytes)
+_LEADING = bytes(b for b in range(256) if not 0x80 <= b < 0xC0)
+
+# Errors signaling that a zero-copy call is not available for these files
+_NOCOPY_ERRORS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF,
+                  errno.EOPNOTSUPP, errno.ENOTSUP)
+
+
+class CharOffsets:
+    """
+    Convert (increasing) character offsets in a UTF-8 buffer into byte offsets
+    """
+
+    def __init__(self, buffer: bytes):
+        self._buf = buffer
+        self._char = self._byte = 0
+
+
+    def __call__(self, charpos: int) -> int:
+        """
+        Return the byte offset for a character offset. Offsets must be given
+        in non-decreasing order (else the scan restarts from the beginning)
+        """
+        if charpos < self._char:
+            self._char = self._byte = 0
+        buf, size = self._buf, len(self._buf)
+        remaining = charpos - self._char
+        pos = self._byte
+        while remaining > 0 and pos < size:
+            window = buf[pos:pos + min(remaining, WINDOW_SIZE)]
+            if window.isascii():
+                chars = len(window)
+            else:
+                # Continuation bytes do not start a character
+                chars = len(window) - len(window.translate(None, _LEADING))
+            pos += len(window)
+            remaining -= chars
+        # If we stopped in the middle of a character, skip the rest of it
+        while pos < size and 0x80 <= buf[pos] < 0xC0:
+            pos += 1
+        self._char, self._byte = charpos - remaining, pos
+        return pos
+
+
+class RangeCopier:
+    """
+    Write an output file made of byte ranges from a memory-mapped input file,
+    interleaved with new data
+    """
+
+    def __init__(self, src: BinaryIO, buffer: bytes, out: BinaryIO):
+        """
+         :param src: the input file (opened in binary mode)
+         :param buffer: the memory mapping for the input file
+         :param out: the output file (binary). If it is a regular file, the
+           kernel will be used to copy ranges
+        """
+        self._buf = buffer
+        self._out = out
+        self._pending = bytearray()
+        self.stats = {"copied": 0, "buffered": 0, "written": 0}
+        # Kernel copies are possible only if the output is a plain file (not
+        # e.g. a compressed stream)
+        self._zerocopy = []
+        if isinstance(getattr(out, "raw", out), io.FileIO):
+            self._src_fd, self._out_fd = src.fileno(), out.fileno()
+            self._zerocopy = [m for m in ("copy_file_range", "sendfile")
+                              if hasattr(os, m)]
+
+
+    def write(self, data: bytes):
+        """
+        Add new data to the output
+        """
+        self._pending += data
+        self.stats["written"] += len(data)
+        if len(self._pending) >= WINDOW_SIZE:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Write out all buffered data
+        """
+        if self._pending:
+            self._out.write(self._pending)
+            self._pending = bytearray()
+            if self._zerocopy:
+                self._out.flush()
+
+
+    def _kernel_copy(self, start: int, end: int) -> int:
+        """
+        Try to copy a range with a system call
+         :return: the number of bytes copied
+        """
+        pos = start
+        while pos < end and self._zerocopy:
+            method = self._zerocopy[0]
+            try:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(self._src_fd, self._out_fd,
+                                           end - pos, offset_src=pos)
+                else:
+                    n = os.sendfile(self._out_fd, self._src_fd, pos, end - pos)
+            except OSError as e:
+                if e.errno not in _NOCOPY_ERRORS:
+                    raise
+                self._zerocopy.pop(0)
+                continue
+            if n == 0:
+                break
+            pos += n
+        return pos - start
+
+
+    def _buffer_copy(self, start: int, end: int):
+        """
+        Copy a byte range through the output buffer
+        """
+        self.stats["buffered"] += end - start
+        for pos in range(start, end, WINDOW_SIZE):
+            self._pending += self._buf[pos:min(pos + WINDOW_SIZE, end)]
+            if len(self._pending) >= WINDOW_SIZE:
+                self.flush()
+
+
+    def copy(self, start: int, end: int):
+        """
+        Copy a byte range from the input file to the output
+        """
+        if end <= start:
+            return
+        elif end - start < SMALL_COPY or not self._zerocopy:
+            self._buffer_copy(start, end)
+            return
+        self.flush()
+        n = self._kernel_copy(start, end)
+        self.stats["copied"] += n
+        if n < end - start:
+            self._buffer_copy(start + n, end)
+
+
+    def close(self):
+        """
+        Write out the pending data
+        """
+        self.flush()
@@ -0,0 +1,404 @@
+"""
+A compact binary format for PII collections (`.piib` files), designed to be
+memory-mapped and used without parsing.
+
+File layout (all integers in the byte order recorded in the header, and all
+sections aligned to 8 bytes):
+ * magic string (8 bytes) and header length (uint64)
+ * JSON header: format, collection metadata, entity count, string tables
+   (chunk ids, PII types, languages, countries, subtypes) and the offset of
+   each section
+ * columnar arrays, one element per entity: chunk id code (uint32), position
+   (uint64), length (uint32), type, lang, country & subtype codes (uint16,
+   with 0xFFFF meaning none)
+ * value offsets (uint64, n+1 elements) and a blob with all values (UTF-8)
+ * extra field offsets (uint64, n+1 elements) and a blob with the remaining
+   entity fields, as JSON (empty for entities without them)
+ * chunk offsets (uint64, one element per chunk plus one): entities are stored
+   grouped by chunk (in order of first appearance) and sorted by position
+
+Opening a file only reads the header; PiiEntity objects are built on demand.
+"""
+
+import sys
+import json
+import mmap
+from array import array
+from operator import itemgetter
+
+from typing import Dict, List, Iterator, Iterable, Union, Sequence
+
+from pii_data.defs import FMT_PIICOLLECTION
+from pii_data.helper.io import base_extension
+from pii_data.helper.exception import InvArgException, FileException
+from pii_data.helper.json_encoder import CustomJSONEncoder
+from pii_data.types import PiiCollection, PiiEntity, PiiEnum
+from pii_data.types.piientity import PiiEntityInfo
+from pii_data.types.piicollection import PiiCollectionLoader
+from pii_data.types.piicollection.loader import check_format
+
+from .io import piic_build
+
+
+FMT_PII_BINARY = "pii-transform:pii-binary:v1"
+
+MAGIC = b"PIIB\x01\x00\x00\x00"
+
+NONE_CODE = 0xFFFF
+
+# Columns: name, array typecode
+COLUMNS = (("chunk", "I"), ("pos", "Q"), ("length", "I"), ("type", "H"),
+           ("lang", "H"), ("country", "H"), ("subtype", "H"))
+
+STRING_TABLES = ("chunk", "type", "lang", "country", "subtype")
+
+# Entity fields stored in their own columns
+_COLUMN_FIELDS = ("type", "value", "chunkid")
+
+
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+class PiiBinaryWriter:
+
+    def __init__(self, filename: str, metadata: Dict = None):
+        """
+         :param filename: output file name
+         :param metadata: collection metadata (as in PiiCollection.get_header())
+        """
+        self.filename = str(filename)
+        self._meta = metadata or {"format": FMT_PIICOLLECTION}
+        self._cols = {name: array(code) for name, code in COLUMNS}
+        self._strings = {name: {} for name in STRING_TABLES}
+        self._values = []
+        self._extra = []
+        self._encoder = CustomJSONEncoder(ensure_ascii=False)
+
+
+    def __repr__(self) -> str:
+        return f"<PiiBinaryWriter #{len(self._values)}>"
+
+
+    def __enter__(self) -> "PiiBinaryWriter":
+        return self
+
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+
+
+    def _code(self, table: str, value: str) -> int:
+        if value is None:
+            return NONE_CODE
+        codes = self._strings[table]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+
+    def add(self, pii: PiiEntity):
+        """
+        Add an entity to the collection
+        """
+        fields = pii.fields
+        value = str(fields["value"])
+        cols = self._cols
+        cols["chunk"].append(self._code("chunk", str(fields["chunkid"])))
+        cols["pos"].append(pii.pos)
+        cols["length"].append(len(value))
+        cols["type"].append(self._code("type", pii.info.pii.name))
+        cols["lang"].append(self._code("lang", pii.info.lang))
+        cols["country"].append(self._code("country", pii.info.country))
+        cols["subtype"].append(self._code("subtype", pii.info.subtype))
+        self._values.append(value.encode("utf-8"))
+        extra = {k: v for k, v in fields.items() if k not in _COLUMN_FIELDS}
+        self._extra.append(self._encoder.encode(extra).encode("utf-8")
+                           if extra else b"")
+
+
+    def close(self):
+        """
+        Write the file
+        """
+        for name in STRING_TABLES[1:]:
+            if len(self._strings[name]) >= NONE_CODE:
+                raise InvArgException("too many distinct {} values", name)
+
+        # Group entities by chunk, sorted by position
+        chunk, pos = self._cols["chunk"], self._cols["pos"]
+        order = sorted(range(len(chunk)), key=lambda i: (chunk[i], pos[i]))
+
+        sections = []
+        for name, code in COLUMNS:
+            col = self._cols[name]
+            sections.append((name, array(code, map(col.__getitem__, order))))
+        for name, blobs in (("value", self._values), ("extra", self._extra)):
+            blobs = [blobs[i] for i in order]
+            offsets = array("Q", [0])
+            total = 0
+            for b in blobs:
+                total += len(b)
+                offsets.append(total)
+            sections.append((name + "_offset", offsets))
+            sections.append((name, b"".join(blobs)))
+        starts = array("Q", [0] * (len(self._strings["chunk"]) + 1))
+        for c in chunk:
+            starts[c+1] += 1
+        for n in range(1, len(starts)):
+            starts[n] += starts[n-1]
+        sections.append(("chunk_offset", starts))
+
+        # Compute the section offsets: header size depends on them, so
+        # reserve space for a header with large enough offset values
+        header = {
+            "format": FMT_PII_BINARY,
+            "byteorder": sys.byteorder,
+            "metadata": self._meta,
+            "count": len(chunk),
+            "strings": {name: [s for s, _ in sorted(self._strings[name].items(),
+                                                  key=itemgetter(1))]
+                        for name in STRING_TABLES},
+            "sections": {}
+        }
+        sizes = [(name, len(data) * getattr(data, "itemsize", 1))
+                 for name, data in sections]
+        for name, _ in sizes:
+            header["sections"][name] = [10**15, 10**15]
+        hlen = len(self._encoder.encode(header).encode("utf-8"))
+        offset = 16 + hlen + _pad(16 + hlen)
+        for name, size in sizes:
+            header["sections"][name] = [offset, size]
+            offset += size + _pad(size)
+        hdata = self._encoder.encode(header).encode("utf-8")
+        hdata += b" " * (hlen - len(hdata))
+
+        with open(self.filename, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(hdata).to_bytes(8, sys.byteorder))
+            f.write(hdata)
+            f.write(b"\0" * _pad(16 + hlen))
+            for (_, data), (_, size) in zip(sections, sizes):
+                f.write(data.tobytes() if isinstance(data, array) else data)
+                f.write(b"\0" * _pad(size))
+
+
+def dump_binary(piic: Iterable[PiiEntity], filename: str):
+    """
+    Write a PII collection in binary format
+    """
+    meta = piic.get_header() if isinstance(piic, PiiCollection) else None
+    with PiiBinaryWriter(filename, meta) as out:
+        for pii in piic:
+            out.add(pii)
+
+
+class PiiBinaryCollection:
+    """
+    A read-only PII collection stored in a binary file. It can be iterated
+    over (producing PiiEntity objects grouped by chunk and sorted by
+    position), and called with a chunk id to obtain the entities for a chunk.
+    """
+
+    def __init__(self, filename: str):
+        """
+         :param filename: name of the binary file
+        """
+        self.filename = str(filename)
+        with open(self.filename, "rb") as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise FileException("cannot map PII file {}: {}",
+                                    self.filename, e) from e
+        mm = self._mm
+        if mm[:8] != MAGIC:
+            raise FileException("not a binary PII collection: {}", self.filename)
+        hlen = int.from_bytes(mm[8:16], sys.byteorder)
+        header = json.loads(bytes(mm[16:16+hlen]))
+        if header.get("format") != FMT_PII_BINARY:
+            raise FileException("invalid binary PII collection: {}",
+                                self.filename)
+        check_format(header["metadata"], self.filename)
+        self.header = header["metadata"]
+        if "detectors" in self.header:
+            # JSON turned the detector ids into strings
+            self.header["detectors"] = {int(k): v for k, v in
+                                        self.header["detectors"].items()}
+        self._size = header["count"]
+        self._strings = header["strings"]
+        self._swap = header["byteorder"] != sys.byteorder
+
+        # Get the columns (as typed views over the mapping, if possible)
+        view = memoryview(mm)
+        sections = self._sections = header["sections"]
+        typecodes = dict(COLUMNS, value_offset="Q", extra_offset="Q",
+                         chunk_offset="Q")
+        self._cols = {}
+        for name, (offset, size) in sections.items():
+            data = view[offset:offset+size]
+            code = typecodes.get(name)
+            if code and self._swap:
+                data = array(code, data)
+                data.byteswap()
+            elif code:
+                data = data.cast(code)
+            self._cols[name] = data
+
+        self._chunk_index = None
+        self._info = {}
+
+
+    def __repr__(self) -> str:
+        return f"<PiiBinaryCollection #{self._size}>"
+
+
+    def __len__(self) -> int:
+        return self._size
+
+
+    def get_header(self) -> Dict:
+        return self.header
+
+
+    def column(self, name: str) -> Sequence[int]:
+        """
+        Return one of the integer columns (`chunk`, `pos`, `length`, `type`,
+        `lang`, `country`, `subtype`, or the offsets for `value`, `extra` &
+        `chunk` sections), as a typed view over the file
+        """
+        return self._cols[name]
+
+
+    def has_field(self, name: str) -> bool:
+        """
+        Check if any entity in the collection may have an optional field
+        (a quick check on the raw data, which can produce false positives)
+        """
+        if not self._size:
+            return False
+        offset, size = self._sections["extra"]
+        return self._mm.find(f'"{name}"'.encode("utf-8"), offset,
+                             offset + size) >= 0
+
+
+    def info(self, n: int) -> PiiEntityInfo:
+        """
+        Return the PiiEntityInfo object for the n-th entity
+        """
+        cols = self._cols
+        key = cols["type"][n], cols["lang"][n], cols["country"][n], \
+            cols["subtype"][n]
+        info = self._info.get(key)
+        if info is None:
+            ptype, lang, country, subtype = (
+                None if c == NONE_CODE else self._strings[t][c]
+                for t, c in zip(STRING_TABLES[1:], key))
+            info = self._info[key] = PiiEntityInfo(PiiEnum[ptype], lang,
+                                                   country, subtype)
+        return info
+
+
+    def value(self, n: int) -> str:
+        """
+        Return the value for the n-th entity
+        """
+        voff = self._cols["value_offset"]
+        return bytes(self._cols["value"][voff[n]:voff[n+1]]).decode("utf-8")
+
+
+    def fields(self, n: int) -> Dict:
+        """
+        Return the optional fields for the n-th entity
+        """
+        xoff = self._cols["extra_offset"]
+        extra = self._cols["extra"][xoff[n]:xoff[n+1]]
+        return json.loads(bytes(extra)) if len(extra) else {}
+
+
+    def entity(self, n: int) -> PiiEntity:
+        """
+        Build the PiiEntity object for the n-th entity
+        """
+        chunkid = self._strings["chunk"][self._cols["chunk"][n]]
+        return PiiEntity(self.info(n), self.value(n), chunkid,
+                         self._cols["pos"][n], **self.fields(n))
+
+
+    def __iter__(self) -> Iterator[PiiEntity]:
+        for n in range(self._size):
+            yield self.entity(n)
+
+
+    def __getitem__(self, n: int) -> PiiEntity:
+        if not -self._size <= n < self._size:
+            raise IndexError(n)
+        return self.entity(n % self._size)
+
+
+    def chunk_ids(self) -> List[str]:
+        """
+        Return the ids of all chunks with entities, in file order
+        """
+        return self._strings["chunk"]
+
+
+    def strings(self, name: str) -> List[str]:
+        """
+        Return one of the string tables (`chunk`, `type`, `lang`, `country`
+        or `subtype`), indexed by the codes in the corresponding column
+        """
+        return self._strings[name]
+
+
+    def __call__(self, chunkid: str) -> List[PiiEntity]:
+        """
+        Return the list of all PiiEntity instances for a chunk, sorted by
+        their position in the chunk
+        """
+        if self._chunk_index is None:
+            self._chunk_index = {c: n for n, c in enumerate(self.chunk_ids())}
+        n = self._chunk_index.get(str(chunkid))
+        if n is None:
+            return []
+        start, end = self._cols["chunk_offset"][n:n+2]
+        return [self.entity(i) for i in range(start, end)]
+
+
+    def to_collection(self) -> PiiCollection:
+        """
+        Load all the entities into a standard PiiCollection object
+        """
+        return piic_build(self.header, self)
+
+
+    def to_json(self) -> Dict:
+        """
+        Return a dictionary that is JSON-serializable (when using the
+        CustomJSONEncoder class), as in PiiCollection.to_json()
+        """
+        return {"metadata": self.get_header(), "pii_list": list(self)}
+
+
+    def close(self):
+        """
+        Release the file mapping
+        """
+        if self._mm is not None:
+            self._cols = {}
+            self._mm.close()
+            self._mm = None
+
+
+def load_pii(filename: str) -> Union[PiiCollection, PiiBinaryCollection]:
+    """
+    Load a PII collection from a file, in any of the supported formats (JSON,
+    NDJSON, YAML or binary)
+    """
+    if base_extension(filename) == ".piib":
+        return PiiBinaryCollection(filename)
+    piic = PiiCollectionLoader()
+    piic.load(filename)
+    return piic
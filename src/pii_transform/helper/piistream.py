@@ -0,0 +1,149 @@
+"""
+Read a PII collection from an NDJSON file as a stream, in lockstep with the
+iteration over document chunks, so that only the entities for the current
+chunk (plus a bounded lookahead) are kept in memory.
+
+The entities for each chunk must be contiguous in the file, and reading stops
+as soon as the group for the requested chunk ends. By default groups must
+also be in document order: a chunk whose group is not next in the file is
+taken as having no entities. Optionally, groups can appear in a different
+order, as long as the displacement fits in a lookahead buffer (the "spill",
+measured in entities): when the group for a chunk is not next, the entities
+for other chunks are then buffered while looking for it. In both cases an
+exception is raised if an entity appears after its chunk was processed.
+"""
+
+import json
+from operator import attrgetter
+from collections import defaultdict
+
+from typing import Dict, List, TextIO, Union, Optional
+
+from pii_data.helper.io import openfile, base_extension
+from pii_data.helper.exception import ProcException, InvArgException
+from pii_data.types import PiiEntity
+from pii_data.types.piicollection.loader import check_format
+
+
+# Maximum number of entities to keep in the lookahead buffer (by default,
+# none: chunk groups must be in document order)
+DEFAULT_SPILL = 0
+
+
+class PiiStreamReader:
+
+    def __init__(self, source: Union[str, TextIO], spill: int = None):
+        """
+         :param source: NDJSON file name, or an opened file-like object
+         :param spill: maximum number of entities in the lookahead buffer
+        """
+        if isinstance(source, str) and \
+           base_extension(source) not in (".ndjson", ".jsonl"):
+            raise InvArgException("streaming PII reading needs an NDJSON file: {}",
+                                  source)
+        self._name = source if isinstance(source, str) else "stream"
+        self._src = openfile(source, encoding="utf-8")
+        self._close = self._src is not source
+        self._spill = DEFAULT_SPILL if spill is None else spill
+
+        # Read the collection header
+        try:
+            self.header = json.loads(next(self._src))
+        except (StopIteration, json.JSONDecodeError) as e:
+            raise ProcException("cannot read PII collection header from {}: {}",
+                                self._name, e) from e
+        check_format(self.header, self._name)
+
+        self._pending = defaultdict(list)
+        self._num_pending = 0
+        self._done = set()
+        self._stats = {"entities": 0, "max_spill": 0}
+        self._next = self._read()
+
+
+    def __repr__(self) -> str:
+        return f"<PiiStreamReader {self._name}>"
+
+
+    def __enter__(self) -> "PiiStreamReader":
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _read(self) -> Optional[PiiEntity]:
+        """
+        Read the next entity from the source
+        """
+        for line in self._src:
+            if line.strip():
+                self._stats["entities"] += 1
+                return PiiEntity.fromdict(json.loads(line))
+        return None
+
+
+    def stats(self) -> Dict:
+        """
+        Return the number of entities read and the maximum lookahead used
+        """
+        return dict(self._stats)
+
+
+    def __call__(self, chunkid: str) -> List[PiiEntity]:
+        """
+        Return the list of all PiiEntity instances for a chunk, sorted by
+        their position in the chunk.
+        Note: it must be called with the chunk ids in document order.
+        """
+        chunkid = str(chunkid)
+        result = self._pending.pop(chunkid, [])
+        self._num_pending -= len(result)
+
+        while self._next is not None:
+            cid = str(self._next.fields["chunkid"])
+            if cid == chunkid:
+                result.append(self._next)
+            elif result:
+                # The (contiguous) group for this chunk has ended
+                break
+            elif cid in self._done:
+                raise ProcException("PII order mismatch in {}: entity for chunk '{}' found after the chunk was processed",
+                                    self._name, cid)
+            elif self._num_pending >= self._spill:
+                break
+            else:
+                # The group for this chunk is not next: look ahead for it,
+                # buffering the entities for other chunks
+                self._pending[cid].append(self._next)
+                self._num_pending += 1
+            self._next = self._read()
+
+        if self._num_pending > self._stats["max_spill"]:
+            self._stats["max_spill"] = self._num_pending
+        self._done.add(chunkid)
+        return sorted(result, key=attrgetter("pos"))
+
+
+    def finish(self):
+        """
+        Check that all entities have been consumed, and close the source
+        """
+        try:
+            if self._pending or self._next is not None:
+                cid = next(iter(self._pending), None) or \
+                    self._next.fields["chunkid"]
+                raise ProcException("PII order mismatch in {}: entities for chunk '{}' not consumed (not in document order, or not in the document)",
+                                    self._name, cid)
+        finally:
+            self.close()
+
+
+    def close(self):
+        """
+        Close the source
+        """
+        if self._close:
+            self._src.close()
+            self._close = False
@@ -10,11 +10,12 @@ Properties are:
  * the chosen value is maintained for subsequent appearances of the same
    PiiInstance (same type & value)
  * the list is rotated as much as needed
+ * alternatively, in deterministic mode, the value is chosen from the list by
+   a keyed hash of the PiiInstance, with no state at all
 """
 
 import random
 from pathlib import Path
-from functools import lru_cache
 from collections import defaultdict
 
 from typing import Union, List, Tuple, Dict
@@ -24,6 +25,8 @@ from pii_data.helper.config import load_config, load_single_config, TYPE_CONFIG_
 from pii_data.helper.exception import FileException
 
 from .. import defs
+from .misc import keyed_hash
+from .cache import LruCache
 
 # How many entities to keep in cache to be able to reassign the same value
 DEFAULT_CACHE_SIZE = 200
@@ -34,22 +37,28 @@ PH_FILENAME = "placeholder.json"
 
 class PlaceholderValue:
 
-    def __init__(self, config: Dict = None, cache_size: int = None):
+    def __init__(self, config: Dict = None, cache_size: int = None,
+                 key: str = None):
         """
          :param config: a generic PIISA configuration object
          :param cache_size: size of the LRU cache used to maintain consistency
            in assignments
+         :param key: activate deterministic mode, using this key to hash
+           PII instances
         """
         if config is None:
             config = {}
         elif isinstance(config, (Path, str)):
             config = load_config(config)        # backwards compatibility
+        trf_config = config.get(defs.FMT_CONFIG_TRANSFORM) or {}
+
+        # Deterministic mode
+        self._key = key if key is not None else trf_config.get("deterministic_key")
 
         # Prepare the cache
         if cache_size is None:
-            trf_config = config.get(defs.FMT_CONFIG_TRANSFORM, {})
             cache_size = trf_config.get("cache_size", DEFAULT_CACHE_SIZE)
-        self._cache = lru_cache(maxsize=cache_size)(self._rotate_value)
+        self._cache = LruCache(cache_size)
 
         # Dictionary to keep the indices of the last assigned value
         self._index = defaultdict(int)
@@ -76,7 +85,26 @@ class PlaceholderValue:
         """
         Remove all elements in the cache
         """
-        self._cache.cache_clear()
+        self._cache.clear()
+
+
+    def get_state(self) -> Dict:
+        """
+        Return the assignment state (the consistency cache and the rotation
+        indices), as a JSON-serializable dict
+        """
+        return {"index": dict(self._index),
+                "cache": [[k, v, c] for (k, v), c in self._cache.items()]}
+
+
+    def set_state(self, state: Dict):
+        """
+        Restore an assignment state produced by get_state()
+        """
+        self._index = defaultdict(int, state["index"])
+        self._cache.clear()
+        for key, value, choice in state["cache"]:
+            self._cache.put((key, value), choice)
 
 
     def _select_value(self, pii: PiiEntity) -> Union[str, List[str]]:
@@ -102,12 +130,9 @@ class PlaceholderValue:
         return country or pii_type
 
 
-    def _rotate_value(self, key: str, value: str, choices: Tuple[str]):
+    def _rotate_value(self, key: str, choices: Tuple[str]):
         """
-        Rotate the value to use from the list, keeping consistency in
-        assignments to the same PiiEntity values
-
-        Note: "value" is used as argument only to trigger LRU cache retrieval
+        Rotate the value to use from the list
         """
         # First time we use this key?
         num_choices = len(choices)
@@ -134,5 +159,15 @@ class PlaceholderValue:
 
         # If it's a list, choose the value to use
         info = pii.info
+        if self._key is not None:
+            h = keyed_hash(self._key, info.pii.name, info.lang, info.country,
+                           pii.fields["value"])
+            return value[h % len(value)]
+        # Keep consistency in assignments to the same PiiEntity values
         key = '/'.join(map(str, (info.pii, info.lang, info.country)))
-        return self._cache(key, pii.fields["value"], tuple(value))
+        ckey = key, pii.fields["value"]
+        choice = self._cache.get(ckey)
+        if choice is None:
+            choice = self._rotate_value(key, tuple(value))
+            self._cache.put(ckey, choice)
+        return choice
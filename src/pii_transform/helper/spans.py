@@ -0,0 +1,208 @@
+"""
+Resolve overlapping PII entities within a chunk, so that the substitutions
+can be applied as a list of non-overlapping edits.
+
+Entities are sorted by position and grouped into clusters of transitively
+overlapping spans in a single sweep. Each cluster is then resolved according
+to a strategy:
+ * `longest`: the longest entities win; entities overlapping one already kept
+   are dropped
+ * `score`: the same, but ranking entities by their detection score (with
+   length as tiebreaker)
+ * `merge`: the whole cluster becomes a single entity covering the union of
+   the spans, with the type & fields of the longest entity
+
+Span table slices are checked for overlaps using only the position columns;
+entities are built only for the clusters that need resolving.
+"""
+
+from bisect import bisect_left
+from operator import attrgetter
+
+from typing import List, Tuple, Iterable, Iterator, Callable
+
+from pii_data.helper.exception import InvArgException
+from pii_data.types import PiiEntity
+
+from .spantable import SpanTable, SpanSlice
+
+
+OVERLAP_STRATEGIES = ("longest", "score", "merge", "none")
+
+DEFAULT_OVERLAP = "longest"
+
+
+def _rank_longest(pii: PiiEntity) -> Tuple:
+    return -len(pii), pii.pos
+
+
+def pii_score(pii: PiiEntity) -> float:
+    """
+    Return the detection score of an entity (0 if it has none). It is taken
+    from the `extra` field (where detectors store it), or from the entity
+    fields
+    """
+    score = (pii.fields.get("extra") or {}).get("score")
+    if score is None:
+        score = pii.fields.get("score")
+    return score or 0
+
+
+def _rank_score(pii: PiiEntity) -> Tuple:
+    return -pii_score(pii), -len(pii), pii.pos
+
+
+def _clusters(piilist: List[PiiEntity]) -> Iterator[List[PiiEntity]]:
+    """
+    Group a list of entities, sorted by position, into clusters of
+    (transitively) overlapping spans
+    """
+    cluster = []
+    end = -1
+    for pii in piilist:
+        if cluster and pii.pos >= end:
+            yield cluster
+            cluster = []
+        cluster.append(pii)
+        end = max(end, pii.pos + len(pii))
+    if cluster:
+        yield cluster
+
+
+def _row_clusters(table: SpanTable,
+                  rows: Iterable[int]) -> Iterator[List[int]]:
+    """
+    Group rows in a span table, sorted by position, into clusters of
+    (transitively) overlapping spans
+    """
+    pos, length = table.pos, table.length
+    cluster = []
+    end = -1
+    for r in rows:
+        if cluster and pos[r] >= end:
+            yield cluster
+            cluster = []
+        cluster.append(r)
+        end = max(end, pos[r] + length[r])
+    if cluster:
+        yield cluster
+
+
+def _overlaps(table: SpanTable, rows: Iterable[int]) -> bool:
+    """
+    Check if there is any overlap in a sequence of rows sorted by position
+    """
+    pos, length = table.pos, table.length
+    end = -1
+    for r in rows:
+        if pos[r] < end:
+            return True
+        end = max(end, pos[r] + length[r])
+    return False
+
+
+def _select(cluster: List[PiiEntity], rank: Callable) -> List[PiiEntity]:
+    """
+    Keep the highest ranking entities in a cluster that do not overlap
+    """
+    starts, ends, kept = [], [], []
+    for pii in sorted(cluster, key=rank):
+        start, end = pii.pos, pii.pos + len(pii)
+        # The kept spans are disjoint: check the neighbours of the new one
+        n = bisect_left(starts, start)
+        if n < len(starts) and starts[n] < end:
+            continue
+        if n > 0 and ends[n-1] > start:
+            continue
+        starts.insert(n, start)
+        ends.insert(n, end)
+        kept.insert(n, pii)
+    return kept
+
+
+def _merge(cluster: List[PiiEntity]) -> PiiEntity:
+    """
+    Merge a cluster of overlapping entities into a single one
+    """
+    main = min(cluster, key=_rank_longest)
+    value = ""
+    start = end = cluster[0].pos
+    for pii in cluster:
+        pii_end = pii.pos + len(pii)
+        if pii_end > end:
+            value += pii.fields["value"][end - pii.pos:]
+            end = pii_end
+    fields = {k: v for k, v in main.fields.items()
+              if k not in ("type", "value", "chunkid")}
+    return PiiEntity(main.info, value, main.fields["chunkid"], start, **fields)
+
+
+class SpanResolver:
+
+    def __init__(self, strategy: str = None):
+        """
+         :param strategy: resolution strategy: "longest", "score", "merge" or
+           "none" (no resolution)
+        """
+        self.strategy = strategy or DEFAULT_OVERLAP
+        if self.strategy not in OVERLAP_STRATEGIES:
+            raise InvArgException("invalid overlap strategy: {}", strategy)
+        self.resolved = 0
+
+
+    def __repr__(self) -> str:
+        return f"<SpanResolver {self.strategy}>"
+
+
+    def __call__(self, piilist: Iterable[PiiEntity]) -> List[PiiEntity]:
+        """
+        Resolve overlaps in a list of entities in a chunk
+         :return: the list of resulting entities, sorted by position and with
+           no overlaps
+        """
+        piilist = sorted(piilist, key=attrgetter("pos"))
+        if self.strategy == "none":
+            return piilist
+        out = []
+        for cluster in _clusters(piilist):
+            if len(cluster) == 1:
+                out.append(cluster[0])
+                continue
+            out += self._resolve(cluster)
+        return out
+
+
+    def _resolve(self, cluster: List[PiiEntity]) -> List[PiiEntity]:
+        """
+        Resolve a cluster of overlapping entities
+        """
+        self.resolved += 1
+        if self.strategy == "merge":
+            return [_merge(cluster)]
+        rank = _rank_score if self.strategy == "score" else _rank_longest
+        return _select(cluster, rank)
+
+
+    def resolve_slice(self, spans: SpanSlice) -> SpanSlice:
+        """
+        Resolve overlaps in a span table slice for a chunk, with its rows
+        sorted by position
+         :return: a slice with no overlaps. If a resolved entity is not in the
+           table (i.e. a merged entity), it is a slice of a new table
+        """
+        table = spans.table
+        if self.strategy == "none" or not _overlaps(table, spans.rows):
+            return spans
+        out = []
+        for cluster in _row_clusters(table, spans.rows):
+            if len(cluster) == 1:
+                out.append(cluster[0])
+                continue
+            piilist = [table.entity(r) for r in cluster]
+            rows = {id(pii): r for pii, r in zip(piilist, cluster)}
+            out += [rows.get(id(pii), pii) for pii in self._resolve(piilist)]
+        if all(isinstance(r, int) for r in out):
+            return SpanSlice(table, out)
+        entities = [r if isinstance(r, PiiEntity) else table.entity(r)
+                    for r in out]
+        return SpanTable(entities, sort=False).all()
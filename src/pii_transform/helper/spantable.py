@@ -0,0 +1,234 @@
+"""
+The span table: the internal representation of a PII collection used by the
+transformer.
+
+The entities are kept as parallel integer arrays (chunk index, position,
+length and PiiEnum code, one element per row) plus references to their type
+info & value. The table is built once per collection: discarded entities are
+filtered out, and rows are grouped by chunk (in order of first appearance)
+and sorted by position, so that the entities for a chunk are a contiguous
+range of rows.
+
+Substitutions, overlap detection & splicing work on the arrays. PiiEntity
+objects are only requested when a policy needs one (and, for binary
+collections, built only then).
+"""
+
+from array import array
+
+from typing import Iterable, Iterator, Callable, Dict, Sequence, Tuple
+
+from pii_data.types import PiiCollection, PiiEntity, PiiEnum
+
+from .piibin import PiiBinaryCollection
+
+
+# Integer codes for the PII types
+PII_TYPES = tuple(PiiEnum)
+PII_CODES = {p: n for n, p in enumerate(PII_TYPES)}
+
+
+class SpanSlice:
+    """
+    A sequence of rows in a span table (typically, the entities in a chunk).
+    Iterating over it produces PiiEntity objects.
+    """
+
+    __slots__ = "table", "rows"
+
+    def __init__(self, table: "SpanTable", rows: Sequence[int]):
+        self.table = table
+        self.rows = rows
+
+
+    def __repr__(self) -> str:
+        return f"<SpanSlice #{len(self.rows)}>"
+
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+    def __iter__(self) -> Iterator[PiiEntity]:
+        entity = self.table.entity
+        return (entity(r) for r in self.rows)
+
+
+    def spans(self) -> Iterator[Tuple[int, int]]:
+        """
+        Return the (start, end) positions of the rows
+        """
+        pos, length = self.table.pos, self.table.length
+        for r in self.rows:
+            yield pos[r], pos[r] + length[r]
+
+
+class SpanTable:
+
+    def __init__(self, piic: Iterable[PiiEntity] = (),
+                 exclude: Callable[[PiiEntity], bool] = None,
+                 sort: bool = True):
+        """
+         :param piic: the PII entities: a PiiCollection, a PiiBinaryCollection
+           or any iterable of PiiEntity objects
+         :param exclude: a predicate selecting the entities to leave out
+         :param sort: group rows by chunk and sort them by position (if not,
+           rows keep the order of the entities)
+        """
+        self.chunk_ids = []
+        self._chunk_index = {}
+        self._info_dict = {}
+        if isinstance(piic, PiiBinaryCollection):
+            self._load_binary(piic, exclude)
+        else:
+            self._load(piic, exclude, sort)
+
+
+    def __repr__(self) -> str:
+        return f"<SpanTable #{len(self)}>"
+
+
+    def __len__(self) -> int:
+        return len(self.pos)
+
+
+    def _chunk_code(self, chunkid: str) -> int:
+        code = self._chunk_index.get(chunkid)
+        if code is None:
+            code = self._chunk_index[chunkid] = len(self.chunk_ids)
+            self.chunk_ids.append(chunkid)
+        return code
+
+
+    def _load(self, piic: Iterable[PiiEntity], exclude: Callable, sort: bool):
+        """
+        Build the table from PiiEntity objects
+        """
+        entities = piic.pii if isinstance(piic, PiiCollection) else piic
+        if exclude is not None:
+            entities = [pii for pii in entities if not exclude(pii)]
+        elif not isinstance(entities, list):
+            entities = list(entities)
+
+        chunk, pos, length = array("I"), array("Q"), array("I")
+        ptype = array("H")
+        infos, values = [], []
+        code = self._chunk_code
+        for pii in entities:
+            fields = pii.fields
+            value = fields["value"]
+            chunk.append(code(str(fields["chunkid"])))
+            pos.append(pii.pos)
+            length.append(len(value))
+            ptype.append(PII_CODES[pii.info.pii])
+            infos.append(pii.info)
+            values.append(value)
+
+        if sort and not _is_sorted(chunk, pos):
+            order = sorted(range(len(pos)), key=lambda n: (chunk[n], pos[n]))
+            chunk, pos, length, ptype = (
+                array(col.typecode, map(col.__getitem__, order))
+                for col in (chunk, pos, length, ptype))
+            entities, infos, values = ([col[n] for n in order]
+                                       for col in (entities, infos, values))
+
+        self.chunk, self.pos, self.length, self.ptype = chunk, pos, length, ptype
+        self.entity = entities.__getitem__
+        self.info = infos.__getitem__
+        self.value = values.__getitem__
+        self._starts = _chunk_starts(chunk, len(self.chunk_ids)) if sort else None
+
+
+    def _load_binary(self, piic: PiiBinaryCollection, exclude: Callable):
+        """
+        Build the table from a binary collection, using its columns directly
+        (the binary format is already grouped by chunk & sorted)
+        """
+        self.chunk_ids = list(piic.chunk_ids())
+        self._chunk_index = {c: n for n, c in enumerate(self.chunk_ids)}
+        cols = [piic.column(name) for name in ("chunk", "pos", "length")]
+        cols.append(_binary_ptypes(piic))
+
+        # Discarding needs entity fields: check only if there may be any
+        src = range(len(piic))
+        if exclude is not None and piic.has_field("process"):
+            src = array("Q", (n for n in src if not exclude(piic.entity(n))))
+            cols = [array(getattr(c, "typecode", None) or c.format,
+                          map(c.__getitem__, src)) for c in cols]
+            self._starts = _chunk_starts(cols[0], len(self.chunk_ids))
+        else:
+            self._starts = piic.column("chunk_offset")
+
+        self.chunk, self.pos, self.length, self.ptype = cols
+        self.entity = lambda r: piic.entity(src[r])
+        self.info = lambda r: piic.info(src[r])
+        self.value = lambda r: piic.value(src[r])
+
+
+    def info_fields(self, row: int) -> Dict:
+        """
+        Return the entity fields that depend only on type & value, as in
+        PiiEntity.asdict() (without building the entity)
+        """
+        info = self.info(row)
+        fields = self._info_dict.get(info)
+        if fields is None:
+            fields = self._info_dict[info] = info.asdict()
+        return {**fields, "value": self.value(row)}
+
+
+    def memo_key(self, row: int) -> Tuple:
+        """
+        Return the substitution memo key for a row (as in substitution.memo_key)
+        """
+        info = self.info(row)
+        return info.pii, info.lang, info.country, self.value(row)
+
+
+    def __call__(self, chunkid: str) -> SpanSlice:
+        """
+        Return the rows for a chunk
+        """
+        n = self._chunk_index.get(str(chunkid))
+        if n is None or self._starts is None:
+            return SpanSlice(self, range(0))
+        return SpanSlice(self, range(self._starts[n], self._starts[n+1]))
+
+
+    def all(self) -> SpanSlice:
+        """
+        Return all rows in the table
+        """
+        return SpanSlice(self, range(len(self)))
+
+
+def _is_sorted(chunk: Sequence[int], pos: Sequence[int]) -> bool:
+    """
+    Check if the rows are grouped by chunk (in order of first appearance)
+    and sorted by position
+    """
+    return all(c0 < c1 or (c0 == c1 and p0 <= p1)
+               for c0, c1, p0, p1 in zip(chunk, chunk[1:], pos, pos[1:]))
+
+
+def _chunk_starts(chunk: Sequence[int], num: int) -> array:
+    """
+    Compute the first row for each chunk in a sorted chunk column (plus the
+    end of the table)
+    """
+    starts = array("Q", [0] * (num + 1))
+    for c in chunk:
+        starts[c+1] += 1
+    for n in range(1, num + 1):
+        starts[n] += starts[n-1]
+    return starts
+
+
+def _binary_ptypes(piic: PiiBinaryCollection) -> Sequence[int]:
+    """
+    Map the type codes of a binary collection into PiiEnum codes
+    """
+    names = piic.strings("type")
+    remap = [PII_CODES[PiiEnum[name]] for name in names]
+    return array("H", map(remap.__getitem__, piic.column("type")))
+
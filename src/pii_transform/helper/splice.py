@@ -0,0 +1,102 @@
+"""
+A compact, lazy representation for a transformed text: the original text
+plus a list of edits to apply to it.
+
+The final string is built only when it is actually needed (and then it is
+built only once); writers can also stream the edits directly to a file
+without building it.
+"""
+
+from typing import List, Tuple, Iterator, TextIO
+
+
+TYPE_EDIT = Tuple[int, int, str]
+
+
+class SplicedText:
+    """
+    A text made of an original string plus a list of (start, end, replacement)
+    edits. Edits must be sorted by position and must not overlap.
+    """
+
+    __slots__ = "text", "edits", "_str"
+
+    def __init__(self, text: str, edits: List[TYPE_EDIT] = None):
+        """
+         :param text: the original text
+         :param edits: list of (start, end, replacement) tuples
+        """
+        self.text = text
+        self.edits = edits or []
+        self._str = None
+
+
+    def __repr__(self) -> str:
+        return f"<SplicedText #{len(self.text)} edits={len(self.edits)}>"
+
+
+    def __len__(self) -> int:
+        """
+        Return the length of the final text (without building it)
+        """
+        if self._str is not None:
+            return len(self._str)
+        return len(self.text) + sum(len(r) - (e - s) for s, e, r in self.edits)
+
+
+    def __str__(self) -> str:
+        """
+        Materialise the final text
+        """
+        if self._str is None:
+            self._str = "".join(self.parts()) if self.edits else self.text
+        return self._str
+
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, SplicedText):
+            other = str(other)
+        return str(self) == other
+
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+
+    def changed(self) -> bool:
+        """
+        Return True if the text has any edit
+        """
+        return bool(self.edits)
+
+
+    def parts(self) -> Iterator[str]:
+        """
+        Produce the final text as a sequence of string fragments
+        """
+        text = self.text
+        pos = 0
+        for start, end, repl in self.edits:
+            if start > pos:
+                yield text[pos:start]
+            yield repl
+            pos = end
+        if pos < len(text):
+            yield text[pos:] if pos else text
+
+
+    def write(self, out: TextIO) -> int:
+        """
+        Write the final text to a file-like object, without building it
+         :return: the number of characters written
+        """
+        if self._str is not None:
+            return out.write(self._str)
+        return sum(out.write(p) for p in self.parts())
+
+
+def materialise(data):
+    """
+    Return the final value for a chunk payload that might be a SplicedText
+    """
+    return str(data) if isinstance(data, SplicedText) else data
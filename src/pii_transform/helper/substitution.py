@@ -3,22 +3,32 @@ The main object performing PII value substitution
 """
 import random
 import hashlib
+from string import Formatter
+from functools import lru_cache
+from collections import defaultdict
 
-from typing import Union, Dict, Callable
+from typing import Union, Dict, Callable, Iterable, List, Tuple, Optional
 
 from pii_data.helper.exception import InvArgException
 from pii_data.types import PiiEnum, PiiEntity
 
 from .. import defs
 from .placeholder import PlaceholderValue
-from .synthetic import SyntheticValue, PROVIDER as SYNT_PROVIDER
+from .vault import PiiVault
+from .spantable import SpanTable, SpanSlice
+from .misc import random_state, set_random_state
+from .dictionary import DictionaryValue
 
 
 DEFAULT_POLICY = "label"
 
+# Available engines for the synthetic policy
+SYNTHETIC_ENGINES = ("faker", "table")
+DEFAULT_SYNTHETIC_ENGINE = "faker"
+
 POLICIES = (
     "passthrough", "redact", "hash", "label", "placeholder",
-    "synthetic", "annotate", "custom"
+    "synthetic", "annotate", "custom", "dictionary"
 )
 
 TEMPLATES = {
@@ -31,6 +41,16 @@ TEMPLATES = {
 
 DEFAULT_HASH_SIZE = 16
 
+# Entity fields that depend only on the entity type & value
+INFO_FIELDS = frozenset(("type", "value", "lang", "country", "subtype"))
+
+# Entity fields used as key for the substitution memo
+MEMO_FIELDS = frozenset(("type", "value", "lang", "country"))
+
+# Default maximum number of entries in the substitution memo (it is emptied
+# when full)
+DEFAULT_MEMO_SIZE = 10000
+
 
 
 class Hasher():
@@ -52,6 +72,18 @@ class Hasher():
         h = hashlib.sha512(bstring).digest()
         return h[:self.size].hex('-', 4)
 
+    def substitute_batch(self, piilist: List[PiiEntity]) -> List[str]:
+        """
+        Hash a list of PiiEntity instances
+        """
+        key, size, sha = self.key, self.size, hashlib.sha512
+        out = []
+        for pii in piilist:
+            fields = pii.fields
+            bstring = (key + fields["type"] + str(fields["value"])).encode('utf-8')
+            out.append(sha(bstring).digest()[:size].hex('-', 4))
+        return out
+
 
 # -------------------------------------------------------------------------
 
@@ -80,6 +112,23 @@ class DefaultEmpty(dict):
         return ""
 
 
+@lru_cache(maxsize=64)
+def template_fields(template: str) -> frozenset:
+    """
+    Return the set of entity fields used by a template
+    """
+    return frozenset(f[1] for f in Formatter().parse(template)
+                     if f[1] is not None)
+
+
+def memo_key(pii: PiiEntity) -> Tuple:
+    """
+    Return the key used to memoize the substitution for an entity
+    """
+    info = pii.info
+    return info.pii, info.lang, info.country, pii.fields["value"]
+
+
 # -------------------------------------------------------------------------
 
 
@@ -97,6 +146,14 @@ class PiiSubstitutionValue:
         self._config = config or {}
         cfg = self._config.get(defs.FMT_CONFIG_TRANSFORM) or {}
 
+        # The memo for already computed substitutions
+        self._memo = {} if cfg.get("memo", True) else None
+        self._memo_size = cfg.get("memo_size", DEFAULT_MEMO_SIZE)
+        self._memo_stats = {"hits": 0, "misses": 0}
+
+        # The vault to record substitutions, if requested
+        self.vault = self._vault(cfg.get("vault"))
+
         # Set the random seed, if needed
         self.seed = seed if seed is not None else cfg.get("seed")
         if self.seed:
@@ -114,6 +171,24 @@ class PiiSubstitutionValue:
         return f"<PiiSubstitutionValue #{len(self._assign)}>"
 
 
+    @staticmethod
+    def _vault(config: Union[str, Dict, None]) -> Optional[PiiVault]:
+        """
+        Open the substitution vault
+         :param config: either the vault directory, or a dictionary with
+           `path` and optional `batch_size` & `segment_size` fields
+        """
+        if not config:
+            return None
+        if not isinstance(config, dict):
+            config = {"path": config}
+        try:
+            return PiiVault(config["path"], batch_size=config.get("batch_size"),
+                            segment_size=config.get("segment_size"))
+        except KeyError as e:
+            raise InvArgException("vault config needs a path") from e
+
+
     def _policy(self, policy: Union[str, Dict]) -> Callable:
         """
         Compose & return a policy process
@@ -139,16 +214,38 @@ class PiiSubstitutionValue:
                 self._cache[pname] = PlaceholderValue(self._config)
             return self._cache[pname]
         elif pname == "synthetic":
-            if pname not in self._cache:
-                cfg = self._config.get(defs.FMT_CONFIG_TRANSFORM)
-                self._cache[pname] = SyntheticValue(cfg, seed=self.seed)
-            return self._cache[pname]
+            cfg = self._config.get(defs.FMT_CONFIG_TRANSFORM) or {}
+            engine = policy.get("engine") or cfg.get("synthetic_engine",
+                                                     DEFAULT_SYNTHETIC_ENGINE)
+            if engine not in SYNTHETIC_ENGINES:
+                raise InvArgException("unsupported synthetic engine: {}", engine)
+            name = f"{pname}/{engine}"
+            if name not in self._cache:
+                # Import on demand, so that Faker is only loaded if needed
+                if engine == "table":
+                    from .synthetic_table import TableSyntheticValue as Synth
+                else:
+                    from .synthetic import SyntheticValue as Synth
+                self._cache[name] = Synth(cfg, seed=self.seed)
+            return self._cache[name]
         elif pname == "hash":
             try:
                 key = policy["key"]
             except KeyError as e:
                 raise InvArgException("hash policy needs a key") from e
             return Hasher(key, size=policy.get("size"))
+        elif pname == "dictionary":
+            try:
+                path = str(policy["path"])
+            except KeyError as e:
+                raise InvArgException("dictionary policy needs a path") from e
+            fallback = self._policy(policy.get("fallback") or DEFAULT_POLICY)
+            if isinstance(fallback, DictionaryValue):
+                raise InvArgException("the fallback for a dictionary policy cannot be another dictionary")
+            name = f"{pname}:{path}"
+            if name not in self._cache:
+                self._cache[name] = DictionaryValue(path, fallback)
+            return self._cache[name]
         elif pname == "custom":
             try:
                 return policy["template"]
@@ -163,24 +260,233 @@ class PiiSubstitutionValue:
         """
         Reset all caches (i.e. forget all previous substitutions)
         """
+        if self._memo:
+            self._memo.clear()
         for p in self._assign.values():
             if hasattr(p, "reset"):
                 p.reset()
 
 
+    def clear_memo(self):
+        """
+        Empty the substitution memo (it does not affect consistency of
+        substitutions, only speed)
+        """
+        if self._memo:
+            self._memo.clear()
+
+
+    def get_state(self) -> Dict:
+        """
+        Return the substitution state: the consistency caches & rotation
+        state of the policies, the memo and the global random generator
+        state, as a JSON-serializable dict. Restoring it with set_state()
+        produces the same assignments from then on
+        """
+        state = {"random": random_state(),
+                 "policies": {name: p.get_state()
+                              for name, p in self._cache.items()
+                              if hasattr(p, "get_state")}}
+        if self._memo is not None:
+            state["memo"] = [[k[0].name, *k[1:], v]
+                             for k, v in self._memo.items()]
+        return state
+
+
+    def set_state(self, state: Dict):
+        """
+        Restore a substitution state produced by get_state()
+        """
+        for name, pstate in state["policies"].items():
+            if name not in self._cache:
+                raise InvArgException("cannot restore state for policy '{}': not in the configuration",
+                                      name)
+            self._cache[name].set_state(pstate)
+        if self._memo is not None:
+            self._memo.clear()
+            for ptype, lang, country, value, subst in state.get("memo", []):
+                self._memo[PiiEnum[ptype], lang, country, value] = subst
+        set_random_state(state["random"])
+
+
+    def close(self):
+        """
+        Flush all pending substitution records to the vault (if any), and
+        release the dictionary mappings
+        """
+        if self.vault is not None:
+            self.vault.close()
+        for p in self._cache.values():
+            if isinstance(p, DictionaryValue):
+                p.dictionary.close()
+
+
+    def stats(self) -> Dict:
+        """
+        Return statistics on the substitution memo (and on dictionary
+        lookups, if the dictionary policy is used)
+        """
+        hits, misses = self._memo_stats["hits"], self._memo_stats["misses"]
+        stats = {
+            "memo_size": len(self._memo) if self._memo is not None else None,
+            "memo_hits": hits,
+            "memo_misses": misses,
+            "memo_hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
+        dicts = [p for p in self._cache.values()
+                 if isinstance(p, DictionaryValue)]
+        if dicts:
+            stats["dictionary_hits"] = sum(d.stats["hits"] for d in dicts)
+            stats["dictionary_misses"] = sum(d.stats["misses"] for d in dicts)
+        return stats
+
+
+    def _memo_get(self, key: Tuple) -> Optional[str]:
+        """
+        Look up a substitution in the memo, updating statistics
+        """
+        value = self._memo.get(key)
+        self._memo_stats["misses" if value is None else "hits"] += 1
+        return value
+
+
+    def _memo_put(self, proc: Union[str, Callable], key: Tuple, value: str):
+        """
+        Store a substitution in the memo, if the processor produces the same
+        result for all entities having the same memo key
+        """
+        if isinstance(proc, str) and not template_fields(proc) <= MEMO_FIELDS:
+            return
+        if self._memo_size and len(self._memo) >= self._memo_size:
+            self._memo.clear()
+        self._memo[key] = value
+
+
+    def _resolve(self, ptype: PiiEnum) -> Union[str, Callable]:
+        """
+        Find the substitution processor for a PII type.
+        For Synthetic ensure we've got a provider, else use the default
+        """
+        proc = self._assign.get(ptype.name) or self._assign["default"]
+        return self._provided(proc, ptype)
+
+
+    def _provided(self, proc: Union[str, Callable],
+                  ptype: PiiEnum) -> Union[str, Callable]:
+        """
+        Check that a processor can handle a PII type, else use the default
+        """
+        providers = getattr(proc, "providers", None)
+        if providers is not None and ptype not in providers:
+            proc = self._policy(DEFAULT_POLICY)
+        return proc
+
+
     def __call__(self, pii: PiiEntity) -> str:
         """
         Find the substitution string for an entity, according to the installed
         policies
         """
-        # Find the substitution processor.
-        # For Synthetic ensure we've got a provider, else use the default
-        proc = self._assign.get(pii.fields["type"]) or self._assign["default"]
-        if isinstance(proc, SyntheticValue) and pii.info.pii not in SYNT_PROVIDER:
-            proc = self._policy(DEFAULT_POLICY)
+        # Check the memo
+        if self._memo is not None:
+            key = memo_key(pii)
+            value = self._memo_get(key)
+            if value is not None:
+                return value
+
+        proc = self._resolve(pii.info.pii)
+
+        # Dictionary policy: look up the value, and use the fallback on misses
+        if isinstance(proc, DictionaryValue):
+            value = proc.get(pii.info.pii, pii.fields["value"])
+            if value is not None:
+                return value
+            proc = self._provided(proc.fallback, pii.info.pii)
 
         # Apply the processor
         if isinstance(proc, str):
-            return proc.format_map(DefaultEmpty(pii.asdict()))
+            value = proc.format_map(DefaultEmpty(pii.asdict()))
         else:
-            return proc(pii)
+            value = proc(pii)
+
+        if self._memo is not None:
+            self._memo_put(proc, key, value)
+        return value
+
+
+    def substitute_batch(self, entities: Iterable[PiiEntity]) -> List[str]:
+        """
+        Find the substitution strings for a batch of entities.
+         :param entities: the entities to substitute
+         :return: the list of substitutions, in the same order as the input
+        """
+        return self.substitute_spans([SpanTable(entities, sort=False).all()])
+
+
+    def substitute_spans(self, spans: Iterable[SpanSlice]) -> List[str]:
+        """
+        Find the substitution strings for a batch of span table rows. Rows
+        are grouped by policy and deduplicated by type & value, and each
+        policy processes its group in a single call. PiiEntity objects are
+        requested only for policies that need them, and only on memo misses.
+         :param spans: the span table slices to substitute
+         :return: the list of substitutions, in the same order as the input
+        """
+        out = []
+        memo = self._memo
+
+        # Group the rows by processor, and dedup them by type & value
+        groups = defaultdict(dict)
+        for span in spans:
+            table = span.table
+            for row in span.rows:
+                n = len(out)
+                out.append(None)
+                info, value = table.info(row), table.value(row)
+                if memo is not None:
+                    cached = self._memo_get((info.pii, info.lang, info.country,
+                                             value))
+                    if cached is not None:
+                        out[n] = cached
+                        continue
+                proc = self._resolve(info.pii)
+                if isinstance(proc, DictionaryValue):
+                    repl = proc.get(info.pii, value)
+                    if repl is not None:
+                        out[n] = repl
+                        continue
+                    proc = self._provided(proc.fallback, info.pii)
+                if isinstance(proc, str) and \
+                   not template_fields(proc) <= INFO_FIELDS:
+                    key = n     # cannot be reused
+                else:
+                    key = info, value
+                group = groups[proc]
+                if memo is not None and key in group:
+                    # A repeated entity within the batch reuses the
+                    # substitution: count it as a memo hit
+                    self._memo_stats["misses"] -= 1
+                    self._memo_stats["hits"] += 1
+                group.setdefault(key, []).append((n, table, row))
+
+        # Process each group
+        for proc, items in groups.items():
+            unique = [idx[0][1:] for idx in items.values()]
+            if isinstance(proc, str):
+                fields = template_fields(proc) <= INFO_FIELDS
+                values = [proc.format_map(DefaultEmpty(
+                    table.info_fields(row) if fields else
+                    table.entity(row).asdict())) for table, row in unique]
+            else:
+                entities = [table.entity(row) for table, row in unique]
+                if hasattr(proc, "substitute_batch"):
+                    values = proc.substitute_batch(entities)
+                else:
+                    values = [proc(p) for p in entities]
+            for idx, v, (table, row) in zip(items.values(), values, unique):
+                for n, _, _ in idx:
+                    out[n] = v
+                if memo is not None:
+                    self._memo_put(proc, table.memo_key(row), v)
+
+        return out
@@ -2,11 +2,11 @@
 A class to provide substitution values for PiiEntity instances, by creating
 synthetic fake values using the Faker package
 """
-from functools import lru_cache
 from collections import defaultdict
 import random
 
 from faker import Faker
+import faker.generator
 from faker.config import AVAILABLE_LOCALES
 
 from typing import Dict, Callable
@@ -14,6 +14,10 @@ from typing import Dict, Callable
 from pii_data.types import PiiEntity, PiiEntityInfo, PiiEnum
 from pii_data.helper.exception import UnimplementedException
 
+from .misc import keyed_hash, info_tolist, info_fromlist, random_state, \
+    set_random_state
+from .cache import LruCache
+
 try:
     from pii_extract import LANG_ANY
 except ImportError:
@@ -79,13 +83,17 @@ PROVIDER = {
 
 class SyntheticValue:
 
+    providers = PROVIDER
+
     def __init__(self, config: Dict = None, seed: int = None,
-                 cache_size: int = None):
+                 cache_size: int = None, key: str = None):
         """
          :param config: configuration to use for this module
          :param seed: set random seed
          :param cache_size: size of the LRU cache used to maintain consistency
            in assignments
+         :param key: activate deterministic mode, using this key to hash
+           PII instances
         """
         if config is None:
             config = {}
@@ -101,7 +109,7 @@ class SyntheticValue:
         # Prepare the cache
         if cache_size is None:
             cache_size = config.get("cache_size", DEFAULT_CACHE_SIZE)
-        self._cache = lru_cache(maxsize=cache_size)(self._fetch_value)
+        self._cache = LruCache(cache_size)
 
         # Set the random seed, if needed
         self.seed = seed if seed is not None else config.get("seed")
@@ -109,6 +117,9 @@ class SyntheticValue:
             Faker.seed(self.seed)
             random.seed(self.seed)
 
+        # Deterministic mode
+        self._key = key if key is not None else config.get("deterministic_key")
+
 
     def __repr__(self) -> str:
         return "<SyntheticValue>"
@@ -118,12 +129,37 @@ class SyntheticValue:
         """
         Remove elements in the cache
         """
-        self._cache.cache_clear()
+        self._cache.clear()
+
+
+    def get_state(self) -> Dict:
+        """
+        Return the assignment state (the consistency cache and the state of
+        the random generator shared by Faker instances), as a
+        JSON-serializable dict
+        """
+        return {"cache": [[info_tolist(i), v, s]
+                          for (i, v), s in self._cache.items()],
+                "random": random_state(faker.generator.random)}
+
+
+    def set_state(self, state: Dict):
+        """
+        Restore an assignment state produced by get_state()
+        """
+        self._cache.clear()
+        for info, value, subst in state["cache"]:
+            self._cache.put((info_fromlist(info), value), subst)
+        set_random_state(state["random"], faker.generator.random)
 
 
-    def _fetch_value(self, info: PiiEntityInfo, value: str) -> str:
+    def _fetch_value(self, info: PiiEntityInfo, value: str,
+                     rng: random.Random = random) -> str:
         """
         Select the value to apply from the placeholder database
+         :param info: the entity information
+         :param value: the entity value
+         :param rng: random number generator to use for locale choices
         """
         # Define lang & country
         lang = info.lang or "en"
@@ -134,7 +170,7 @@ class SyntheticValue:
             raise UnimplementedException("no countries available for lang: {}",
                                          lang)
         if country not in self._countries[lang]:
-            country = random.choice(self._countries[lang])
+            country = rng.choice(self._countries[lang])
         faker_loc = f"{lang}_{country}"
         #print("\nINPUT:", info, faker_loc)
 
@@ -145,7 +181,7 @@ class SyntheticValue:
                                          info.pii.name)
         elif isinstance(provider_name, dict):
             if faker_loc not in provider_name:
-                faker_loc = random.choice(list(provider_name))
+                faker_loc = rng.choice(list(provider_name))
             provider_name = provider_name[faker_loc]
 
         #print("=>", faker_loc, provider_name)
@@ -154,6 +190,8 @@ class SyntheticValue:
         if faker_loc not in self.faker:
             self.faker[faker_loc] = Faker(faker_loc)
         faker = self.faker[faker_loc]
+        if rng is not random:
+            faker.seed_instance(rng.getrandbits(64))
 
         # Look up the provider and execute it
         if isinstance(provider_name, Callable):
@@ -167,4 +205,16 @@ class SyntheticValue:
         """
         Return the appropriate placeholder value for a given PiiEntity
         """
-        return self._cache(pii.info, pii.fields["value"])
+        if self._key is None:
+            key = pii.info, pii.fields["value"]
+            value = self._cache.get(key)
+            if value is None:
+                value = self._fetch_value(*key)
+                self._cache.put(key, value)
+            return value
+
+        # Deterministic mode: all random choices derive from the entity hash
+        info = pii.info
+        value = pii.fields["value"]
+        h = keyed_hash(self._key, info.pii.name, info.lang, info.country, value)
+        return self._fetch_value(info, value, random.Random(h))
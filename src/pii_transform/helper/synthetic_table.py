@@ -0,0 +1,405 @@
+"""
+A class to provide substitution values for PiiEntity instances, by creating
+synthetic fake values from precompiled value tables and pattern generators.
+
+This is a lightweight alternative to the Faker-based SyntheticValue class: it
+does not need Faker at all, and all values are produced by sampling from
+in-memory arrays or by filling simple patterns.
+"""
+
+import json
+import random
+import unicodedata
+from pathlib import Path
+from collections import defaultdict
+
+from typing import Dict, List, Callable
+
+from pii_data.types import PiiEntity, PiiEnum
+from pii_data.helper.exception import UnimplementedException
+
+from .cache import LruCache
+from .misc import keyed_hash, info_tolist, info_fromlist, random_state, \
+    set_random_state
+
+try:
+    from pii_extract import LANG_ANY
+except ImportError:
+    LANG_ANY = "any"
+
+
+# How many entities to keep in cache to be able to reassign the same value
+DEFAULT_CACHE_SIZE = 200
+
+# Default filename containing the value tables
+TABLES_FILENAME = "synthetic-tables.json"
+
+# Pattern characters
+PATTERN_CHARS = {
+    "#": "0123456789",
+    "%": "123456789",
+    "$": "23456789",
+    "?": "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+}
+
+# Value table (or pattern generator) used for each PII type
+PROVIDER = {
+    PiiEnum.PERSON: ("first_name", "last_name"),
+    PiiEnum.EMAIL_ADDRESS: ("first_name", "last_name"),
+    PiiEnum.LOCATION: ("city",),
+    PiiEnum.PHONE_NUMBER: ("phone",),
+    PiiEnum.GOV_ID: ("gov_id",),
+    PiiEnum.BANK_ACCOUNT: (),
+    PiiEnum.CREDIT_CARD: (),
+    PiiEnum.IP_ADDRESS: ()
+}
+
+TYPE_GEN = Callable[[random.Random, int], List[str]]
+
+
+# -------------------------------------------------------------------------
+
+
+def fill_pattern(pattern: str, rng: random.Random,
+                 chars: Dict[str, str] = PATTERN_CHARS) -> str:
+    """
+    Fill a pattern: `#` is a digit, `%` a non-zero digit, `$` a digit
+    between 2 and 9 and `?` an uppercase letter. All other characters are
+    copied verbatim
+    """
+    return "".join(rng.choice(chars[c]) if c in chars else c for c in pattern)
+
+
+def luhn_digit(digits: str) -> str:
+    """
+    Compute the Luhn check digit for a string of digits
+    """
+    total = 0
+    for n, d in enumerate(reversed(digits)):
+        d = int(d)
+        if n % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+
+def iban_check(country: str, bban: str) -> str:
+    """
+    Compute the two IBAN check digits for a country code & a BBAN
+    """
+    num = "".join(str(int(c, 36)) for c in bban + country + "00")
+    return f"{98 - int(num) % 97:02d}"
+
+
+def ascii_fold(name: str) -> str:
+    """
+    Convert a name to a lowercase ASCII-only string, usable in an email
+    """
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore")
+    return "".join(c for c in name.decode("ascii").lower() if c.isalnum())
+
+
+# Check/normalization functions for government ids
+
+def _check_ssn(value: str, rng: random.Random) -> str:
+    area, group, serial = value.split("-")
+    if area in ("000", "666") or area[0] == "9":
+        area = f"{rng.randint(1, 665):03d}"
+    if group == "00":
+        group = f"{rng.randint(1, 99):02d}"
+    if serial == "0000":
+        serial = f"{rng.randint(1, 9999):04d}"
+    return f"{area}-{group}-{serial}"
+
+
+def _check_sin(value: str, rng: random.Random) -> str:
+    value += luhn_digit(value)
+    return f"{value[:3]} {value[3:6]} {value[6:]}"
+
+
+def _check_nif(value: str, rng: random.Random) -> str:
+    return value + "TRWAGMYFPDXBNJZSQVHLCKE"[int(value) % 23]
+
+
+def _check_rut(value: str, rng: random.Random) -> str:
+    digits = value.replace(".", "")
+    total = sum(int(d) * (2 + n % 6) for n, d in enumerate(reversed(digits)))
+    dv = 11 - total % 11
+    return f"{value}-{'0' if dv == 11 else 'K' if dv == 10 else dv}"
+
+
+def _check_curp(value: str, rng: random.Random) -> str:
+    date = f"{value[4:6]}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+    return value[:4] + date + rng.choice("HM") + value[11:]
+
+
+GOVID_CHECK = {
+    "ssn": _check_ssn,
+    "sin": _check_sin,
+    "nif": _check_nif,
+    "rut": _check_rut,
+    "curp": _check_curp
+}
+
+
+# -------------------------------------------------------------------------
+
+
+class TableSyntheticValue:
+
+    providers = PROVIDER
+
+    def __init__(self, config: Dict = None, seed: int = None,
+                 cache_size: int = None, key: str = None):
+        """
+         :param config: configuration to use for this module
+         :param seed: set random seed
+         :param cache_size: size of the LRU cache used to maintain consistency
+           in assignments
+         :param key: activate deterministic mode, using this key to hash
+           PII instances
+        """
+        if config is None:
+            config = {}
+
+        # Load the value tables
+        base = Path(__file__).parents[1] / "resources" / TABLES_FILENAME
+        with open(config.get("synthetic_tables", base), encoding="utf-8") as f:
+            tables = json.load(f)
+        self._tables = {k: {n: tuple(v) if isinstance(v, list) else v
+                            for n, v in t.items()}
+                        for k, t in tables["locales"].items()}
+        self._default = tables.get("default", {})
+        self._domains = tuple(tables["email_domain"])
+        self._cards = [(tuple(c["prefix"]), c["length"])
+                       for c in tables["credit_card"]]
+        self._iban = config.get("iban", False)
+
+        # Available countries per language
+        self._countries = defaultdict(list)
+        for loc in sorted(self._tables):
+            lang, country = loc.split("_")
+            self._countries[lang].append(country)
+
+        # Generators, indexed by (PiiEnum, locale)
+        self._gen = {}
+
+        # Prepare the cache
+        if cache_size is None:
+            cache_size = config.get("cache_size", DEFAULT_CACHE_SIZE)
+        self._cache = LruCache(cache_size)
+
+        # Set the random seed, if needed
+        self.seed = seed if seed is not None else config.get("seed")
+        self._rng = random.Random(self.seed)
+
+        # Deterministic mode
+        self._key = key if key is not None else config.get("deterministic_key")
+
+
+    def __repr__(self) -> str:
+        return f"<TableSyntheticValue #{len(self._tables)}>"
+
+
+    def reset(self):
+        """
+        Remove elements in the cache
+        """
+        self._cache.clear()
+
+
+    def get_state(self) -> Dict:
+        """
+        Return the assignment state (the consistency cache and the random
+        generator state), as a JSON-serializable dict
+        """
+        return {"cache": [[info_tolist(i), v, s]
+                          for (i, v), s in self._cache.items()],
+                "random": random_state(self._rng)}
+
+
+    def set_state(self, state: Dict):
+        """
+        Restore an assignment state produced by get_state()
+        """
+        self._cache.clear()
+        for info, value, subst in state["cache"]:
+            self._cache.put((info_fromlist(info), value), subst)
+        set_random_state(state["random"], self._rng)
+
+
+    def _locale(self, ptype: PiiEnum, lang: str, country: str,
+                rng: random.Random) -> str:
+        """
+        Find the locale to use for a PII type, language & country
+        """
+        if not lang or lang == LANG_ANY:
+            lang = "en"
+        country = country.upper() if country else None
+        if lang not in self._countries:
+            raise UnimplementedException("no countries available for lang: {}",
+                                         lang)
+        if country not in self._countries[lang]:
+            country = rng.choice(self._countries[lang])
+        loc = f"{lang}_{country}"
+
+        # Ensure the locale has the tables needed for this PII type
+        needed = PROVIDER[ptype]
+        if not all(t in self._tables[loc] for t in needed):
+            loc = rng.choice([k for k, v in self._tables.items()
+                                    if all(t in v for t in needed)])
+        return loc
+
+
+    def _build(self, ptype: PiiEnum, loc: str) -> TYPE_GEN:
+        """
+        Build the generator for a PII type & locale
+        """
+        table = self._tables[loc]
+
+        if ptype == PiiEnum.PERSON:
+            first, last = table["first_name"], table["last_name"]
+            return lambda rng, n: [f"{f} {l}" for f, l in
+                                   zip(rng.choices(first, k=n),
+                                       rng.choices(last, k=n))]
+
+        elif ptype == PiiEnum.EMAIL_ADDRESS:
+            first = tuple(map(ascii_fold, table["first_name"]))
+            last = tuple(map(ascii_fold, table["last_name"]))
+            forms = ("{f}.{l}", "{i}{l}", "{f}{n}", "{l}.{f}", "{f}_{l}{n}")
+            return lambda rng, n: [
+                fm.format(f=f, l=l, i=f[:1], n=rng.randrange(100)) + "@" + d
+                for fm, f, l, d in zip(rng.choices(forms, k=n),
+                                       rng.choices(first, k=n),
+                                       rng.choices(last, k=n),
+                                       rng.choices(self._domains, k=n))]
+
+        elif ptype == PiiEnum.LOCATION:
+            city = table["city"]
+            return lambda rng, n: rng.choices(city, k=n)
+
+        elif ptype == PiiEnum.PHONE_NUMBER:
+            phone = table["phone"]
+            return lambda rng, n: [fill_pattern(p, rng)
+                                   for p in rng.choices(phone, k=n)]
+
+        elif ptype == PiiEnum.GOV_ID:
+            govid = table["gov_id"]
+            chars = PATTERN_CHARS
+            if "letters" in govid:
+                chars = {**chars, "?": govid["letters"]}
+            check = GOVID_CHECK.get(govid.get("check"), lambda v, r: v)
+            return lambda rng, n: [check(fill_pattern(govid["pattern"], rng,
+                                                      chars), rng)
+                                   for _ in range(n)]
+
+        elif ptype == PiiEnum.BANK_ACCOUNT:
+            bban = table.get("bban") or self._default["bban"]
+            country = loc[3:] if "bban" in table else "GB"
+            if not self._iban:
+                return lambda rng, n: [fill_pattern(bban, rng)
+                                       for _ in range(n)]
+            def _iban(rng, n):
+                out = [fill_pattern(bban, rng) for _ in range(n)]
+                return [country + iban_check(country, b) + b for b in out]
+            return _iban
+
+        elif ptype == PiiEnum.CREDIT_CARD:
+            def _card(rng, n):
+                out = []
+                for prefixes, length in rng.choices(self._cards, k=n):
+                    num = rng.choice(prefixes)
+                    num += fill_pattern("#"*(length - len(num) - 1), rng)
+                    out.append(num + luhn_digit(num))
+                return out
+            return _card
+
+        elif ptype == PiiEnum.IP_ADDRESS:
+            nets = (("10", 0, 255), ("172", 16, 31), ("192", 168, 168))
+            return lambda rng, n: [
+                f"{a}.{rng.randint(lo, hi)}.{rng.randrange(256)}.{rng.randint(1, 254)}"
+                for a, lo, hi in rng.choices(nets, k=n)]
+
+        raise UnimplementedException("synthetic policy unavailable for {}",
+                                     ptype.name)
+
+
+    def _generator(self, ptype: PiiEnum, loc: str) -> TYPE_GEN:
+        """
+        Get the generator for a PII type & locale (building it if needed)
+        """
+        key = ptype, loc
+        gen = self._gen.get(key)
+        if gen is None:
+            gen = self._gen[key] = self._build(ptype, loc)
+        return gen
+
+
+    def generate(self, ptype: PiiEnum, lang: str = None, country: str = None,
+                 num: int = 1, rng: random.Random = None) -> List[str]:
+        """
+        Generate a batch of synthetic values for a given PII type
+         :param ptype: the PII type
+         :param lang: language for the values
+         :param country: country for the values
+         :param num: number of values to generate
+         :param rng: random number generator to use (default is the
+           object-wide generator)
+        """
+        if ptype not in PROVIDER:
+            raise UnimplementedException("synthetic policy unavailable for {}",
+                                         ptype.name)
+        if rng is None:
+            rng = self._rng
+        loc = self._locale(ptype, lang, country, rng)
+        return self._generator(ptype, loc)(rng, num)
+
+
+    def __call__(self, pii: PiiEntity) -> str:
+        """
+        Return the appropriate synthetic value for a given PiiEntity
+        """
+        info = pii.info
+        if self._key is not None:
+            # Deterministic mode: all random choices derive from the entity hash
+            h = keyed_hash(self._key, info.pii.name, info.lang, info.country,
+                           pii.fields["value"])
+            return self.generate(info.pii, info.lang, info.country,
+                                 rng=random.Random(h))[0]
+        key = info, pii.fields["value"]
+        value = self._cache.get(key)
+        if value is None:
+            value = self.generate(info.pii, info.lang, info.country)[0]
+            self._cache.put(key, value)
+        return value
+
+
+    def substitute_batch(self, piilist: List[PiiEntity]) -> List[str]:
+        """
+        Return the synthetic values for a list of PiiEntity instances. All
+        the values not in the cache are generated in batches, one per PII
+        type, language & country
+        """
+        if self._key is not None:
+            return [self(pii) for pii in piilist]
+        out = [None] * len(piilist)
+        pending = defaultdict(lambda: defaultdict(list))
+        for n, pii in enumerate(piilist):
+            info = pii.info
+            key = info, pii.fields["value"]
+            value = self._cache.get(key)
+            if value is None:
+                pending[info.pii, info.lang, info.country][key].append(n)
+            else:
+                out[n] = value
+
+        for (ptype, lang, country), items in pending.items():
+            values = self.generate(ptype, lang, country, len(items))
+            for (key, idx), value in zip(items.items(), values):
+                self._cache.put(key, value)
+                for n in idx:
+                    out[n] = value
+
+        return out
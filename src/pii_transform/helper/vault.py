@@ -0,0 +1,434 @@
+"""
+A local store recording PII substitutions, so that transformed documents can
+be restored to their original values.
+
+The vault is a directory containing:
+ * a number of append-only segment files, each one holding a JSON record per
+   line; each record contains all the substitutions done in a document chunk,
+   as (start, end, substitution, original) tuples, where start & end are the
+   positions of the substitution in the *transformed* chunk
+ * an append-only index journal, with a line mapping each (document id,
+   chunk id) to the segment, offset & length of its record
+ * a hash index compiled from the journal (`index.bin`), used for lookups.
+   It is memory-mapped, so lookups do not load it
+
+Writes are buffered and flushed in batches. Segments written in previous
+sessions are never modified: a new session always starts a new segment. If a
+chunk is recorded more than once, the last record wins. Records are keyed by
+document & chunk id, so a document id is required to record substitutions.
+
+The hash index is brought up to date with the journal when a writing session
+is closed, or on the first lookup if it is behind it; only the journal lines
+added since the last update are read. Its layout (integers in the byte order
+recorded in the header):
+ * magic string (8 bytes) and header length (uint64)
+ * JSON header: format, number of entries & slots, size of the journal
+   covered by the index, and the offset of the slots
+ * hash slots: an open-addressing table (linear probing, at most half full)
+   with five uint64 per slot: the two halves of the 128-bit key hash, and the
+   segment, offset & length of the record (a length of 0 means an empty slot)
+"""
+
+import os
+import sys
+import json
+import mmap
+import hashlib
+from array import array
+from pathlib import Path
+from operator import itemgetter
+from itertools import groupby
+
+from typing import Dict, List, Tuple, Iterable, Optional, Union
+
+from pii_data.helper.exception import InvArgException, FileException
+
+
+# Number of chunk records to buffer before writing them
+DEFAULT_BATCH_SIZE = 1000
+
+# Maximum size of a segment file, in bytes
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+INDEX_NAME = "index.jsonl"
+HASH_INDEX_NAME = "index.bin"
+SEGMENT_NAME = "segment-{:05d}.jsonl"
+
+FMT_VAULT_INDEX = "pii-transform:vault-index:v1"
+
+MAGIC = b"PIIV\x01\x00\x00\x00"
+
+# Maximum fraction of used slots in the hash index
+MAX_LOAD = 0.5
+
+# Number of uint64 values in a hash index slot
+SLOT_SIZE = 5
+
+TYPE_KEY = Tuple[Optional[str], str]
+TYPE_VAULT_EDIT = Tuple[int, int, str, str]
+
+
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+def _hash(docid: str, chunkid: str) -> Tuple[int, int]:
+    """
+    Compute the 128-bit hash for a record key, as two integers
+    """
+    key = json.dumps([docid, chunkid], ensure_ascii=False).encode("utf-8")
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), \
+        int.from_bytes(digest[8:], "little")
+
+
+class VaultIndex:
+    """
+    A read-only hash index for a vault, over a memory-mapped file or a buffer
+    """
+
+    def __init__(self, data: Union[mmap.mmap, bytes], name: str):
+        """
+         :param data: the index contents
+         :param name: name of the index file (for error messages)
+        """
+        self._data = data
+        if data[:8] != MAGIC:
+            raise FileException("not a vault index: {}", name)
+        hlen = int.from_bytes(data[8:16], sys.byteorder)
+        try:
+            header = json.loads(bytes(data[16:16+hlen]))
+        except ValueError as e:
+            raise FileException("invalid vault index: {}", name) from e
+        if header.get("format") != FMT_VAULT_INDEX:
+            raise FileException("invalid vault index format: {}", name)
+        self.header = header
+        self._mask = header["slots"] - 1
+        offset, size = header["slots_section"]
+        slots = memoryview(data)[offset:offset+size]
+        if header["byteorder"] != sys.byteorder:
+            slots = array("Q", slots)
+            slots.byteswap()
+        else:
+            slots = slots.cast("Q")
+        self._slots = slots
+
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+
+    @property
+    def journal(self) -> int:
+        """
+        The size of the index journal covered by the index
+        """
+        return self.header["journal"]
+
+
+    def get(self, key: TYPE_KEY) -> Optional[Tuple[int, int, int]]:
+        """
+        Find the location of the record for a key
+         :return: a (segment, offset, length) tuple, or None if the key is not
+           in the index
+        """
+        h1, h2 = _hash(*key)
+        slots, mask = self._slots, self._mask
+        i = h1 & mask
+        while True:
+            n = SLOT_SIZE * i
+            if not slots[n+4]:
+                return None
+            if slots[n] == h1 and slots[n+1] == h2:
+                return slots[n+2], slots[n+3], slots[n+4]
+            i = (i + 1) & mask
+
+
+    def entries(self) -> Iterable[Tuple[int, ...]]:
+        """
+        Iterate over all the slots in use, as (hash1, hash2, segment,
+        offset, length) tuples
+        """
+        slots = self._slots
+        for n in range(0, len(slots), SLOT_SIZE):
+            if slots[n+4]:
+                yield tuple(slots[n:n+SLOT_SIZE])
+
+
+    def close(self):
+        """
+        Release the mapping
+        """
+        if self._data is None:
+            return
+        self._slots = None
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = None
+
+
+def _journal_lines(name: Path, start: int, end: int) -> Iterable[bytes]:
+    """
+    Read the complete lines in a section of the index journal
+    """
+    if start >= end:
+        return
+    with open(name, "rb") as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            pos += len(line)
+            if pos > end or not line.endswith(b"\n"):
+                break
+            yield line
+
+
+def build_index(path: Path, previous: VaultIndex = None) -> bytes:
+    """
+    Compile the hash index for a vault from its index journal
+     :param path: the vault directory
+     :param previous: the current index, if it is valid; only the journal
+       lines added after it will be read
+     :return: the contents of the index file
+    """
+    journal = path / INDEX_NAME
+    size = journal.stat().st_size if journal.is_file() else 0
+    start = previous.journal if previous is not None else 0
+    # Count the new lines, to size the table
+    new, end = 0, start
+    for line in _journal_lines(journal, start, size):
+        new += 1
+        end += len(line)
+    num = new + (len(previous) if previous is not None else 0)
+
+    nslots = 8
+    while num > nslots * MAX_LOAD:
+        nslots *= 2
+    mask = nslots - 1
+    slots = array("Q", bytes(8 * SLOT_SIZE * nslots))
+    count = 0
+
+    def insert(h1: int, h2: int, *loc: int):
+        # Add an entry, replacing a previous one for the same key
+        nonlocal count
+        i = h1 & mask
+        while True:
+            n = SLOT_SIZE * i
+            if not slots[n+4]:
+                count += 1
+                break
+            if slots[n] == h1 and slots[n+1] == h2:
+                break
+            i = (i + 1) & mask
+        slots[n:n+SLOT_SIZE] = array("Q", (h1, h2, *loc))
+
+    if previous is not None:
+        for entry in previous.entries():
+            insert(*entry)
+    for line in _journal_lines(journal, start, end):
+        docid, chunkid, *loc = json.loads(line)
+        insert(*_hash(docid, chunkid), *loc)
+
+    header = {"format": FMT_VAULT_INDEX, "byteorder": sys.byteorder,
+              "count": count, "slots": nslots, "journal": end}
+    hlen = len(json.dumps(header)) + 64     # room for the section offset
+    offset = 16 + hlen + _pad(16 + hlen)
+    header["slots_section"] = [offset, len(slots) * slots.itemsize]
+    hdata = json.dumps(header).encode("utf-8").ljust(hlen)
+    return b"".join((MAGIC, len(hdata).to_bytes(8, sys.byteorder), hdata,
+                     b"\0" * _pad(16 + hlen), slots.tobytes()))
+
+
+
+class PiiVault:
+
+    def __init__(self, path: Union[str, Path], mode: str = "a",
+                 batch_size: int = None, segment_size: int = None):
+        """
+         :param path: vault directory
+         :param mode: "a" to record substitutions (the directory is created
+           if needed), "r" to read them
+         :param batch_size: number of chunk records to buffer before writing
+         :param segment_size: maximum size for a segment file
+        """
+        if mode not in ("a", "r"):
+            raise InvArgException("invalid vault mode: {}", mode)
+        self.path = Path(path)
+        self.mode = mode
+        self._batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self._segment_size = segment_size or DEFAULT_SEGMENT_SIZE
+        self._buffer = []
+        self._index = None
+
+        if mode == "r":
+            if not (self.path / INDEX_NAME).is_file():
+                raise FileException("not a vault: {}", self.path)
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+            segments = [int(p.stem.split("-")[1])
+                        for p in self.path.glob("segment-*.jsonl")]
+            self._segment = max(segments, default=-1) + 1
+
+
+    def __repr__(self) -> str:
+        return f"<PiiVault {self.path}>"
+
+
+    def __enter__(self) -> "PiiVault":
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def add(self, docid: str, chunkid: str,
+            edits: List[TYPE_VAULT_EDIT]):
+        """
+        Record the substitutions done in a chunk
+         :param docid: document id
+         :param chunkid: chunk id
+         :param edits: list of (start, end, substitution, original) tuples
+        """
+        if self.mode != "a":
+            raise InvArgException("vault not opened for writing")
+        if docid is None:
+            raise InvArgException("recording substitutions in a vault needs a document id (chunk {})",
+                                  chunkid)
+        self._buffer.append((docid, chunkid, edits))
+        if len(self._buffer) >= self._batch_size:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Write all the buffered records to the current segment, and add them
+        to the index
+        """
+        if not self._buffer:
+            return
+        segname = self.path / SEGMENT_NAME.format(self._segment)
+        entries = []
+        with open(segname, "ab") as f:
+            offset = f.tell()
+            for docid, chunkid, edits in self._buffer:
+                line = json.dumps({"doc": docid, "chunk": chunkid,
+                                   "edits": edits},
+                                  ensure_ascii=False).encode("utf-8") + b"\n"
+                f.write(line)
+                entries.append([docid, chunkid, self._segment, offset,
+                                len(line)])
+                offset += len(line)
+        with open(self.path / INDEX_NAME, "a", encoding="utf-8") as f:
+            for e in entries:
+                print(json.dumps(e, ensure_ascii=False), file=f)
+
+        self._buffer = []
+        if offset >= self._segment_size:
+            self._segment += 1
+
+
+    def close(self):
+        """
+        Flush all pending records, and update the hash index
+        """
+        if self.mode == "a":
+            self.flush()
+            if (self.path / INDEX_NAME).is_file():
+                self._load_index()
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+
+    def _load_index(self) -> VaultIndex:
+        """
+        Open the hash index, updating it first if it is behind the journal.
+        If the index file cannot be written, the updated index is kept in
+        memory
+        """
+        journal = self.path / INDEX_NAME
+        size = journal.stat().st_size if journal.is_file() else 0
+        index = self._index
+        if index is None:
+            index = self._open_index()
+        if index is not None and index.journal == size:
+            self._index = index
+            return index
+
+        # Update the index (or rebuild it, if it is not consistent)
+        previous = index if index is not None and index.journal < size \
+            else None
+        data = build_index(self.path, previous)
+        if index is not None:
+            index.close()
+        name = self.path / HASH_INDEX_NAME
+        try:
+            tmpname = name.with_suffix(".tmp")
+            with open(tmpname, "wb") as f:
+                f.write(data)
+            os.replace(tmpname, name)
+            self._index = self._open_index()
+        except OSError:
+            self._index = VaultIndex(data, str(name))
+        return self._index
+
+
+    def _open_index(self) -> Optional[VaultIndex]:
+        """
+        Map the hash index file, if there is one
+        """
+        name = self.path / HASH_INDEX_NAME
+        if not name.is_file():
+            return None
+        try:
+            with open(name, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise FileException("cannot map vault index {}: {}", name,
+                                e) from e
+        return VaultIndex(data, str(name))
+
+
+    def __len__(self) -> int:
+        """
+        Return the number of chunks recorded in the vault
+        """
+        if self.mode == "a":
+            self.flush()
+        return len(self._load_index())
+
+
+    def lookup_many(self, keys: Iterable[TYPE_KEY]
+                    ) -> Dict[TYPE_KEY, List[TYPE_VAULT_EDIT]]:
+        """
+        Fetch the substitutions for a number of chunks. Records are read via
+        the index, in segment & offset order
+         :param keys: an iterable of (document id, chunk id) tuples
+         :return: a dict {key: edits}, containing only the keys found
+        """
+        if self.mode == "a":
+            self.flush()
+        index = self._load_index()
+        found = sorted(loc + (k,) for k, loc in
+                       ((k, index.get(k)) for k in set(keys)) if loc)
+        out = {}
+        for seg, items in groupby(found, key=itemgetter(0)):
+            with open(self.path / SEGMENT_NAME.format(seg), "rb") as f:
+                for _, offset, length, key in items:
+                    f.seek(offset)
+                    record = json.loads(f.read(length))
+                    # Guard against (very unlikely) hash collisions
+                    if (record["doc"], record["chunk"]) == key:
+                        out[key] = [tuple(e) for e in record["edits"]]
+        return out
+
+
+    def lookup(self, docid: Optional[str],
+               chunkid: str) -> Optional[List[TYPE_VAULT_EDIT]]:
+        """
+        Fetch the substitutions for a chunk
+         :return: the list of (start, end, substitution, original) tuples, or
+           None if the chunk is not in the vault
+        """
+        return self.lookup_many([(docid, chunkid)]).get((docid, chunkid))
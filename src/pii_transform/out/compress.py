@@ -0,0 +1,268 @@
+"""
+Block-parallel compressed output: the output stream is cut into blocks, each
+block is compressed independently on a thread pool (as a gzip member or a
+zstd frame) and the compressed blocks are written in order. The concatenation
+is a single valid gzip/zstd stream, readable by any standard decompressor.
+
+Blocks are cut at line boundaries whenever possible. Optionally a JSON index
+file (`<name>.idx`) is written, containing the uncompressed & compressed
+offsets of each block, so that consumers can start decompressing mid-file.
+"""
+
+import os
+import io
+import gzip
+import json
+import bisect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Dict, Iterator, List, Union, TextIO, BinaryIO
+
+from pii_data.helper.io import openfile
+from pii_data.helper.exception import InvArgException, MissingDependency, \
+    ProcException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+FMT_BLOCK_INDEX = "pii-transform:block-index:v1"
+
+CODECS = ("gzip", "zstd")
+
+# Default uncompressed size of each block
+DEFAULT_BLOCK_SIZE = 1024*1024
+
+# Default compression levels
+DEFAULT_LEVEL = {"gzip": 6, "zstd": 3}
+
+# File extension for each codec
+EXTENSION = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def _compressor(codec: str, level: int):
+    """
+    Return a function that compresses one block
+    """
+    if codec == "gzip":
+        return lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise MissingDependency("zstd compression needs the zstandard package")
+        # ZstdCompressor objects are not thread-safe: use one per call
+        return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+    raise InvArgException("unknown compression codec: {}", codec)
+
+
+def _decompressor(codec: str):
+    """
+    Return a function that decompresses one block
+    """
+    if codec == "gzip":
+        return gzip.decompress
+    elif codec == "zstd":
+        if zstandard is None:
+            raise MissingDependency("zstd decompression needs the zstandard package")
+        return lambda data: zstandard.ZstdDecompressor().decompress(data)
+    raise InvArgException("unknown compression codec: {}", codec)
+
+
+def codec_from_name(filename: str) -> str:
+    """
+    Return the codec corresponding to the extension of a file name (or None)
+    """
+    for codec, ext in EXTENSION.items():
+        if str(filename).endswith(ext):
+            return codec
+    return None
+
+
+def strip_codec(filename: str) -> str:
+    """
+    Remove the compression extension from a file name
+    """
+    codec = codec_from_name(filename)
+    return str(filename)[:-len(EXTENSION[codec])] if codec else str(filename)
+
+
+class BlockCompressWriter(io.RawIOBase):
+    """
+    A binary writable stream that compresses its contents in parallel blocks
+    """
+
+    def __init__(self, filename: str, codec: str = "gzip", level: int = None,
+                 block_size: int = None, threads: int = None,
+                 index: bool = False):
+        """
+         :param filename: output file name
+         :param codec: compression codec: "gzip" or "zstd"
+         :param level: compression level
+         :param block_size: uncompressed size of each block, in bytes
+         :param threads: number of compression threads
+         :param index: write a block index file (`<filename>.idx`)
+        """
+        super().__init__()
+        if level is None:
+            level = DEFAULT_LEVEL.get(codec)
+        self._compress = _compressor(codec, level)
+        self.codec = codec
+        self.filename = str(filename)
+        self._bsize = block_size or DEFAULT_BLOCK_SIZE
+        if self._bsize < 1:
+            raise InvArgException("invalid block size: {}", block_size)
+        self._threads = threads or os.cpu_count() or 1
+        self._index = [] if index else None
+        self._buf = bytearray()
+        self._pending = deque()
+        self._uoffset = self._coffset = 0
+        self._pool = ThreadPoolExecutor(self._threads)
+        self._out = open(self.filename, "wb")
+
+
+    def __repr__(self) -> str:
+        return f"<BlockCompressWriter {self.codec} {self.filename}>"
+
+
+    def writable(self) -> bool:
+        return True
+
+
+    def write(self, data: bytes) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._buf += data
+        while len(self._buf) >= self._bsize:
+            # Cut the block at the last line boundary, if there is one
+            cut = self._buf.rfind(b"\n", 0, self._bsize) + 1 or self._bsize
+            self._submit(bytes(self._buf[:cut]))
+            del self._buf[:cut]
+        return len(data)
+
+
+    def _submit(self, block: bytes):
+        """
+        Send a block to the thread pool. Keep the number of blocks in flight
+        bounded, writing out the oldest ones
+        """
+        self._pending.append((len(block),
+                              self._pool.submit(self._compress, block)))
+        while len(self._pending) > 2*self._threads:
+            self._write_next()
+
+
+    def _write_next(self):
+        """
+        Write out the oldest compressed block
+        """
+        size, future = self._pending.popleft()
+        data = future.result()
+        self._out.write(data)
+        if self._index is not None:
+            self._index.append([self._uoffset, self._coffset, size, len(data)])
+        self._uoffset += size
+        self._coffset += len(data)
+
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buf or not self._uoffset:
+                self._submit(bytes(self._buf))
+                self._buf = bytearray()
+            while self._pending:
+                self._write_next()
+        finally:
+            self._pool.shutdown()
+            self._out.close()
+            super().close()
+        if self._index is not None:
+            index = {"format": FMT_BLOCK_INDEX, "codec": self.codec,
+                     "size": self._uoffset, "blocks": self._index}
+            with open(self.filename + ".idx", "w", encoding="utf-8") as f:
+                json.dump(index, f)
+
+
+def open_compressed(filename: str, compress: Union[str, Dict] = None,
+                    encoding: str = "utf-8", binary: bool = False,
+                    newline: str = None) -> Union[TextIO, BinaryIO]:
+    """
+    Open an output text file. If compression options are given, or the file
+    name has a ".zst" extension, the file is written with block-parallel
+    compression; else it is opened as usual (compressed according to its
+    extension, in a single thread)
+     :param filename: output file name
+     :param compress: compression options: either a codec name, or a dict
+       with `codec`, `level`, `block_size`, `threads` and `index` fields
+     :param encoding: text encoding
+     :param binary: open the file in binary mode
+     :param newline: newline translation mode for text files (as in open())
+    """
+    if isinstance(compress, str):
+        compress = {"codec": compress}
+    elif not compress:
+        if codec_from_name(filename) != "zstd":
+            if binary:
+                return openfile(filename, "wb")
+            elif newline is None:
+                return openfile(filename, "wt", encoding=encoding)
+            return io.TextIOWrapper(openfile(filename, "wb"),
+                                    encoding=encoding, newline=newline)
+        compress = {}
+    compress = dict(compress)
+    codec = compress.pop("codec", None) or codec_from_name(filename) or "gzip"
+    out = io.BufferedWriter(BlockCompressWriter(filename, codec, **compress))
+    return out if binary else io.TextIOWrapper(out, encoding=encoding,
+                                               newline=newline)
+
+
+# --------------------------------------------------------------------------
+
+
+def load_index(filename: str) -> Dict:
+    """
+    Load the block index for a compressed file
+    """
+    try:
+        with open(str(filename) + ".idx", encoding="utf-8") as f:
+            index = json.load(f)
+    except OSError as e:
+        raise ProcException("cannot read block index for {}: {}", filename, e) from e
+    if index.get("format") != FMT_BLOCK_INDEX:
+        raise ProcException("invalid block index for {}", filename)
+    return index
+
+
+def iter_blocks(filename: str, offset: int = 0,
+                index: Dict = None) -> Iterator[bytes]:
+    """
+    Read a block-compressed file starting at an uncompressed offset, using
+    its block index
+     :param filename: compressed file name
+     :param offset: uncompressed offset to start reading from
+     :param index: the block index (if not given, it is loaded)
+     :return: an iterator over the decompressed data, block by block
+    """
+    if index is None:
+        index = load_index(filename)
+    blocks = index["blocks"]
+    decompress = _decompressor(index["codec"])
+    n = max(bisect.bisect_right([b[0] for b in blocks], offset) - 1, 0)
+    with open(filename, "rb") as f:
+        for uoff, coff, _, clen in blocks[n:]:
+            f.seek(coff)
+            data = decompress(f.read(clen))
+            if offset > uoff:
+                data = data[offset-uoff:]
+            yield data
+
+
+def block_offsets(filename: str) -> List[int]:
+    """
+    Return the uncompressed offsets at which each block starts (all of them
+    are at line boundaries, unless a line was longer than the block size)
+    """
+    return [b[0] for b in load_index(filename)["blocks"]]
@@ -1,12 +1,16 @@
 """
-Write a table document to a CSV file
+Write a table document to a CSV file, either at once or incrementally
 """
 
 import csv
 
+from typing import Dict, Iterable, Union
+
 from pii_data.helper.exception import InvArgException
 from pii_data.helper.io import openfile
-from pii_data.types.doc import TableSrcDocument
+from pii_data.types.doc import TableSrcDocument, DocumentChunk
+
+from .compress import open_compressed
 
 
 def write_csv(doc: TableSrcDocument, outname: str, header: bool = True):
@@ -28,3 +32,61 @@ def write_csv(doc: TableSrcDocument, outname: str, header: bool = True):
 
         for row in doc.iter_struct():
             w.writerow(row["data"])
+
+
+def write_csv_stream(outname: str, metadata: Dict,
+                     chunks: Iterable[DocumentChunk], header: bool = True,
+                     delimiter: str = None,
+                     compress: Union[str, Dict] = None) -> int:
+    """
+    Write a table document to a CSV file as its chunks are produced (e.g. by
+    PiiTransformer.iter_transform()), holding only one row at a time
+     :param outname: output file name
+     :param metadata: document metadata
+     :param chunks: an iterable of DocumentChunk objects (table cells, in
+       document order). For documents read from CSV files (row ids `R<n>`),
+       the empty rows, which have no cells, are written back too
+     :param header: write the column names as the first row
+     :param delimiter: the field delimiter (default is a comma)
+     :param compress: options for block-parallel compression
+     :return: the number of rows written
+    """
+    if metadata.get("document", {}).get("type") != "table":
+        raise InvArgException("cannot write document '{}' as CSV: not a table",
+                              outname)
+
+    csv_rows = metadata.get("document", {}).get("origin") == "csv"
+
+    num = 0
+    with open_compressed(outname, compress, newline="") as f:
+        w = csv.writer(f, delimiter=delimiter or ",")
+
+        def fill(upto: int):
+            # Write the empty rows before a CSV row number
+            nonlocal num
+            while csv_rows and num < upto - 1:
+                w.writerow([])
+                num += 1
+
+        if header:
+            colnames = metadata.get("column", {}).get("name")
+            if colnames:
+                w.writerow(colnames)
+
+        row, current = [], None
+        for chunk in chunks:
+            key = chunk.context.get("row") if chunk.context else None
+            if key != current:
+                if row:
+                    w.writerow(row)
+                    num += 1
+                    row = []
+                if csv_rows:
+                    fill(int(str(key)[1:]))
+            current = key
+            row.append(str(chunk.data))
+        if row:
+            w.writerow(row)
+            num += 1
+        fill(metadata.get("document", {}).get("rows", 0) + 1)
+    return num
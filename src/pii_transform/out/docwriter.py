@@ -2,11 +2,31 @@
 Wrapper clas for writing document to local files
 """
 
+from yaml import SafeDumper
+
+from typing import Dict, Union, TextIO
+
 from pii_data.helper.exception import InvArgException
 from pii_data.helper.io import base_extension
 from pii_data.types.doc import SrcDocument
 
+from ..helper.splice import SplicedText
 from .csv import write_csv
+from .text import write_text
+from .compress import open_compressed, codec_from_name, strip_codec
+
+
+def spliced_representer(dumper, data: SplicedText):
+    """
+    A YAML representer for SplicedText chunk data, producing the same block
+    literal style used for plain text chunks
+    """
+    return dumper.represent_scalar("tag:yaml.org,2002:str", str(data),
+                                   style="|")
+
+
+SafeDumper.add_representer(SplicedText, spliced_representer)
+
 
 def get_fmt(outname: str, format: str) -> str:
     """
@@ -32,16 +52,34 @@ class DocumentWriter(SrcDocument):
     def __init__(self, doc: SrcDocument):
         self.doc = doc
 
-    def dump(self, outname: str, format: str, **kwargs):
+    def dump(self, outname: str, format: str, compress: Union[str, Dict] = None,
+             **kwargs):
         """
         Write documento to a local file
+         :param outname: output file name
+         :param format: output format
+         :param compress: options for block-parallel compression (a codec name
+           or a dict, see `open_compressed()`)
         """
-        fmt = get_fmt(outname, format)
+        fmt = get_fmt(strip_codec(outname), format)
+        if compress or codec_from_name(outname) == "zstd":
+            # Write through a block-compressed stream
+            with open_compressed(outname, compress) as out:
+                self._dump(out, fmt, **kwargs)
+        else:
+            self._dump(outname, fmt, **kwargs)
+
+
+    def _dump(self, outname: Union[str, TextIO], fmt: str, **kwargs):
 
         # Custom writing as CSV (only for table documents)
         if fmt == "csv":
             write_csv(self.doc, outname, header=kwargs.get("header", True))
             return
+        # Text output can stream SplicedText chunks
+        elif fmt in ("txt", "text"):
+            write_text(self.doc, outname, indent=kwargs.get("indent"))
+            return
 
         # For the remaining formats, use the native dump method
-        self.doc.dump(outname, format, **kwargs)
+        self.doc.dump(outname, fmt, **kwargs)
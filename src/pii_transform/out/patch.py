@@ -0,0 +1,185 @@
+"""
+Patch output: instead of the full transformed document, write only the edits
+done to it. Output size & write time depend on the number of substitutions,
+not on the document size.
+
+A patch is a JSON Lines file:
+ * a first line with the format and the document header
+ * one line for each modified chunk, with its id, the length of the original
+   chunk text and the list of (start, end, replacement) edits, with positions
+   relative to the original chunk text
+ * a last line with a summary (number of chunks & edits), whose absence
+   signals a truncated patch
+
+The transformed document can be materialised from the original document plus
+the patch.
+"""
+
+import json
+
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from pii_data.helper.io import openfile
+from pii_data.helper.exception import ProcException
+from pii_data.types.doc import DocumentChunk, SrcDocument, LocalSrcDocument
+
+from ..helper.splice import SplicedText, TYPE_EDIT
+from .compress import open_compressed
+
+
+FMT_PATCH = "pii-transform:patch:v1"
+
+
+class PatchWriter:
+
+    def __init__(self, outname: str, metadata: Dict,
+                 compress: Union[str, Dict] = None):
+        """
+         :param outname: output file name
+         :param metadata: document metadata
+         :param compress: options for block-parallel compression
+        """
+        self._out = open_compressed(outname, compress)
+        self.num_chunks = self.num_edits = 0
+        header = {"format": FMT_PATCH, "header": dict(metadata)}
+        print(json.dumps(header, ensure_ascii=False, default=str),
+              file=self._out)
+
+
+    def __repr__(self) -> str:
+        return f"<PatchWriter #{self.num_chunks}>"
+
+
+    def __enter__(self) -> "PatchWriter":
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def add_chunk(self, chunk: DocumentChunk):
+        """
+        Add a transformed chunk. Only chunks whose data is a SplicedText with
+        edits (as produced by a transformer with `lazy=True`) are written
+        """
+        data = chunk.data
+        if not isinstance(data, SplicedText) or not data.edits:
+            return
+        record = {"id": chunk.id, "len": len(data.text),
+                  "edits": [list(e) for e in data.edits]}
+        print(json.dumps(record, ensure_ascii=False), file=self._out)
+        self.num_chunks += 1
+        self.num_edits += len(data.edits)
+
+
+    def close(self):
+        """
+        Write the summary and close the output file
+        """
+        if self._out is None:
+            return
+        summary = {"summary": {"chunks": self.num_chunks,
+                               "edits": self.num_edits}}
+        print(json.dumps(summary), file=self._out)
+        self._out.close()
+        self._out = None
+
+
+def write_patch(outname: str, metadata: Dict, chunks: Iterable[DocumentChunk],
+                compress: Union[str, Dict] = None) -> int:
+    """
+    Write the edits in a transformed document as a patch
+     :param outname: output file name
+     :param metadata: document metadata
+     :param chunks: an iterable of transformed DocumentChunk objects
+     :param compress: options for block-parallel compression
+     :return: the number of modified chunks written
+    """
+    with PatchWriter(outname, metadata, compress) as out:
+        for chunk in chunks:
+            out.add_chunk(chunk)
+    return out.num_chunks
+
+
+# --------------------------------------------------------------------------
+
+
+def load_patch(filename: str) -> Tuple[Dict, Dict[str, Tuple[int, List[TYPE_EDIT]]]]:
+    """
+    Read a patch file
+     :return: a tuple (document header, edits), with edits as a dict
+       `chunk id -> (original length, list of edits)`
+    """
+    edits = {}
+    header = summary = None
+    with openfile(filename, "rt", encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ProcException("invalid line {} in patch {}: {}",
+                                    n, filename, e) from e
+            if header is None:
+                if record.get("format") != FMT_PATCH:
+                    raise ProcException("invalid patch format: {}", filename)
+                header = record["header"]
+            elif "summary" in record:
+                summary = record["summary"]
+            else:
+                edits[record["id"]] = record["len"], \
+                    [tuple(e) for e in record["edits"]]
+    if summary is None:
+        raise ProcException("truncated patch: {}", filename)
+    return header, edits
+
+
+def iter_apply_patch(document: SrcDocument, patch: Union[str, Tuple],
+                     lazy: bool = False) -> Iterator[DocumentChunk]:
+    """
+    Apply a patch to an original document, producing the transformed chunks
+     :param document: the original document
+     :param patch: a patch file name, or the tuple returned by load_patch()
+     :param lazy: leave the data for the modified chunks as SplicedText
+       objects
+    """
+    header, edits = load_patch(patch) if isinstance(patch, str) else patch
+    docid = header.get("document", {}).get("id")
+    if docid is not None and docid != document.id:
+        raise ProcException("patch is for document {}, not {}", docid,
+                            document.id)
+    applied = 0
+    for chunk in document:
+        patched = edits.get(chunk.id)
+        if patched is None:
+            yield chunk
+            continue
+        applied += 1
+        length, chunk_edits = patched
+        if len(chunk.data) != length:
+            raise ProcException("patch does not match chunk {}: length {} instead of {}",
+                                chunk.id, len(chunk.data), length)
+        data = SplicedText(chunk.data, chunk_edits)
+        yield DocumentChunk(chunk.id, data if lazy else str(data),
+                            chunk.context)
+    if applied != len(edits):
+        raise ProcException("patch contains {} chunks not in the document",
+                            len(edits) - applied)
+
+
+def apply_patch(document: SrcDocument, patch: Union[str, Tuple],
+                lazy: bool = False) -> LocalSrcDocument:
+    """
+    Apply a patch to an original document
+     :param document: the original document
+     :param patch: a patch file name, or the tuple returned by load_patch()
+     :param lazy: leave the data for the modified chunks as SplicedText
+       objects
+     :return: a local document with the transformed chunks
+    """
+    dtype = document.metadata.get("document", {}).get("type", "sequence")
+    out = LocalSrcDocument(dtype)
+    out.add_metadata(**document.metadata)
+    for chunk in iter_apply_patch(document, patch, lazy):
+        out.add_chunk(chunk)
+    return out
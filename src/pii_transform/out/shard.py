@@ -0,0 +1,306 @@
+"""
+Write a transformed document as a set of output files (shards), so that
+downstream processes can consume it in parallel.
+
+Top-level elements (table rows, top-level chunks with all their descendants
+in tree documents, chunks in sequence documents) are never split across
+shards. They are assigned to shards in one of three modes:
+ * `rows`: a new shard is started every `limit` top-level elements
+ * `size`: a new shard is started when the text in the current one reaches
+   `limit` characters
+ * `hash`: elements are spread across a fixed number of shards according to
+   the hash of a key (the chunk id, or a field in the chunk context)
+
+Each shard is written by its own thread, fed through a bounded queue, so that
+writing overlaps with the production of transformed chunks. At the end a
+manifest file (JSON) describing all the shards is written.
+"""
+
+import os
+import re
+import json
+import threading
+from queue import Queue
+
+from typing import Dict, Iterable, List, Union, Callable, Any
+
+from pii_data.helper.io import base_extension
+from pii_data.helper.exception import InvArgException
+from pii_data.types.doc import DocumentChunk
+
+from ..helper.misc import keyed_hash
+from .stream import StreamDocumentWriter, stream_format, iter_units
+from .compress import strip_codec
+
+
+FMT_MANIFEST = "pii-transform:shards:v1"
+
+SHARD_MODES = ("rows", "size", "hash")
+
+# Default size of the queue feeding each shard writer (in elements)
+DEFAULT_QUEUE_SIZE = 64
+
+# End-of-stream marker
+_END = object()
+
+
+def shard_names(outname: str) -> Callable[[int], str]:
+    """
+    Build the function producing the file name for each shard. If the output
+    name contains a `{n}` field, it is used as a template; otherwise the shard
+    number is added before the file extension.
+    """
+    outname = str(outname)
+    if "{n" in outname:
+        return lambda n: outname.format(n=n)
+    ext = base_extension(strip_codec(outname))
+    pos = outname.rindex(ext) if ext else len(outname)
+    base, tail = outname[:pos], outname[pos:]
+    return lambda n: f"{base}-{n:05d}{tail}"
+
+
+def manifest_name(outname: str) -> str:
+    """
+    Return the name of the manifest file for a sharded output
+    """
+    outname = re.sub(r"\{n[^}]*\}", "", str(outname))
+    ext = base_extension(strip_codec(outname))
+    if ext:
+        outname = outname[:outname.rindex(ext)]
+    return outname.rstrip("-_.") + ".manifest.json"
+
+
+def unit_size(unit: List[DocumentChunk]) -> int:
+    """
+    Return the text size of a top-level element, in characters
+    """
+    size = 0
+    for chunk in unit:
+        if isinstance(chunk.data, (list, tuple)):
+            size += sum(len(v) if isinstance(v, str) else len(str(v))
+                        for v in chunk.data)
+        else:
+            size += len(chunk.data)
+    return size
+
+
+class ShardThread(threading.Thread):
+    """
+    A thread writing a single shard
+    """
+
+    def __init__(self, num: int, name: str, metadata: Dict, format: str,
+                 queue_size: int = None, compress: Union[str, Dict] = None):
+        super().__init__(daemon=True)
+        self.num = num
+        self.filename = name
+        self.units = self.size = 0
+        self.exc = None
+        self._ended = False
+        self._queue = Queue(queue_size or DEFAULT_QUEUE_SIZE)
+        self._writer = StreamDocumentWriter(name, metadata, format, compress)
+        self.start()
+
+
+    def put(self, unit: List[DocumentChunk], size: int):
+        """
+        Send a top-level element to the shard
+        """
+        if self.exc is not None:
+            raise self.exc
+        self.units += 1
+        self.size += size
+        self._queue.put(unit)
+
+
+    def run(self):
+        try:
+            with self._writer:
+                while True:
+                    unit = self._queue.get()
+                    if unit is _END:
+                        return
+                    self._writer.add_unit(unit)
+        except BaseException as e:
+            self.exc = e
+            # Keep draining the queue, so that the producer does not block
+            while self._queue.get() is not _END:
+                pass
+
+
+    def end(self):
+        """
+        Signal the end of the shard (it will be closed in the background)
+        """
+        if not self._ended:
+            self._ended = True
+            self._queue.put(_END)
+
+
+    def finish(self) -> Dict:
+        """
+        Close the shard, and return its description
+        """
+        self.end()
+        self.join()
+        if self.exc is not None:
+            raise self.exc
+        return {"shard": self.num, "file": os.path.basename(self.filename),
+                "units": self.units, "chunks": self._writer.num_chunks,
+                "size": self.size, "bytes": os.path.getsize(self.filename)}
+
+
+class ShardedWriter:
+
+    def __init__(self, outname: str, metadata: Dict, mode: str = "rows",
+                 limit: int = None, shards: int = None,
+                 key: Union[str, Callable] = None, format: str = None,
+                 queue_size: int = None, compress: Union[str, Dict] = None):
+        """
+         :param outname: output file name; shard numbers are added to it (or
+           it can contain a `{n}` field to be filled with the shard number)
+         :param metadata: document metadata
+         :param mode: sharding mode: "rows", "size" or "hash"
+         :param limit: for "rows" & "size" modes, the maximum number of
+           top-level elements, or of characters, per shard
+         :param shards: for "hash" mode, the number of shards
+         :param key: for "hash" mode, the value to hash for each element: the
+           name of a context field, or a function receiving the first chunk
+           of the element (default is the chunk id)
+         :param format: output format: "yml" or "jsonl"
+         :param queue_size: maximum number of pending elements per shard
+         :param compress: options for block-parallel compression of each shard
+        """
+        if mode not in SHARD_MODES:
+            raise InvArgException("invalid sharding mode: {}", mode)
+        if mode == "hash" and (not shards or shards < 1):
+            raise InvArgException("hash sharding needs a number of shards")
+        if mode != "hash" and (not limit or limit < 1):
+            raise InvArgException("{} sharding needs a limit", mode)
+        self.mode = mode
+        self._limit = limit
+        self._num = shards
+        self._key = key if callable(key) else self._field(key)
+        self._fmt = stream_format(outname, format)
+        self._meta = dict(metadata)
+        self.dtype = self._meta.get("document", {}).get("type", "sequence")
+        self._names = shard_names(outname)
+        self._manifest = manifest_name(outname)
+        self._qsize = queue_size
+        self._compress = compress
+        self._shards = {}
+        self._current = None
+        self._closed = False
+        self.manifest = None
+
+
+    def __repr__(self) -> str:
+        return f"<ShardedWriter {self.mode}>"
+
+
+    def __enter__(self) -> "ShardedWriter":
+        return self
+
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+    @staticmethod
+    def _field(name: str) -> Callable[[DocumentChunk], Any]:
+        if name in (None, "id"):
+            return lambda chunk: chunk.id
+        return lambda chunk: (chunk.context or {}).get(name)
+
+
+    def _open(self, num: int) -> ShardThread:
+        shard = ShardThread(num, self._names(num), self._meta, self._fmt,
+                            self._qsize, self._compress)
+        self._shards[num] = shard
+        return shard
+
+
+    def _target(self, unit: List[DocumentChunk], size: int) -> ShardThread:
+        """
+        Find out the shard a top-level element goes to
+        """
+        if self.mode == "hash":
+            num = keyed_hash(FMT_MANIFEST, self._key(unit[0])) % self._num
+            return self._shards.get(num) or self._open(num)
+
+        cur = self._current
+        if cur is None or \
+           (cur.units >= self._limit if self.mode == "rows"
+                else cur.size and cur.size + size > self._limit):
+            # Rolling shards: close the current one in the background
+            if cur is not None:
+                cur.end()
+            cur = self._current = self._open(len(self._shards))
+        return cur
+
+
+    def add_unit(self, unit: List[DocumentChunk]):
+        """
+        Add a complete top-level element
+        """
+        size = unit_size(unit)
+        self._target(unit, size).put(unit, size)
+
+
+    def add_chunks(self, chunks: Iterable[DocumentChunk]):
+        """
+        Add a sequence of chunks, in document order
+        """
+        for unit in iter_units(self.dtype, chunks):
+            self.add_unit(unit)
+
+
+    def close(self) -> Dict:
+        """
+        Wait for all shards to be written, and write the manifest
+         :return: the manifest
+        """
+        if self._closed:
+            return self.manifest
+        self._closed = True
+        if self.mode == "hash":
+            # Produce all shards, even if empty
+            for n in range(self._num):
+                if n not in self._shards:
+                    self._open(n)
+        shards = [self._shards[n].finish() for n in sorted(self._shards)]
+        self.manifest = manifest = {"format": FMT_MANIFEST, "header": self._meta,
+                    "mode": self.mode, "output_format": self._fmt,
+                    "shards": shards}
+        with open(self._manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False, default=str)
+        return manifest
+
+
+    def abort(self):
+        """
+        Stop all shard writers, without writing a manifest
+        """
+        self._closed = True
+        for shard in self._shards.values():
+            shard.end()
+        for shard in self._shards.values():
+            shard.join()
+
+
+def write_shards(outname: str, metadata: Dict, chunks: Iterable[DocumentChunk],
+                 **kwargs) -> Dict:
+    """
+    Write a document as a set of shards
+     :param outname: output file name
+     :param metadata: document metadata
+     :param chunks: an iterable of DocumentChunk objects
+     :param kwargs: sharding options, as in ShardedWriter
+     :return: the manifest
+    """
+    with ShardedWriter(outname, metadata, **kwargs) as writer:
+        writer.add_chunks(chunks)
+    return writer.manifest
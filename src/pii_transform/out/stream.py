@@ -0,0 +1,217 @@
+"""
+Write documents incrementally: chunks are written to the output file as they
+are produced (e.g. by PiiTransformer.iter_transform()), without building the
+whole output document in memory.
+
+Chunks are buffered only until a top-level element is complete (a table row,
+or a top-level chunk with all its descendants in a tree document). The output
+can be in YAML (the standard Source Document format) or in JSON Lines (one
+top-level chunk per line, after a first line with the document header).
+"""
+
+import json
+from collections import defaultdict
+from types import MappingProxyType
+
+import yaml
+from yaml import SafeDumper
+from yaml.representer import SafeRepresenter
+
+from typing import Dict, Iterable, Iterator, List, Union, Any
+
+from pii_data.defs import FMT_SRCDOCUMENT
+from pii_data.helper.io import base_extension
+from pii_data.helper.exception import InvArgException
+from pii_data.types.doc import DocumentChunk, LocalSrcDocument
+from pii_data.types.doc.defs import CTX_FIELDS
+from pii_data.dump.json import serialize_chunk
+from pii_data.dump.yaml import text_representer, ChunkWrapperRepresenter
+from pii_data.dump.utils import TextNode, ChunkIterWrapper
+
+from ..helper.splice import SplicedText
+from ..helper.io import materialise_chunk
+from .docwriter import spliced_representer
+from .compress import open_compressed, strip_codec
+
+
+class StreamDumper(SafeDumper):
+    """
+    A YAML dumper with the representers needed for document chunks
+    """
+    pass
+
+
+StreamDumper.add_representer(MappingProxyType, SafeRepresenter.represent_dict)
+StreamDumper.add_representer(defaultdict, SafeRepresenter.represent_dict)
+StreamDumper.add_representer(TextNode, text_representer)
+StreamDumper.add_representer(ChunkIterWrapper, ChunkWrapperRepresenter())
+StreamDumper.add_representer(SplicedText, spliced_representer)
+
+
+def stream_format(outname: str, format: str = None) -> str:
+    """
+    Find out the output format for a streamed document
+    """
+    if format is None:
+        ext = base_extension(strip_codec(outname))
+        format = "yml" if ext in (".yml", ".yaml") else \
+            "jsonl" if ext in (".jsonl", ".ndjson") else ext
+    format = str(format).lower()
+    if format == "yaml":
+        format = "yml"
+    elif format == "ndjson":
+        format = "jsonl"
+    if format not in ("yml", "jsonl"):
+        raise InvArgException("unsupported format for streamed output: {}",
+                              format or outname)
+    return format
+
+
+def unit_key(dtype: str, chunk: DocumentChunk, current: Any) -> Any:
+    """
+    Return the key of the top-level element a chunk belongs to
+     :param current: key of the element being built
+    """
+    ctx = chunk.context or {}
+    if dtype == "table":
+        return ctx.get("row")
+    elif dtype == "tree" and ctx.get("level", 0) > 0:
+        return current
+    return chunk.id
+
+
+def iter_units(dtype: str, chunks: Iterable[DocumentChunk]) -> Iterator[List[DocumentChunk]]:
+    """
+    Group a flat sequence of chunks into top-level elements: a table row, a
+    top-level chunk with all its descendants in a tree document, or a single
+    chunk in a sequence document
+     :param dtype: document type
+     :param chunks: iterable of chunks, in document order
+    """
+    unit = []
+    current = None
+    for chunk in chunks:
+        key = unit_key(dtype, chunk, current)
+        if unit and key != current:
+            yield unit
+            unit = []
+        current = key
+        unit.append(chunk)
+    if unit:
+        yield unit
+
+
+class StreamDocumentWriter:
+
+    def __init__(self, outname: str, metadata: Dict, format: str = None,
+                 compress: Union[str, Dict] = None):
+        """
+         :param outname: output file name
+         :param metadata: document metadata
+         :param format: output format: "yml" or "jsonl" (if not given, it is
+           deduced from the file extension)
+         :param compress: options for block-parallel compression
+        """
+        self._fmt = stream_format(outname, format)
+        self._meta = dict(metadata)
+        self.dtype = self._meta.get("document", {}).get("type", "sequence")
+        self._unit = []
+        self._unit_key = None
+        self.num_chunks = 0
+
+        self._out = open_compressed(outname, compress)
+        header = {"format": FMT_SRCDOCUMENT, "header": self._meta}
+        if self._fmt == "yml":
+            self._out.write(yaml.dump(header, Dumper=StreamDumper,
+                                      sort_keys=False, allow_unicode=True,
+                                      default_flow_style=False))
+            self._out.write("chunks:\n")
+        else:
+            print(json.dumps(header, ensure_ascii=False, default=str),
+                  file=self._out)
+
+
+    def __repr__(self) -> str:
+        return f"<StreamDocumentWriter {self._fmt}>"
+
+
+    def __enter__(self) -> "StreamDocumentWriter":
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _write(self, chunks: Iterable[Dict]):
+        if self._fmt == "yml":
+            self._out.write(yaml.dump(ChunkIterWrapper(chunks),
+                                      Dumper=StreamDumper, sort_keys=False,
+                                      allow_unicode=True,
+                                      default_flow_style=False))
+        else:
+            for c in chunks:
+                c = materialise_chunk(serialize_chunk(c, CTX_FIELDS, False))
+                print(json.dumps(c, ensure_ascii=False, default=str),
+                      file=self._out)
+
+
+    def add_unit(self, unit: List[DocumentChunk]):
+        """
+        Write a complete top-level element (as produced by iter_units())
+        """
+        doc = LocalSrcDocument(self.dtype, metadata=self._meta)
+        for chunk in unit:
+            doc.add_chunk(chunk)
+        self._write(doc.iter_struct())
+        self.num_chunks += len(unit)
+
+
+    def _flush(self):
+        """
+        Write the buffered top-level element
+        """
+        if self._unit:
+            self.add_unit(self._unit)
+            self._unit = []
+
+
+    def add_chunk(self, chunk: DocumentChunk):
+        """
+        Add a chunk to the output document
+        """
+        key = unit_key(self.dtype, chunk, self._unit_key)
+        if key != self._unit_key or not self._unit:
+            self._flush()
+            self._unit_key = key
+        self._unit.append(chunk)
+
+
+    def close(self):
+        """
+        Write all pending chunks and close the output file
+        """
+        if self._out is None:
+            return
+        self._flush()
+        if self._fmt == "yml" and not self.num_chunks:
+            self._out.write("[]\n")
+        self._out.close()
+        self._out = None
+
+
+def write_stream(outname: str, metadata: Dict, chunks: Iterable[DocumentChunk],
+                 format: str = None, compress: Union[str, Dict] = None) -> int:
+    """
+    Write a document to a file, as its chunks are produced
+     :param outname: output file name
+     :param metadata: document metadata
+     :param chunks: an iterable of DocumentChunk objects
+     :param format: output format ("yml" or "jsonl")
+     :param compress: options for block-parallel compression
+     :return: the number of chunks written
+    """
+    with StreamDocumentWriter(outname, metadata, format, compress) as out:
+        for unit in iter_units(out.dtype, chunks):
+            out.add_unit(unit)
+    return out.num_chunks
@@ -0,0 +1,91 @@
+"""
+Write a document as plain text
+"""
+
+import re
+
+from typing import Dict, TextIO
+
+from pii_data.helper.io import openfile
+from pii_data.types.doc import SrcDocument
+
+from ..helper.splice import SplicedText
+
+
+# The line boundaries recognised by str.splitlines()
+_NEWLINE = re.compile("\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+class _LineWriter:
+    """
+    A file-like wrapper that writes text fragments as lines, with the same
+    result as writing each line in `"".join(fragments).splitlines()` plus a
+    newline, but without joining the fragments: line endings are normalised
+    and an indent is added to each line
+    """
+
+    def __init__(self, out: TextIO, indent: str = ""):
+        self._out = out
+        self._indent = indent
+        self._bol = True     # at the beginning of a line
+        self._cr = False     # the last fragment ended with a \r
+
+    def write(self, fragment: str) -> int:
+        if not fragment:
+            return 0
+        size = len(fragment)
+        if self._cr and fragment[0] == "\n":
+            # The second half of a \r\n boundary
+            fragment = fragment[1:]
+        self._cr = fragment.endswith("\r")
+        out = self._out
+        for n, piece in enumerate(_NEWLINE.split(fragment)):
+            if n:
+                # A line boundary: end the current line (maybe an empty one)
+                if self._bol:
+                    out.write(self._indent)
+                out.write("\n")
+                self._bol = True
+            if piece:
+                if self._bol:
+                    out.write(self._indent)
+                    self._bol = False
+                out.write(piece)
+        return size
+
+    def close(self):
+        """
+        End the last line, if it is not complete
+        """
+        if not self._bol:
+            self._out.write("\n")
+            self._bol = True
+
+
+def _write_chunk(chunk: Dict, out: TextIO, level: int, indent: int):
+    """
+    Write a document chunk as raw text lines, possibly with leading indent.
+    Chunks holding a SplicedText are streamed from their edits, with line
+    endings normalised in the same way as for plain string chunks.
+    """
+    data = chunk.get("data", "")
+    lines = _LineWriter(out, " " * (level-1)*indent)
+    if isinstance(data, SplicedText):
+        data.write(lines)
+    else:
+        lines.write(str(data))
+    lines.close()
+    for subchunk in chunk.get("chunks", []):
+        _write_chunk(subchunk, out, level+1, indent)
+
+
+def write_text(doc: SrcDocument, outname: str, indent: int = None):
+    """
+    Write a document as a plain text file, maybe with indentation to
+    preserve a tree structure
+    """
+    if not indent:
+        indent = 0
+    with openfile(outname, "wt", encoding="utf-8") as f:
+        for chunk in doc.iter_struct():
+            _write_chunk(chunk, f, 1, indent)
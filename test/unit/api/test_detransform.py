@@ -0,0 +1,78 @@
+"""
+Test the PiiDetransformer class
+"""
+
+from pathlib import Path
+
+import pytest
+
+from pii_data.types.piicollection import PiiCollectionLoader
+from pii_data.types.doc import DocumentChunk, LocalSrcDocument
+from pii_data.types.doc.localdoc import LocalSrcDocumentFile
+from pii_data.helper.exception import ProcException
+
+from pii_transform.api import PiiTransformer
+import pii_transform.api.detransform as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def transform(name: str, vault: Path, policy: str):
+    doc = LocalSrcDocumentFile(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    config = {"pii-transform:main:v1": {"vault": str(vault)}}
+    trf = PiiTransformer(default_policy=policy, config=config)
+    result = trf(doc, pii)
+    trf.close()
+    return doc, result
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_constructor(tmp_path):
+    """
+    Test constructing the object
+    """
+    transform("seq", tmp_path, "label")
+    m = mod.PiiDetransformer(tmp_path)
+    assert str(m) == f"<PiiDetransformer {tmp_path}>"
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+@pytest.mark.parametrize("policy", ["label", "placeholder", "synthetic"])
+def test20_roundtrip(tmp_path, name, policy):
+    """
+    Test transforming & detransforming a document
+    """
+    doc, result = transform(name, tmp_path, policy)
+    assert [c.data for c in result] != [c.data for c in doc]
+
+    m = mod.PiiDetransformer(tmp_path)
+    restored = m(result)
+    assert [(c.id, c.data, c.context) for c in restored] == \
+        [(c.id, c.data, c.context) for c in doc]
+    assert m.stats()["documents"] == 1
+
+
+def test30_mismatch(tmp_path):
+    """
+    Test a document that does not match the recorded substitutions
+    """
+    _, result = transform("seq", tmp_path, "label")
+    chunks = [DocumentChunk(c.id, "X" + c.data, c.context) for c in result]
+    meta = result.metadata
+    result = LocalSrcDocument("sequence")
+    result.add_metadata(**meta)
+    for c in chunks:
+        result.add_chunk(c)
+
+    with pytest.raises(ProcException):
+        mod.PiiDetransformer(tmp_path)(result)
+
+    m = mod.PiiDetransformer(tmp_path, strict=False)
+    restored = m(result)
+    assert [c.data for c in restored] == [c.data for c in chunks]
+    assert m.stats()["mismatches"] > 0
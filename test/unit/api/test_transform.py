@@ -4,6 +4,7 @@ Test the PiiTransform class
 
 from pathlib import Path
 
+import asyncio
 import tempfile
 import pytest
 
@@ -13,6 +14,8 @@ from pii_data.types.piicollection import PiiCollectionLoader
 from pii_data.types.doc.localdoc import BaseLocalSrcDocument, LocalSrcDocumentFile
 from pii_data.helper.io import load_yaml
 
+from pii_transform.helper.splice import SplicedText
+from pii_transform.out import DocumentWriter
 import pii_transform.api.transform as mod
 
 
@@ -97,3 +100,323 @@ def test50_process_seq_ignore():
     got = save_load_yaml(result)
     exp = load_yaml(DATADIR / "minidoc-example-seq-ignore-repl.yaml")
     assert exp == got
+
+
+def test60_process_seq_lazy():
+    """
+    Process leaving the transformed chunks as lazy spliced text
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-seq-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-seq-pii.json")
+    m = mod.PiiTransformer()
+    result = m(doc, pii, lazy=True)
+
+    chunks = list(result)
+    assert isinstance(chunks[2].data, SplicedText)
+    assert isinstance(chunks[0].data, str)
+
+    got = save_load_yaml(result)
+    exp = load_yaml(DATADIR / "minidoc-example-seq-repl.yaml")
+    assert exp == got
+
+
+def test70_process_seq_lazy_text():
+    """
+    Process a document lazily and write it as text
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-seq-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-seq-pii.json")
+    m = mod.PiiTransformer()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outname = Path(tmpdir) / "out.txt"
+        DocumentWriter(m(doc, pii, lazy=True)).dump(outname, format="txt")
+        got = outname.read_text(encoding="utf-8")
+
+        outname2 = Path(tmpdir) / "out2.txt"
+        DocumentWriter(m(doc, pii)).dump(outname2, format="txt")
+        exp = outname2.read_text(encoding="utf-8")
+
+    assert exp == got
+    assert "<PHONE_NUMBER>" in got
+
+
+def test71_lazy_text_newlines(tmp_path):
+    """
+    Check that line endings are written in the same way for chunks with and
+    without substitutions
+    """
+    from pii_data.types import PiiEntity
+    from pii_data.types.doc import LocalSrcDocument, DocumentChunk
+    doc = LocalSrcDocument("sequence")
+    doc.add_chunk(DocumentChunk("1", "Call John\r\nnow\r\n"))
+    doc.add_chunk(DocumentChunk("2", "Call Mary\r\nnow"))
+    pii = [PiiEntity.build("PERSON", "John", "1", 5)]
+
+    outname = tmp_path / "out.txt"
+    result = mod.PiiTransformer()(doc, pii, lazy=True)
+    DocumentWriter(result).dump(outname, format="txt")
+    got = outname.read_bytes()
+    assert got == b"Call <PERSON>\nnow\nCall Mary\nnow\n"
+    # The edits were streamed, without building the chunk text
+    assert next(iter(result)).data._str is None
+
+
+def test80_stats():
+    """
+    Check the processing statistics
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-seq-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-seq-pii.json")
+    m = mod.PiiTransformer()
+    m(doc, pii)
+    stats = m.stats()
+    assert stats["documents"] == 1
+    assert stats["chunks"] == 4
+    assert stats["entities"] == 3
+    assert stats["memo_misses"] == 3
+
+
+def test81_metrics():
+    """
+    Check the latency & entity-count histograms, and the slow chunk log
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-seq-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-seq-pii.json")
+    config = {"pii-transform:main:v1": {"slow_chunk": 0}}
+    m = mod.PiiTransformer(config=config)
+    m(doc, pii)
+    hist = m.metrics.hist
+    assert hist["document_seconds"].count == 1
+    assert hist["document_entities"].sum == 3
+    assert hist["chunk_seconds"].count == 4
+    assert hist["chunk_entities"].max == 2
+    assert m.stats()["slow_chunks"] == 4
+    assert [r["chunk"] for r in m.metrics.slow] == ["1", "2", "3", "4"]
+
+
+def test90_iter_transform():
+    """
+    Process a document producing a chunk iterator
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-table-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-table-pii.json")
+    m = mod.PiiTransformer()
+
+    got = list(m.iter_transform(doc, pii))
+    exp = list(m(doc, pii))
+    assert got == exp
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test100_atransform(name):
+    """
+    Process documents asynchronously
+    """
+    doc = LocalSrcDocumentFile(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    config = {"pii-transform:main:v1": {"slice_size": 2, "max_concurrency": 2}}
+    m = mod.PiiTransformer(config=config)
+    exp = save_load_yaml(m(doc, pii))
+
+    async def run():
+        return await asyncio.gather(*[m.atransform(doc, pii)
+                                      for _ in range(5)])
+
+    results = asyncio.run(run())
+    for r in results:
+        assert save_load_yaml(r) == exp
+    assert m.stats()["documents"] == 6
+
+
+def test110_aiter_transform():
+    """
+    Process a document asynchronously, producing a chunk iterator
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-seq-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-seq-pii.json")
+    m = mod.PiiTransformer()
+
+    async def run():
+        return [c async for c in m.aiter_transform(doc, pii)]
+
+    assert asyncio.run(run()) == list(m(doc, pii))
+
+    # The same transformer can be used in another event loop
+    async def run_many():
+        return await asyncio.gather(*[m.atransform(doc, pii)
+                                      for _ in range(3)])
+    for _ in range(2):
+        assert all(list(d) == list(m(doc, pii)) for d in asyncio.run(run_many()))
+
+
+def test120_memory_budget():
+    """
+    Process a document under memory pressure: caches are cleared, but the
+    result does not change
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-seq-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-seq-pii.json")
+
+    usage = iter([100, 900, 950, 900, 800])
+    budget = mod.MemoryBudget(1000, measure=lambda: next(usage, 500))
+    m = mod.PiiTransformer(budget=budget)
+    result = m(doc, pii)
+
+    got = save_load_yaml(result)
+    exp = load_yaml(DATADIR / "minidoc-example-seq-repl.yaml")
+    assert exp == got
+
+    stats = m.stats()
+    assert stats["memory_budget"] == 1000
+    assert stats["memory_peak"] == 950
+    assert stats["memory_pressure"] == 1
+    assert stats["memory_memo"] == stats["memory_caches"] == 1
+
+
+@pytest.mark.parametrize("strategy,exp", [
+    ("longest", "Call <PERSON> at <PHONE_NUMBER> now"),
+    ("score", "Call <PERSON> Smith at +34 <GOV_ID> 678 now"),
+    ("merge", "Call <PERSON> at <PHONE_NUMBER> now")
+])
+def test130_overlap(strategy, exp):
+    """
+    Transform a chunk with overlapping entities
+    """
+    from pii_data.types import PiiEntity
+    from pii_data.types.doc import DocumentChunk
+    text = "Call John Smith at +34 612 345 678 now"
+    pii = [PiiEntity.build(t, v, "1", text.index(v), extra={"score": s})
+           for t, v, s in (("PERSON", "John Smith", 0.9),
+                           ("PERSON", "John", 0.95),
+                           ("PHONE_NUMBER", "+34 612 345 678", 0.5),
+                           ("GOV_ID", "612 345", 0.8))]
+    config = {mod.defs.FMT_CONFIG_TRANSFORM: {"overlap": strategy}}
+    m = mod.PiiTransformer(default_policy="label", config=config)
+    got = m.transform_chunk(DocumentChunk("1", text), pii)
+    assert got.data == exp
+    assert m.stats()["overlaps"] == 2
+
+
+@pytest.mark.parametrize("byte_offsets", [False, True])
+def test140_textfile(byte_offsets, tmp_path):
+    """
+    Transform a plain text file through the fast path
+    """
+    from pii_data.types import PiiEntity
+    text = "Añadir a John Smith, tel. +34 612 345 678.\nY también a Mary\n" * 50
+    infile = tmp_path / "in.txt"
+    infile.write_text(text, encoding="utf-8")
+
+    pii = []
+    for n in range(50):
+        for ptype, value in (("PERSON", "John Smith"), ("PERSON", "Mary"),
+                             ("PHONE_NUMBER", "+34 612 345 678")):
+            pos = text.index(value, n*len(text)//50)
+            if byte_offsets:
+                pos = len(text[:pos].encode("utf-8"))
+            pii.append(PiiEntity.build(ptype, value, "1", pos))
+
+    m = mod.PiiTransformer(default_policy="label")
+    outfile = tmp_path / "out.txt"
+    m.transform_textfile(str(infile), pii, str(outfile),
+                         byte_offsets=byte_offsets)
+
+    exp = text.replace("John Smith", "<PERSON>").replace("Mary", "<PERSON>")
+    exp = exp.replace("+34 612 345 678", "<PHONE_NUMBER>")
+    assert outfile.read_text(encoding="utf-8") == exp
+    assert m.stats()["entities"] == 150
+
+
+def test145_textfile_errors(tmp_path):
+    """
+    Check that the plain text fast path rejects PII collections with several
+    chunks, or with positions not matching the text
+    """
+    from pii_data.helper.exception import ProcException
+    from pii_data.types import PiiEntity
+    infile = tmp_path / "in.txt"
+    infile.write_text("Hello John\n\nCall Mary now\n", encoding="utf-8")
+    m = mod.PiiTransformer(default_policy="label")
+
+    pii = [PiiEntity.build("PERSON", "John", "1", 6),
+           PiiEntity.build("PERSON", "Mary", "2", 5)]
+    with pytest.raises(ProcException):
+        m.transform_textfile(str(infile), pii, str(tmp_path / "out.txt"))
+
+    pii = [PiiEntity.build("PERSON", "Mary", "1", 5)]
+    with pytest.raises(ProcException):
+        m.transform_textfile(str(infile), pii, str(tmp_path / "out.txt"))
+
+
+def test150_textfile_vault(tmp_path):
+    """
+    Transform a plain text file through the fast path, recording the
+    substitutions in a vault
+    """
+    from pii_data.types import PiiEntity
+    from pii_transform.helper.vault import PiiVault
+    text = "Añadir a John Smith y a Mary\n"
+    infile = tmp_path / "in.txt"
+    infile.write_text(text, encoding="utf-8")
+    pii = [PiiEntity.build("PERSON", "Mary", "1", 24),
+           PiiEntity.build("PERSON", "John Smith", "1", 9)]
+
+    config = {mod.defs.FMT_CONFIG_TRANSFORM: {"vault": str(tmp_path / "vault")}}
+    m = mod.PiiTransformer(default_policy="label", config=config)
+    m.transform_textfile(str(infile), pii, str(tmp_path / "out.txt"),
+                         docid="doc1")
+    m.close()
+
+    got = PiiVault(tmp_path / "vault", "r").lookup("doc1", "1")
+    assert got == [(9, 17, "<PERSON>", "John Smith"),
+                   (22, 30, "<PERSON>", "Mary")]
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test160_transform_multi(name):
+    """
+    Transform a document with several policy sets in a single pass
+    """
+    doc = LocalSrcDocumentFile(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    policy_sets = {"ext": "redact",
+                   "join": {"name": "hash", "key": "abcd"},
+                   "ann": {"default_policy": "annotate",
+                           "policy": {"PHONE_NUMBER": "label"}}}
+    m = mod.PiiTransformer(policy_sets=policy_sets)
+    got = m.transform_multi(doc, pii)
+    assert list(got) == ["ext", "join", "ann"]
+    assert m.stats()["documents"] == 1
+    entities = m.stats()["entities"]
+
+    for setname, policy in policy_sets.items():
+        if "default_policy" in policy:
+            cfg = {mod.defs.FMT_CONFIG_TRANSFORM: policy}
+            single = mod.PiiTransformer(config=cfg)
+        else:
+            single = mod.PiiTransformer(default_policy=policy)
+        exp = single(doc, pii)
+        assert save_load_yaml(got[setname]) == save_load_yaml(exp)
+        assert single.stats()["entities"] == entities
+
+    with pytest.raises(mod.InvArgException):
+        mod.PiiTransformer().transform_multi(doc, pii)
+
+
+@pytest.mark.parametrize("pset", [None, 12, ["redact"]])
+def test161_policy_sets_invalid(pset):
+    """
+    Check that invalid policy set definitions are rejected
+    """
+    with pytest.raises(mod.InvArgException):
+        mod.PiiTransformer(policy_sets={"bad": pset})
@@ -0,0 +1,87 @@
+"""
+Test checkpointing & resuming batch runs
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from pii_data.helper.exception import InvArgException
+from pii_data.helper.config import FMT_CONFIG_PREFIX
+
+from pii_transform import defs
+from pii_transform.app.transform import main
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def mkbatch(outdir: Path, outname: str, fail: int = None) -> Path:
+    """
+    Create a batch file, optionally with a job that will fail
+    """
+    batch = outdir / f"batch-{outname}.txt"
+    with open(batch, "w", encoding="utf-8") as f:
+        for n in range(6):
+            name = ("seq", "tree", "table")[n % 3]
+            pii = "missing" if n == fail else name
+            print(DATADIR / f"minidoc-example-{name}-orig.yaml",
+                  DATADIR / f"minidoc-example-{pii}-pii.json",
+                  outdir / f"{outname}-{n}.yaml", file=f)
+    return batch
+
+
+def run(tmp_path: Path, batch: Path, *args):
+    config = tmp_path / "config.json"
+    with open(config, "w", encoding="utf-8") as f:
+        json.dump({"format": FMT_CONFIG_PREFIX + defs.FMT_CONFIG_TRANSFORM,
+                   "seed": 1234}, f)
+    main(["--batch", str(batch), "--default-policy", "placeholder",
+          "--config", str(config), "--reraise", *args])
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_resume(tmp_path):
+    """
+    Test that an interrupted & resumed run gives the same result as an
+    uninterrupted one
+    """
+    run(tmp_path, mkbatch(tmp_path, "full"))
+
+    ckpt = str(tmp_path / "ckpt")
+    with pytest.raises(Exception):
+        run(tmp_path, mkbatch(tmp_path, "part", fail=4),
+            "--checkpoint", ckpt, "--checkpoint-interval", "3")
+    assert not (tmp_path / "part-4.yaml").exists()
+    with open(tmp_path / "ckpt" / "state.json", encoding="utf-8") as f:
+        assert json.load(f)["done"] == 3
+
+    # A new run on the same checkpoint needs to resume it
+    with pytest.raises(InvArgException):
+        run(tmp_path, mkbatch(tmp_path, "part"), "--checkpoint", ckpt)
+
+    # Resume: documents after the snapshot are redone
+    (tmp_path / "part-0.yaml").unlink()
+    (tmp_path / "part-3.yaml").unlink()
+    run(tmp_path, mkbatch(tmp_path, "part"), "--checkpoint", ckpt,
+        "--resume")
+    assert not (tmp_path / "part-0.yaml").exists()
+    for n in range(1, 6):
+        exp = (tmp_path / f"full-{n}.yaml").read_text(encoding="utf-8")
+        assert (tmp_path / f"part-{n}.yaml").read_text(encoding="utf-8") == exp
+
+    with open(tmp_path / "ckpt" / "journal.jsonl", encoding="utf-8") as f:
+        assert len(f.readlines()) == 6
+
+
+def test20_pipeline(tmp_path):
+    """
+    Test that checkpoints are rejected in pipeline mode
+    """
+    with pytest.raises(InvArgException):
+        run(tmp_path, mkbatch(tmp_path, "pipe"), "--checkpoint",
+            str(tmp_path / "ckpt"), "--pipeline")
+    assert not (tmp_path / "pipe-0.yaml").exists()
@@ -0,0 +1,107 @@
+"""
+Test multi-node corpus processing: plan, run & merge
+"""
+
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from pii_data.helper.exception import InvArgException, ProcException
+
+from pii_transform.app.transform import main
+import pii_transform.app.corpus as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def mkbatch(outdir: Path, num: int = 6) -> Path:
+    """
+    Create a batch file with a number of documents
+    """
+    names = ["seq", "tree", "table"]
+    batch = outdir / "batch.txt"
+    with open(batch, "w", encoding="utf-8") as f:
+        for n in range(num):
+            name = names[n % 3]
+            print(DATADIR / f"minidoc-example-{name}-orig.yaml",
+                  DATADIR / f"minidoc-example-{name}-pii.json",
+                  outdir / f"out-{n}.yaml", file=f)
+    return batch
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_shard():
+    """
+    Test parsing shard specifications
+    """
+    assert mod.parse_shard("0/4") == (0, 4)
+    for value in ("4/4", "1", "a/2", "-1/2"):
+        with pytest.raises(InvArgException):
+            mod.parse_shard(value)
+
+
+def test20_plan(tmp_path):
+    """
+    Test creating a plan
+    """
+    planfile = tmp_path / "plan.json"
+    main(["plan", str(mkbatch(tmp_path)), str(planfile), "--shards", "2"])
+    plan = mod.load_plan(str(planfile))
+    assert plan["shards"] == 2
+    assert plan["jobs"] == 6
+    shards = plan["shard_list"]
+    assert sum(len(s["jobs"]) for s in shards) == 6
+    assert sum(s["pii_count"] for s in shards) == plan["pii_count"]
+    # Each shard gets one document of each kind
+    for s in shards:
+        assert len(s["jobs"]) == 3
+        assert s["bytes"] == plan["bytes"] // 2
+
+
+def test30_run_merge(tmp_path):
+    """
+    Test running all shards in separate processes, and merging the results
+    """
+    planfile = tmp_path / "plan.json"
+    main(["plan", str(mkbatch(tmp_path)), str(planfile), "--shards", "3"])
+
+    with pytest.raises(SystemExit):
+        main(["merge", str(planfile)])
+
+    code = "from pii_transform.app.transform import main; main()"
+    procs = [subprocess.Popen([sys.executable, "-c", code, "run",
+                               "--plan", str(planfile), "--shard", f"{i}/3"])
+             for i in range(3)]
+    assert [p.wait() for p in procs] == [0, 0, 0]
+    for n in range(6):
+        assert (tmp_path / f"out-{n}.yaml").is_file()
+
+    main(["merge", str(planfile)])
+    with open(mod.merged_name(str(planfile)), encoding="utf-8") as f:
+        merged = json.load(f)
+    assert merged["complete"] is True
+    assert merged["stats"]["documents"] == 6
+    assert len(merged["outputs"]) == 6
+
+
+def test40_merge_partial(tmp_path):
+    """
+    Test merging with missing shards
+    """
+    planfile = str(tmp_path / "plan.json")
+    main(["plan", str(mkbatch(tmp_path, 2)), planfile, "--shards", "2"])
+    main(["run", "--plan", planfile, "--shard", "1/2"])
+    with pytest.raises(ProcException):
+        mod.merge_results(planfile)
+    got = mod.merge_results(planfile, partial=True)
+    assert got["missing"] == [0]
+    assert got["stats"]["documents"] == 1
+
+    with pytest.raises(InvArgException):
+        mod.shard_jobs(mod.load_plan(planfile), 0, 3)
@@ -0,0 +1,117 @@
+"""
+Test the pii-transform command-line entry point
+"""
+
+import csv
+from pathlib import Path
+from types import SimpleNamespace
+
+from typing import Tuple
+
+import pytest
+
+from pii_data.types import PiiEnum, PiiEntity
+from pii_data.types.piicollection import PiiCollection
+
+from pii_transform.api import PiiTransformer
+from pii_transform.helper.memory import MemoryBudget
+from pii_transform.app import jobs
+import pii_transform.app.transform as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def test10_subcommands():
+    """
+    Check that all subcommands point to an existing function
+    """
+    for name, (module, func) in mod.SUBCOMMANDS.items():
+        module = mod.importlib.import_module("." + module, "pii_transform.app")
+        assert callable(getattr(module, func)), name
+
+
+@pytest.mark.parametrize("args", [["--", "run"], ["./run"]])
+def test20_subcommand_name(args, monkeypatch):
+    """
+    Check that an input file with the name of a subcommand can be used
+    """
+    got = []
+    monkeypatch.setattr(mod, "run", got.append)
+    mod.main(["--default-policy", "redact", *args, "pii.json", "out.yaml"])
+    assert len(got) == 1
+    assert got[0].infile == args[-1]
+    assert (got[0].pii, got[0].outfile) == ("pii.json", "out.yaml")
+
+
+def test30_run_needs_plan():
+    """
+    Check that the run subcommand needs a plan & a shard
+    """
+    with pytest.raises(SystemExit):
+        mod.main(["run", "infile", "pii", "outfile"])
+
+
+def mkcsv(tmp_path: Path, rows: int) -> Tuple[Path, Path]:
+    """
+    Create a CSV file with a name and a repeated name in each row, and its
+    PII collection
+    """
+    csvfile = tmp_path / "names.csv"
+    pii = PiiCollection(lang="en")
+    with open(csvfile, "w", encoding="utf-8", newline="") as f:
+        print("name,contact", file=f)
+        for n in range(rows):
+            names = f"Person{n:03}", f"Person{n % 10:03}"
+            print(",".join(names), file=f)
+            for col, name in enumerate(names, start=1):
+                pii.add(PiiEntity.build(PiiEnum.PERSON, name, f"R{n+1}.{col}",
+                                        0))
+    piifile = tmp_path / "names-pii.json"
+    with open(piifile, "w", encoding="utf-8") as f:
+        pii.dump(f, format="json")
+    return csvfile, piifile
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test40_csv_batch(pipeline, tmp_path):
+    """
+    Check that a CSV to CSV job followed by another job keeps consistent
+    substitutions, also in pipeline execution
+    """
+    csvfile, piifile = mkcsv(tmp_path, 200)
+    batch = tmp_path / "batch.txt"
+    with open(batch, "w", encoding="utf-8") as f:
+        print(csvfile, piifile, tmp_path / "out.csv", file=f)
+        for n in range(3):
+            print(DATADIR / "minidoc-example-table-orig.yaml",
+                  DATADIR / "minidoc-example-table-pii.json",
+                  tmp_path / f"out-{n}.yaml", file=f)
+    args = ["--pipeline"] if pipeline else []
+    mod.main(["--batch", str(batch), "--default-policy", "placeholder",
+              "--reraise", "-q", *args])
+
+    with open(tmp_path / "out.csv", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))[1:]
+    assert len(rows) == 200
+    # Each name always gets the same placeholder
+    assert all(r[0] == r[1] for r in rows[:10])
+    assert all(r[1] == rows[n % 10][0] for n, r in enumerate(rows))
+
+
+def test50_budget_stream(tmp_path):
+    """
+    Check that a job switched to streaming reserves its working memory
+    """
+    trf = PiiTransformer(budget=MemoryBudget(1000, measure=lambda: 0))
+    stages = jobs.JobStages(trf, mod.parse_args([]), jobs.Log(False))
+    pii = DATADIR / "minidoc-example-seq-pii.json"
+    job = SimpleNamespace(infile=str(DATADIR / "minidoc-example-seq-orig.yaml"),
+                          pii=str(pii), outfile=str(tmp_path / "out.yaml"))
+    stages.load(job)
+    assert job.stream_doc
+    assert job.reserved == jobs.STREAM_MEMORY + \
+        pii.stat().st_size * jobs.MEMORY_EXPANSION
+    assert trf.budget.stats()["memory_peak_reserved"] == job.reserved
+    stages.write(stages.transform(job))
+    assert trf.budget.available() == 1000
@@ -0,0 +1,46 @@
+"""
+Test the Pipeline class
+"""
+
+import time
+
+import pytest
+
+import pii_transform.app.pipeline as mod
+
+
+def test10_constructor():
+    """
+    Test constructing the object
+    """
+    m = mod.Pipeline(str, len)
+    assert str(m) == "<Pipeline #2>"
+
+
+def test20_process():
+    """
+    Test processing a sequence: results keep the input order
+    """
+    def slow(x):
+        time.sleep(0.001)
+        return x + 1
+
+    m = mod.Pipeline(slow, lambda x: x * 2, str, queue_size=1)
+    assert list(m(range(20))) == [str((x + 1) * 2) for x in range(20)]
+
+
+def test30_error():
+    """
+    Test an error in a stage
+    """
+    def fail(x):
+        if x == 5:
+            raise ValueError("bad value")
+        return x
+
+    m = mod.Pipeline(fail, str)
+    got = []
+    with pytest.raises(ValueError):
+        for r in m(range(100)):
+            got.append(r)
+    assert got == ["0", "1", "2", "3", "4"]
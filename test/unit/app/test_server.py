@@ -0,0 +1,181 @@
+"""
+Test the transform server & client
+"""
+
+import threading
+from pathlib import Path
+
+import pytest
+
+from pii_data.types.piicollection import PiiCollectionLoader
+from pii_data.types.doc import LocalSrcDocumentFile
+from pii_data.helper.exception import ProcException, InvArgException
+
+from pii_transform.api import PiiTransformer
+from pii_transform.helper.io import doc_todict, piic_todict
+from pii_transform.app.client import TransformClient, RemoteTransformer
+from pii_transform.app.transform import main
+import pii_transform.app.server as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def load(name: str):
+    doc = LocalSrcDocumentFile(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    return doc, pii
+
+
+@pytest.fixture(params=["tcp", "unix"])
+def server(request, tmp_path):
+    pool = mod.TransformerPool(default_policy="label", size=2)
+    if request.param == "tcp":
+        srv = mod.make_server(mod.TransformService(pool), port=0)
+        url = "http://{}:{}".format(*srv.server_address[:2])
+    else:
+        srv = mod.make_server(mod.TransformService(pool),
+                              socket=str(tmp_path / "socket"))
+        url = f"unix:{tmp_path / 'socket'}"
+    t = threading.Thread(target=srv.serve_forever, args=(0.05,), daemon=True)
+    t.start()
+    yield url
+    srv.shutdown()
+    srv.server_close()
+    pool.close()
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_health(server):
+    """
+    Test the health endpoint
+    """
+    client = TransformClient(server)
+    r = client.health()
+    assert r["status"] == "ok"
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test20_transform(server, name):
+    """
+    Test transforming a document
+    """
+    doc, pii = load(name)
+    exp = doc_todict(PiiTransformer(default_policy="annotate")(doc, pii))
+    client = TransformClient(server)
+    got = client.transform(doc_todict(doc), piic_todict(pii), "annotate")
+    assert got == exp
+
+
+def test30_batch(server):
+    """
+    Test transforming a batch of documents, and the server metrics
+    """
+    items = [load(name) for name in ("seq", "tree", "table")]
+    trf = PiiTransformer()
+    exp = [doc_todict(trf(doc, pii)) for doc, pii in items]
+    client = TransformClient(server)
+    got = client.transform_batch([{"document": doc_todict(doc),
+                                   "pii": piic_todict(pii)}
+                                  for doc, pii in items])
+    assert got == exp
+
+    metrics = client.metrics()
+    assert metrics["server"]["documents"] == 3
+    assert metrics["transformers"][0]["documents"] == 3
+
+
+def test40_remote(server):
+    """
+    Test the remote transformer, and server errors
+    """
+    doc, pii = load("seq")
+    trf = RemoteTransformer(server, "annotate")
+    got = doc_todict(trf(doc, pii))
+    assert got == doc_todict(PiiTransformer("annotate")(doc, pii))
+    assert trf.stats() == {"documents": 1}
+
+    with pytest.raises(ProcException):
+        TransformClient(server).request("POST", "/transform", {"pii": {}})
+    with pytest.raises(ProcException):
+        TransformClient(server).request("GET", "/unknown")
+
+
+def test50_request_checks():
+    """
+    Test that requests cannot set configuration fields or policies that
+    access server files, and that invalid bodies are rejected
+    """
+    pool = mod.TransformerPool(default_policy="label")
+    service = mod.TransformService(pool)
+    doc, pii = load("seq")
+    request = {"document": doc_todict(doc), "pii": piic_todict(pii)}
+
+    cfg = {mod.defs.FMT_CONFIG_TRANSFORM: {"policy": {"PERSON": "redact"}}}
+    assert service("POST", "/transform", {**request, "config": cfg})
+
+    bad = [
+        {"config": {mod.defs.FMT_CONFIG_TRANSFORM: {"vault": {"path": "x"}}}},
+        {"config": {mod.defs.FMT_CONFIG_TRANSFORM: {"synthetic_tables": "x"}}},
+        {"config": {"other:section:v1": {}}},
+        {"config": {mod.defs.FMT_CONFIG_TRANSFORM:
+                    {"policy": {"PERSON": {"name": "dictionary",
+                                           "path": "x"}}}}},
+        {"policy": {"name": "dictionary", "path": "x"}},
+        {"policy": {"name": "hash", "key": "k", "path": "x"}},
+    ]
+    for b in bad:
+        with pytest.raises(InvArgException):
+            service("POST", "/transform", {**request, **b})
+    with pytest.raises(InvArgException):
+        service("POST", "/transform", [request])
+    pool.close()
+
+
+def test60_pool_evict():
+    """
+    Test that an evicted transformer is closed only after its last use
+    """
+    pool = mod.TransformerPool(default_policy="label", size=1)
+    closed = []
+    with pool.use() as (trf, _):
+        trf.close = lambda: closed.append("label")
+        # Evict it from another thread, while it is in use
+        def evict():
+            with pool.use("redact"):
+                pass
+        t = threading.Thread(target=evict, daemon=True)
+        t.start()
+        t.join(2)
+        assert not t.is_alive()
+        assert len(pool) == 1 and not closed
+    assert closed == ["label"]
+
+    # Unused evicted transformers are closed straight away
+    with pool.use("redact") as (trf, _):
+        trf.close = lambda: closed.append("redact")
+    with pool.use("annotate"):
+        assert closed == ["label", "redact"]
+    pool.close()
+
+
+def test70_remote_csv(server, tmp_path):
+    """
+    Test transforming a CSV file through the server (without streaming)
+    """
+    infile = tmp_path / "in.csv"
+    infile.write_text(DATADIR.joinpath("minidoc-example-table-orig.csv")
+                      .read_text(encoding="utf-8").replace(",", ";"),
+                      encoding="utf-8")
+    outfile = tmp_path / "out.csv"
+    main([str(infile), str(DATADIR / "minidoc-example-table-pii.json"),
+          str(outfile), "--server", server, "--csv-delimiter", ";",
+          "--reraise", "-q"])
+    exp = DATADIR.joinpath("minidoc-example-table-orig.csv") \
+        .read_text(encoding="utf-8").replace(",", ";").splitlines()
+    got = outfile.read_text(encoding="utf-8").splitlines()
+    assert len(got) == len(exp) and got[0] == exp[0]
+    assert got[1].split(";")[2] == "<CREDIT_CARD>"
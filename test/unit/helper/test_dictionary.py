@@ -0,0 +1,118 @@
+"""
+Test the on-disk substitution dictionary
+"""
+
+import pytest
+
+from pii_data.types import PiiEnum
+from pii_data.helper.exception import InvArgException, FileException
+
+import pii_transform.helper.dictionary as mod
+from pii_transform.app.transform import main
+
+
+ENTRIES = [
+    (PiiEnum.PERSON, "John Smith", "Peter Jones"),
+    (PiiEnum.PERSON, "Jane", "Mary"),
+    (PiiEnum.LOCATION, "Jane", "Lyon"),
+    (PiiEnum.EMAIL_ADDRESS, "a@b.com", "x@y.org"),
+    (PiiEnum.LOCATION, "Zürich, CH", "Genève"),
+]
+
+
+def mksource(path, entries, delimiter=",", header=True):
+    with open(path, "w", encoding="utf-8") as f:
+        if header:
+            print(delimiter.join(("type", "value", "replacement")), file=f)
+        for ptype, value, repl in entries:
+            value = f'"{value}"' if delimiter in value else value
+            print(delimiter.join((ptype.name, value, repl)), file=f)
+    return path
+
+
+# ---------------------------------------------------------------------
+
+
+def test10_build(tmp_path):
+    """
+    Test building & reading a dictionary
+    """
+    src = mksource(tmp_path / "dict.csv", ENTRIES)
+    outfile = tmp_path / "dict.piid"
+    assert mod.build_dictionary(src, outfile) == 5
+
+    d = mod.PiiDictionary(outfile)
+    assert len(d) == 5
+    for ptype, value, repl in ENTRIES:
+        assert d.get(ptype, value) == repl
+    assert sorted(d.items(), key=str) == sorted(ENTRIES, key=str)
+    d.close()
+
+
+def test20_miss(tmp_path):
+    """
+    Test looking up values not in the dictionary
+    """
+    src = mksource(tmp_path / "dict.csv", ENTRIES)
+    mod.build_dictionary(src, tmp_path / "dict.piid")
+    d = mod.PiiDictionary(tmp_path / "dict.piid")
+    assert d.get(PiiEnum.PERSON, "John") is None
+    assert d.get(PiiEnum.EMAIL_ADDRESS, "Jane") is None
+    assert (PiiEnum.PERSON, "Jane") in d
+    assert (PiiEnum.PHONE_NUMBER, "Jane") not in d
+
+
+def test30_large(tmp_path):
+    """
+    Test a dictionary with enough entries to have hash collisions
+    """
+    entries = [(PiiEnum.PERSON, f"Name{n}", f"Other{n}") for n in range(5000)]
+    mod.build_dictionary(mksource(tmp_path / "dict.csv", entries),
+                         tmp_path / "dict.piid")
+    d = mod.PiiDictionary(tmp_path / "dict.piid")
+    assert d.header["slots"] == 16384
+    assert all(d.get(*e[:2]) == e[2] for e in entries)
+    assert d.get(PiiEnum.PERSON, "Name5000") is None
+
+
+def test40_tsv(tmp_path):
+    """
+    Test building from several sources, including a TSV file
+    """
+    src1 = mksource(tmp_path / "dict1.csv", ENTRIES[:3])
+    src2 = mksource(tmp_path / "dict2.tsv", ENTRIES[2:], delimiter="\t",
+                    header=False)
+    assert mod.build_dictionary([src1, src2], tmp_path / "dict.piid") == 5
+    d = mod.PiiDictionary(tmp_path / "dict.piid")
+    assert d.get(PiiEnum.LOCATION, "Zürich, CH") == "Genève"
+
+
+def test50_errors(tmp_path):
+    """
+    Test invalid sources & index files
+    """
+    src = mksource(tmp_path / "dict.csv",
+                   ENTRIES + [(PiiEnum.PERSON, "Jane", "Ann")])
+    with pytest.raises(InvArgException):
+        mod.build_dictionary(src, tmp_path / "dict.piid")
+
+    src.write_text("PERSON,Jane\n", encoding="utf-8")
+    with pytest.raises(InvArgException):
+        mod.build_dictionary(src, tmp_path / "dict.piid")
+
+    src.write_text("NOT_A_TYPE,Jane,Ann\n", encoding="utf-8")
+    with pytest.raises(InvArgException):
+        mod.build_dictionary(src, tmp_path / "dict.piid")
+
+    with pytest.raises(FileException):
+        mod.PiiDictionary(src)
+
+
+def test60_cli(tmp_path):
+    """
+    Test the build-dict subcommand
+    """
+    src = mksource(tmp_path / "dict.tsv", ENTRIES, delimiter="\t")
+    main(["build-dict", str(src), str(tmp_path / "dict.piid"), "--reraise"])
+    d = mod.PiiDictionary(tmp_path / "dict.piid")
+    assert d.get(PiiEnum.PERSON, "Jane") == "Mary"
@@ -0,0 +1,163 @@
+"""
+Test incremental reading & writing of source documents
+"""
+
+from pathlib import Path
+
+import pytest
+
+from pii_data.helper.io import load_yaml
+from pii_data.helper.exception import InvalidDocument, InvArgException
+from pii_data.types.doc import LocalSrcDocumentFile
+from pii_data.types.piicollection import PiiCollectionLoader
+
+from pii_transform.api import PiiTransformer
+from pii_transform.out.stream import write_stream
+from pii_transform.out.csv import write_csv_stream
+import pii_transform.helper.docstream as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+DOCTYPES = ("seq", "tree", "table")
+
+
+def load_pii(name: str) -> PiiCollectionLoader:
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    return pii
+
+
+# -----------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("name", DOCTYPES)
+def test10_read(name):
+    """
+    Test reading a YAML document incrementally
+    """
+    fname = DATADIR / f"minidoc-example-{name}-orig.yaml"
+    doc = mod.StreamSrcDocumentFile(str(fname))
+    exp = LocalSrcDocumentFile(fname)
+    assert doc.metadata == exp.metadata
+    got = [(c.id, c.data, c.context) for c in doc.iter_full()]
+    assert got == [(c.id, c.data, c.context) for c in exp.iter_full()]
+
+
+@pytest.mark.parametrize("name", DOCTYPES)
+def test20_transform(name, tmp_path):
+    """
+    Test streamed transformation, in YAML format
+    """
+    doc = mod.StreamSrcDocumentFile(str(DATADIR / f"minidoc-example-{name}-orig.yaml"))
+    chunks = PiiTransformer().iter_transform(doc, load_pii(name), lazy=True)
+    outname = tmp_path / "out.yaml"
+    write_stream(str(outname), doc.metadata, chunks)
+
+    exp = load_yaml(DATADIR / f"minidoc-example-{name}-repl.yaml")
+    assert load_yaml(outname) == exp
+
+
+@pytest.mark.parametrize("name", DOCTYPES)
+def test30_jsonl(name, tmp_path):
+    """
+    Test a roundtrip through the JSON Lines format
+    """
+    doc = mod.StreamSrcDocumentFile(str(DATADIR / f"minidoc-example-{name}-orig.yaml"))
+    chunks = PiiTransformer().iter_transform(doc, load_pii(name))
+    outname = tmp_path / "out.jsonl"
+    n = write_stream(str(outname), doc.metadata, chunks)
+    assert n > 0
+
+    doc2 = mod.StreamSrcDocumentFile(str(outname))
+    outname2 = tmp_path / "out.yaml"
+    assert write_stream(str(outname2), doc2.metadata, doc2) == n
+
+    exp = load_yaml(DATADIR / f"minidoc-example-{name}-repl.yaml")
+    assert load_yaml(outname2) == exp
+
+
+def test40_errors(tmp_path):
+    """
+    Test invalid documents & formats
+    """
+    fname = tmp_path / "doc.yaml"
+    fname.write_text("format: unknown\nheader: {}\nchunks:\n- id: 1\n  data: A\n")
+    with pytest.raises(InvalidDocument):
+        mod.StreamSrcDocumentFile(str(fname))
+
+    fname.write_text("- a list\n")
+    with pytest.raises(InvalidDocument):
+        mod.StreamSrcDocumentFile(str(fname))
+
+    with pytest.raises(InvArgException):
+        write_stream(str(tmp_path / "out.txt"), {}, [])
+
+
+def test50_csv():
+    """
+    Test reading a CSV file as a table document
+    """
+    doc = mod.load_csv(str(DATADIR / "minidoc-example-table-orig.csv"),
+                       docid="00000-11111")
+    exp = LocalSrcDocumentFile(DATADIR / "minidoc-example-table-orig.yaml")
+    assert doc.metadata == exp.metadata
+    assert [(c.id, c.data, c.context) for c in doc] == \
+        [(c.id, c.data, c.context) for c in exp]
+
+    doc = mod.load_csv(str(DATADIR / "minidoc-example-table-orig.csv"),
+                       header=False)
+    chunks = list(doc)
+    assert "column" not in doc.metadata
+    assert chunks[0].id == "R1.1" and chunks[0].data == "Date"
+    assert chunks[-1].id == "R4.6"
+
+
+def test60_csv_transform(tmp_path):
+    """
+    Test transforming a CSV file in a single pass
+    """
+    outname = tmp_path / "out.csv"
+    num = PiiTransformer().transform_csv(
+        str(DATADIR / "minidoc-example-table-orig.csv"), load_pii("table"),
+        str(outname))
+    assert num == 3
+    exp = DATADIR / "minidoc-example-table-repl.csv"
+    assert outname.read_bytes() == exp.read_bytes()
+
+    # A CSV file with another delimiter, from the command-line script
+    from pii_transform.app.transform import main
+    tsv = tmp_path / "in.csv"
+    tsv.write_text(DATADIR.joinpath("minidoc-example-table-orig.csv")
+                   .read_text(encoding="utf-8").replace(",", "\t"),
+                   encoding="utf-8")
+    main([str(tsv), str(DATADIR / "minidoc-example-table-pii.json"),
+          str(outname), "--csv-delimiter", "\t", "-q"])
+    got = outname.read_text(encoding="utf-8").splitlines()
+    assert got[1].split("\t")[2] == "<CREDIT_CARD>"
+
+    with pytest.raises(InvArgException):
+        write_csv_stream(str(outname), {"document": {"type": "sequence"}}, [])
+
+
+def test70_csv_roundtrip(tmp_path):
+    """
+    Test that line breaks inside cells and empty rows are preserved when
+    transforming a CSV file
+    """
+    from pii_data.types import PiiEntity
+    text = 'name,phone\r\n"John\r\nSmith",555-1234\r\n\r\nMary,555-9876\r\n\r\n'
+    infile = tmp_path / "in.csv"
+    infile.write_bytes(text.encode("utf-8"))
+
+    doc = mod.load_csv(str(infile))
+    assert [c.data for c in doc] == ["John\r\nSmith", "555-1234", "Mary",
+                                     "555-9876"]
+
+    pii = [PiiEntity.build("PHONE_NUMBER", "555-9876", "R3.2", 0)]
+    outname = tmp_path / "out.csv"
+    num = PiiTransformer(default_policy="label").transform_csv(
+        str(infile), pii, str(outname))
+    assert num == 4
+    exp = text.replace("555-9876", "<PHONE_NUMBER>")
+    assert outname.read_bytes() == exp.encode("utf-8")
@@ -0,0 +1,59 @@
+"""
+Test the document & PII collection conversions
+"""
+
+from pathlib import Path
+
+import pytest
+
+from pii_data.types.piicollection import PiiCollectionLoader
+from pii_data.types.doc import LocalSrcDocumentFile
+from pii_data.helper.exception import InvalidDocument
+from pii_data.helper.io import load_yaml
+
+from pii_transform.api import PiiTransformer
+import pii_transform.helper.io as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test10_document(name):
+    """
+    Test document conversions
+    """
+    data = load_yaml(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    doc = mod.doc_fromdict(data)
+    assert list(doc) == list(LocalSrcDocumentFile(
+        DATADIR / f"minidoc-example-{name}-orig.yaml"))
+    assert mod.doc_todict(mod.doc_fromdict(mod.doc_todict(doc))) == \
+        mod.doc_todict(doc)
+
+    with pytest.raises(InvalidDocument):
+        mod.doc_fromdict({**data, "format": "unknown"})
+
+
+def test20_document_lazy():
+    """
+    Test converting a lazily transformed document
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-table-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-table-pii.json")
+    trf = PiiTransformer()
+    got = mod.doc_todict(trf(doc, pii, lazy=True))
+    exp = load_yaml(DATADIR / "minidoc-example-table-repl.yaml")
+    assert got["chunks"] == exp["chunks"]
+
+
+def test30_piic():
+    """
+    Test PII collection conversions
+    """
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-seq-pii.json")
+    data = mod.piic_todict(pii)
+    pii2 = mod.piic_fromdict(data)
+    assert list(pii2) == list(pii)
+    assert mod.piic_todict(pii2) == data
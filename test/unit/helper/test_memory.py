@@ -0,0 +1,123 @@
+"""
+Test the MemoryBudget class
+"""
+
+import threading
+
+import pytest
+
+from pii_data.helper.exception import InvArgException
+
+import pii_transform.helper.memory as mod
+
+
+class Measure:
+    """
+    A fake memory measurement
+    """
+    def __init__(self, value: int = 0):
+        self.value = value
+
+    def __call__(self) -> int:
+        return self.value
+
+
+def test10_size():
+    """
+    Test parsing & formatting memory sizes
+    """
+    assert mod.parse_size(1234) == 1234
+    assert mod.parse_size("2K") == 2048
+    assert mod.parse_size("1.5G") == 1536*1024*1024
+    assert mod.parse_size("512MiB") == 512*1024*1024
+    with pytest.raises(InvArgException):
+        mod.parse_size("lots")
+    assert mod.format_size(1536*1024) == "1.5M"
+    assert mod.rss() > 0
+
+
+def test20_constructor():
+    """
+    Test constructing the object
+    """
+    m = mod.MemoryBudget("1G", measure=Measure(100))
+    assert str(m) == "<MemoryBudget 1.0G>"
+    assert m.limit == 1024**3
+    assert m.stats()["memory_peak"] == 100
+
+    with pytest.raises(InvArgException):
+        mod.MemoryBudget(0)
+
+
+def test30_pressure():
+    """
+    Test running the pressure handlers
+    """
+    measure = Measure(100)
+    m = mod.MemoryBudget(1000, measure=measure)
+    calls = []
+
+    def handler(name: str, release: int):
+        def func():
+            calls.append(name)
+            measure.value -= release
+        return func
+
+    m.add_handler("flush", handler("flush", 50))
+    m.add_handler("caches", handler("caches", 200))
+
+    # Under the soft limit
+    measure.value = 700
+    assert m.check() == 0
+
+    # Over the soft limit: handlers run until memory goes under it
+    measure.value = 900
+    assert m.check() == 2
+    assert calls == ["flush", "caches"]
+    assert measure.value == 650
+
+    stats = m.stats()
+    assert stats["memory_peak"] == 900
+    assert stats["memory_pressure"] == 1
+    assert stats["memory_flush"] == stats["memory_caches"] == 1
+
+
+def test35_pressure_no_release():
+    """
+    Test pressure handlers that do not release memory
+    """
+    measure = Measure(100)
+    m = mod.MemoryBudget(1000, measure=measure)
+    m.add_handler("other", lambda: None)
+
+    measure.value = 900
+    assert m.check() == 1
+    # Handlers do not run again until memory grows
+    measure.value = 920
+    assert m.check() == 0
+    measure.value = 1010
+    assert m.check() == 1
+    assert m.stats()["memory_over_budget"] == 1
+
+
+def test40_backpressure():
+    """
+    Test reserving budget for queued work
+    """
+    m = mod.MemoryBudget(1000, measure=Measure(200))
+    assert m.acquire(700)
+    assert m.available() == 100
+    # Does not fit
+    assert not m.acquire(200, timeout=0.01)
+
+    # Released from another thread
+    t = threading.Timer(0.05, m.release, args=(700,))
+    t.start()
+    assert m.acquire(200, timeout=5)
+    t.join()
+    assert m.stats()["memory_peak_reserved"] == 700
+    assert m.stats()["memory_waits"] == 2
+
+    # A single reservation is always granted
+    m.release(200)
+    assert m.acquire(5000)
@@ -0,0 +1,90 @@
+"""
+Test the processing metrics
+"""
+
+import json
+
+import pytest
+
+from pii_data.helper.exception import InvArgException
+
+import pii_transform.helper.metrics as mod
+
+
+def test10_histogram():
+    """
+    Test adding values to a histogram, and estimating quantiles
+    """
+    h = mod.Histogram([1, 2, 4, 8])
+    assert h.quantile(0.5) is None
+    for v in (0, 1, 1.5, 3, 3, 3, 100):
+        h.add(v)
+    assert len(h) == 7
+    assert h.counts == [2, 1, 3, 0, 1]
+    assert h.cumulative() == [(1, 2), (2, 3), (4, 6), (8, 6),
+                              (float("inf"), 7)]
+    assert h.quantile(0.5) == 4
+    assert h.quantile(0.1) == 1
+    assert h.quantile(1) == 100
+    got = h.asdict()
+    assert got["min"] == 0 and got["max"] == 100
+    assert got["buckets"] == [[1, 2], [2, 1], [4, 3], ["+Inf", 1]]
+
+    h2 = mod.Histogram([1, 2, 4, 8])
+    h2.add(200)
+    h.merge(h2)
+    assert h.count == 8
+    assert h.max == 200
+    with pytest.raises(InvArgException):
+        h.merge(mod.Histogram([1]))
+
+
+def test20_slow():
+    """
+    Test the slow chunk log
+    """
+    logged = []
+    m = mod.TransformMetrics(slow_chunk=0.5, log=logged.append)
+    m.chunk(0.1, 2, ["1"], "doc")
+    m.chunk(0.7, 3, ["2", "3"], "doc")
+    assert m.slow_count == 1
+    assert logged == [{"docid": "doc", "chunk": "2,3", "entities": 3,
+                       "seconds": 0.7}]
+    assert m.hist["chunk_entities"].count == 2
+
+
+def test30_export(tmp_path):
+    """
+    Test exporting the metrics
+    """
+    m = mod.TransformMetrics()
+    m.chunk(0.003, 2, ["1"])
+    m.document(0.004, 2)
+
+    got = m.to_prometheus({"documents": 1, "policy": "label"}).splitlines()
+    assert "# TYPE pii_transform_chunk_seconds histogram" in got
+    assert 'pii_transform_chunk_seconds_bucket{le="0.002"} 0' in got
+    assert 'pii_transform_chunk_seconds_bucket{le="0.005"} 1' in got
+    assert 'pii_transform_chunk_seconds_bucket{le="+Inf"} 1' in got
+    assert 'pii_transform_document_entities_bucket{le="2"} 1' in got
+    assert "pii_transform_documents 1" in got
+    assert not any("policy" in line for line in got)
+
+    # Stats already exported as a metric are not repeated
+    got = m.to_prometheus({"slow_chunks": 0}).splitlines()
+    types = [line.split()[2] for line in got if line.startswith("# TYPE")]
+    assert len(types) == len(set(types))
+    assert "# TYPE pii_transform_slow_chunks_total counter" in got
+    assert "pii_transform_slow_chunks_total 0" in got
+
+    m.dump(tmp_path / "metrics.json", {"documents": 1})
+    with open(tmp_path / "metrics.json", encoding="utf-8") as f:
+        got = json.load(f)
+    assert got["histograms"]["document_seconds"]["count"] == 1
+    assert got["stats"] == {"documents": 1}
+
+    m.dump(tmp_path / "metrics.prom")
+    text = (tmp_path / "metrics.prom").read_text(encoding="utf-8")
+    assert text.startswith("# HELP pii_transform_document_seconds")
+    with pytest.raises(InvArgException):
+        m.dump(tmp_path / "metrics.txt", format="xml")
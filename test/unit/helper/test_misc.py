@@ -46,3 +46,15 @@ def test40_set_element():
     Test set_element
     """
     assert mod.set_element(TEST, "f2.g3", 9) is False
+
+
+def test30_keyed_hash():
+    """
+    Test keyed_hash
+    """
+    h = mod.keyed_hash("key", "PERSON", "en", None, "John")
+    assert h == mod.keyed_hash("key", "PERSON", "en", None, "John")
+    assert 0 <= h < 2**64
+    assert h != mod.keyed_hash("key2", "PERSON", "en", None, "John")
+    assert h != mod.keyed_hash("key", "PERSON", "en", None, "Johm")
+    assert mod.keyed_hash("k"*100, "a") != mod.keyed_hash("k"*99, "a")
@@ -0,0 +1,77 @@
+"""
+Test the plain text fast path utilities
+"""
+
+import io
+import mmap
+
+import pytest
+
+import pii_transform.helper.mmaptext as mod
+
+
+TEXT = "Añadir 日本語 text\n" * 200
+
+
+def test10_char_offsets():
+    """
+    Test converting character offsets to byte offsets
+    """
+    data = TEXT.encode("utf-8")
+    m = mod.CharOffsets(data)
+    for pos in (0, 1, 2, 8, 9, 100, 1000, len(TEXT)):
+        assert m(pos) == len(TEXT[:pos].encode("utf-8"))
+    # Going backwards restarts the scan
+    assert m(3) == len(TEXT[:3].encode("utf-8"))
+
+
+def test20_char_offsets_window(monkeypatch):
+    """
+    Test converting offsets with windows that split characters
+    """
+    monkeypatch.setattr(mod, "WINDOW_SIZE", 5)
+    data = TEXT.encode("utf-8")
+    m = mod.CharOffsets(data)
+    for pos in range(0, 200, 7):
+        assert m(pos) == len(TEXT[:pos].encode("utf-8"))
+
+
+@pytest.mark.parametrize("small", [1, 10**6])
+def test30_copy(small, tmp_path, monkeypatch):
+    """
+    Test copying ranges, with and without kernel copies
+    """
+    monkeypatch.setattr(mod, "SMALL_COPY", small)
+    src = tmp_path / "in.txt"
+    src.write_bytes(TEXT.encode("utf-8"))
+    data = src.read_bytes()
+    with open(src, "rb") as f, open(tmp_path / "out.txt", "wb") as out:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        m = mod.RangeCopier(f, buf, out)
+        m.copy(0, 100)
+        m.write(b"<X>")
+        m.copy(200, len(data))
+        m.close()
+        buf.close()
+    assert (tmp_path / "out.txt").read_bytes() == data[:100] + b"<X>" + data[200:]
+    if small == 1:
+        assert m.stats["copied"] == len(data) - 100
+    else:
+        assert m.stats["buffered"] == len(data) - 100
+
+
+def test40_copy_nofile(tmp_path):
+    """
+    Test copying ranges to a non-file output
+    """
+    src = tmp_path / "in.txt"
+    src.write_bytes(TEXT.encode("utf-8"))
+    out = io.BytesIO()
+    with open(src, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        m = mod.RangeCopier(f, buf, out)
+        m.copy(0, len(buf))
+        m.close()
+        buf.close()
+    assert out.getvalue() == src.read_bytes()
+    assert m.stats["copied"] == 0
@@ -0,0 +1,120 @@
+"""
+Test the binary PII collection format
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from pii_data.types import PiiEnum, PiiEntity
+from pii_data.types.piicollection import PiiCollectionLoader
+from pii_data.types.doc import LocalSrcDocumentFile
+from pii_data.helper.exception import FileException
+
+from pii_transform.api import PiiTransformer
+from pii_transform.app.piiconvert import main as convert
+import pii_transform.helper.piibin as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def load_pii(name: str) -> PiiCollectionLoader:
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    return pii
+
+
+def key(pii: PiiEntity):
+    return pii.fields["chunkid"], pii.pos
+
+
+# -----------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test10_roundtrip(tmp_path, name):
+    """
+    Test writing & reading back a collection
+    """
+    pii = load_pii(name)
+    outname = tmp_path / "pii.piib"
+    mod.dump_binary(pii, outname)
+
+    got = mod.load_pii(str(outname))
+    assert isinstance(got, mod.PiiBinaryCollection)
+    assert len(got) == len(pii.pii)
+    assert got.get_header() == pii.get_header()
+    assert sorted(got, key=key) == sorted(pii.pii, key=key)
+    assert got[0] == list(got)[0]
+
+    piic = got.to_collection()
+    assert piic.get_header() == pii.get_header()
+    assert piic.get_detectors() == pii.get_detectors()
+    got.close()
+
+
+def test20_chunk(tmp_path):
+    """
+    Test retrieving the entities for a chunk, and optional fields
+    """
+    piic = PiiCollectionLoader()
+    e = [PiiEntity.build(PiiEnum.EMAIL_ADDRESS, "a@b.com", "2", 10, lang="en"),
+         PiiEntity.build(PiiEnum.PHONE_NUMBER, "555 555", "1", 5,
+                         country="us", extra={"score": 0.5}),
+         PiiEntity.build(PiiEnum.EMAIL_ADDRESS, "añadir@b.com", "2", 3,
+                         lang="en", docid="d1")]
+    for pii in e:
+        piic.add(pii)
+    outname = tmp_path / "pii.piib"
+    mod.dump_binary(piic, outname)
+
+    got = mod.PiiBinaryCollection(outname)
+    assert got.chunk_ids() == ["2", "1"]
+    assert got("2") == [e[2], e[0]]
+    assert got("1") == [e[1]]
+    assert got("1")[0].fields["extra"] == {"score": 0.5}
+    assert got("3") == []
+    assert str(got) == "<PiiBinaryCollection #3>"
+
+
+def test30_invalid(tmp_path):
+    """
+    Test reading a file that is not a binary collection
+    """
+    outname = tmp_path / "pii.piib"
+    outname.write_bytes(b"not a binary collection")
+    with pytest.raises(FileException):
+        mod.PiiBinaryCollection(outname)
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test40_transform(tmp_path, name):
+    """
+    Test transforming a document with a binary collection
+    """
+    doc = LocalSrcDocumentFile(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    pii = load_pii(name)
+    exp = list(PiiTransformer()(doc, pii))
+
+    outname = tmp_path / "pii.piib"
+    mod.dump_binary(pii, outname)
+    got = list(PiiTransformer()(doc, mod.PiiBinaryCollection(outname)))
+    assert got == exp
+
+
+def test50_convert(tmp_path):
+    """
+    Test the conversion script
+    """
+    binname = tmp_path / "pii.piib"
+    outname = tmp_path / "pii.json"
+    convert([str(DATADIR / "minidoc-example-seq-pii.json"), str(binname)])
+    convert([str(binname), str(outname)])
+    with open(outname, encoding="utf-8") as f:
+        got = json.load(f)
+    with open(DATADIR / "minidoc-example-seq-pii.json", encoding="utf-8") as f:
+        exp = json.load(f)
+    assert got["metadata"] == exp["metadata"]
+    assert len(got["pii_list"]) == len(exp["pii_list"])
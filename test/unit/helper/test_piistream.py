@@ -0,0 +1,110 @@
+"""
+Test the PiiStreamReader class
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from pii_data.types.piicollection import PiiCollectionLoader
+from pii_data.types.doc import LocalSrcDocumentFile
+from pii_data.helper.exception import ProcException, InvArgException
+
+from pii_transform.api import PiiTransformer
+import pii_transform.helper.piistream as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def ndjson(name: str, outdir: Path, reorder=None) -> Path:
+    """
+    Dump a PII collection as NDJSON, possibly changing the entity order
+    """
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    if reorder:
+        pii.pii = reorder(pii.pii)
+    outname = outdir / f"{name}.ndjson"
+    with open(outname, "w", encoding="utf-8") as f:
+        pii.dump(f)
+    return outname
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_constructor(tmp_path):
+    """
+    Test constructing the object
+    """
+    name = ndjson("seq", tmp_path)
+    with mod.PiiStreamReader(str(name)) as m:
+        assert str(m) == f"<PiiStreamReader {name}>"
+        assert m.header["format"] == "piisa:pii-collection:v1"
+
+    with pytest.raises(InvArgException):
+        mod.PiiStreamReader(str(DATADIR / "minidoc-example-seq-pii.json"))
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test20_transform(tmp_path, name):
+    """
+    Test transforming a document with a streamed PII collection
+    """
+    doc = LocalSrcDocumentFile(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    exp = list(PiiTransformer()(doc, pii))
+
+    stream = mod.PiiStreamReader(str(ndjson(name, tmp_path)), spill=0)
+    got = list(PiiTransformer()(doc, stream))
+    assert got == exp
+    assert stream.stats() == {"entities": len(pii), "max_spill": 0}
+
+
+def test25_bounded(tmp_path):
+    """
+    Test that reading stops at the end of the group for each chunk, even
+    with a lookahead buffer
+    """
+    with mod.PiiStreamReader(str(ndjson("seq", tmp_path)), spill=1000) as m:
+        assert len(m("3")) == 1
+        assert m.stats() == {"entities": 2, "max_spill": 0}
+        assert len(m("4")) == 2
+        assert m.stats() == {"entities": 3, "max_spill": 0}
+
+
+def test30_reorder(tmp_path):
+    """
+    Test a collection with chunks out of order
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-table-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-table-pii.json")
+    exp = list(PiiTransformer()(doc, pii))
+
+    name = str(ndjson("table", tmp_path, reversed))
+    stream = mod.PiiStreamReader(name, spill=1000)
+    assert list(PiiTransformer()(doc, stream)) == exp
+    assert stream.stats()["max_spill"] == len(pii)
+
+    # Without enough lookahead, we get an error
+    with pytest.raises(ProcException):
+        PiiTransformer()(doc, mod.PiiStreamReader(name, spill=1))
+    with pytest.raises(ProcException):
+        PiiTransformer()(doc, mod.PiiStreamReader(name))
+
+
+def test40_unconsumed(tmp_path):
+    """
+    Test a collection with entities for chunks not in the document
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-seq-orig.yaml")
+    name = ndjson("seq", tmp_path)
+    with open(name, "a", encoding="utf-8") as f:
+        print(json.dumps({"type": "PERSON", "value": "John", "chunkid": "99",
+                          "start": 0, "end": 4}), file=f)
+    with pytest.raises(ProcException):
+        PiiTransformer()(doc, mod.PiiStreamReader(str(name)))
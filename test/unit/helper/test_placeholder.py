@@ -114,3 +114,25 @@ def test40_value_subdict():
     pii = PiiEntity.build(PiiEnum.PERSON, "Augusto Monterroso", "43", 23,
                           lang="es")
     assert m(pii) == "Zutano"
+
+
+def test50_deterministic():
+    """
+    Test deterministic assignment: same key & value, same placeholder,
+    regardless of the assignment order
+    """
+    config = load_config(datafile("placeholder-test.json"))
+    m1 = mod.PlaceholderValue(config, key="secret")
+    m2 = mod.PlaceholderValue(config, key="secret")
+
+    values = [f"1234 567{n}" for n in range(10)]
+    piis = [PiiEntity.build(PiiEnum.CREDIT_CARD, v, "43", 23) for v in values]
+    r1 = [m1(p) for p in piis]
+    r2 = [m2(p) for p in reversed(piis)]
+    assert r1 == r2[::-1]
+    assert set(r1) <= {"0000 0000 0000 0000", "0123 0123 0123 0123",
+                       "9999 9999 9999 9999"}
+
+    # A different key produces (at least some) different assignments
+    m3 = mod.PlaceholderValue(config, key="other")
+    assert [m3(p) for p in piis] != r1
@@ -0,0 +1,100 @@
+"""
+Test the SpanResolver class
+"""
+
+import pytest
+
+from pii_data.helper.exception import InvArgException
+from pii_data.types import PiiEntity
+
+import pii_transform.helper.spans as mod
+
+
+TEXT = "Call John Smith at +34 612 345 678 or mail john@example.com"
+
+
+def entity(ptype: str, value: str, score: float = None) -> PiiEntity:
+    pos = TEXT.index(value)
+    return PiiEntity.build(ptype, value, "1", pos, extra={"score": score})
+
+
+def spans(piilist):
+    return [(p.fields["type"], p.fields["value"]) for p in piilist]
+
+
+PII = [
+    entity("PHONE_NUMBER", "+34 612 345 678", 0.5),
+    entity("PERSON", "John Smith", 0.9),
+    entity("GOV_ID", "612 345", 0.8),
+    entity("PERSON", "John", 0.95),
+    entity("EMAIL_ADDRESS", "john@example.com"),
+    entity("LOCATION", "example.com", 0.7),
+]
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_constructor():
+    """
+    Test constructing the object
+    """
+    m = mod.SpanResolver()
+    assert str(m) == "<SpanResolver longest>"
+    with pytest.raises(InvArgException):
+        mod.SpanResolver("shortest")
+
+
+def test20_longest():
+    """
+    Test the longest-wins strategy
+    """
+    m = mod.SpanResolver("longest")
+    assert spans(m(PII)) == [("PERSON", "John Smith"),
+                             ("PHONE_NUMBER", "+34 612 345 678"),
+                             ("EMAIL_ADDRESS", "john@example.com")]
+    assert m.resolved == 3
+
+
+def test30_score():
+    """
+    Test the highest-score strategy
+    """
+    m = mod.SpanResolver("score")
+    assert spans(m(PII)) == [("PERSON", "John"),
+                             ("GOV_ID", "612 345"),
+                             ("LOCATION", "example.com")]
+
+
+def test40_merge():
+    """
+    Test the merge strategy
+    """
+    pii = PII + [entity("OTHER", "678 or", 0.1)]
+    got = mod.SpanResolver("merge")(pii)
+    assert spans(got) == [("PERSON", "John Smith"),
+                          ("PHONE_NUMBER", "+34 612 345 678 or"),
+                          ("EMAIL_ADDRESS", "john@example.com")]
+    for p in got:
+        assert TEXT[p.pos:p.pos+len(p)] == p.fields["value"]
+    assert mod.pii_score(got[1]) == 0.5
+
+
+def test50_none():
+    """
+    Test disabling resolution
+    """
+    got = mod.SpanResolver("none")(PII)
+    assert [p.pos for p in got] == sorted(p.pos for p in PII)
+
+
+def test60_chain():
+    """
+    Test a chain of overlapping spans: non-overlapping ones are kept
+    """
+    text = "aaaaaaaaaabbbbbbbbbbcccccccccc"
+    pii = [PiiEntity.build("OTHER", text[0:12], "1", 0),
+           PiiEntity.build("OTHER", text[10:22], "1", 10),
+           PiiEntity.build("OTHER", text[20:30], "1", 20)]
+    got = mod.SpanResolver("longest")(pii)
+    assert [p.pos for p in got] == [0, 20]
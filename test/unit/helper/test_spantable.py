@@ -0,0 +1,121 @@
+"""
+Test the span table
+"""
+
+from pathlib import Path
+
+import pytest
+
+from pii_data.types import PiiEnum, PiiEntity
+from pii_data.types.piicollection import PiiCollectionLoader
+from pii_data.types.doc import LocalSrcDocumentFile
+
+from pii_transform.api import PiiTransformer
+from pii_transform.api.transform import discard_pii
+from pii_transform.helper.piibin import dump_binary, PiiBinaryCollection
+from pii_transform.helper.spans import SpanResolver
+from pii_transform.helper.substitution import PiiSubstitutionValue
+import pii_transform.helper.spantable as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def entities():
+    return [
+        PiiEntity.build(PiiEnum.EMAIL_ADDRESS, "a@b.com", "2", 10, lang="en"),
+        PiiEntity.build(PiiEnum.PHONE_NUMBER, "555 555", "1", 5, country="us"),
+        PiiEntity.build(PiiEnum.PERSON, "John", "2", 3, lang="en"),
+        PiiEntity.build(PiiEnum.PERSON, "Mary", "1", 0, lang="en",
+                        process={"stage": "decision", "action": "discard"})
+    ]
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_table():
+    """
+    Test building a table: sorting & chunk lookup
+    """
+    e = entities()
+    m = mod.SpanTable(e)
+    assert len(m) == 4
+    assert m.chunk_ids == ["2", "1"]
+    assert list(m.pos) == [3, 10, 0, 5]
+    assert list(m.length) == [4, 7, 4, 7]
+    assert m.ptype[0] == mod.PII_CODES[PiiEnum.PERSON]
+    assert list(m("2")) == [e[2], e[0]]
+    assert list(m("1").spans()) == [(0, 4), (5, 12)]
+    assert len(m("3")) == 0
+    assert m.info_fields(0) == {"type": "PERSON", "lang": "en",
+                                "value": "John"}
+    assert m.memo_key(1) == (PiiEnum.EMAIL_ADDRESS, "en", None, "a@b.com")
+
+    # Exclusion, and unsorted tables
+    m = mod.SpanTable(e, exclude=discard_pii, sort=False)
+    assert list(m.all()) == e[:3]
+    assert list(m("1")) == []
+
+
+def test20_binary(tmp_path):
+    """
+    Test building a table from a binary collection
+    """
+    e = entities()
+    outname = tmp_path / "pii.piib"
+    dump_binary(e[:3], outname)
+    piic = PiiBinaryCollection(outname)
+
+    m = mod.SpanTable(piic, exclude=discard_pii)
+    assert list(m("2")) == [e[2], e[0]]
+    assert m.value(1) == "a@b.com"
+
+    dump_binary(e, outname)
+    m = mod.SpanTable(PiiBinaryCollection(outname), exclude=discard_pii)
+    assert len(m) == 3
+    assert list(m("1")) == [e[1]]
+
+
+@pytest.mark.parametrize("strategy", ["longest", "merge"])
+def test30_resolve(strategy):
+    """
+    Test resolving overlaps in a table slice
+    """
+    e = [PiiEntity.build(PiiEnum.PERSON, "John Smith", "1", 0),
+         PiiEntity.build(PiiEnum.PERSON, "Smith Jones", "1", 5),
+         PiiEntity.build(PiiEnum.PERSON, "Mary", "1", 20)]
+    m = mod.SpanTable(e)
+    got = SpanResolver(strategy).resolve_slice(m("1"))
+    if strategy == "longest":
+        assert got.table is m
+        assert list(got) == [e[1], e[2]]
+    else:
+        assert got.table is not m
+        assert [p.fields["value"] for p in got] == ["John Smith Jones", "Mary"]
+
+
+def test40_lazy(monkeypatch):
+    """
+    Test that template policies do not request PiiEntity objects
+    """
+    m = mod.SpanTable(entities())
+    monkeypatch.setattr(m, "entity", None)
+    subst = PiiSubstitutionValue("annotate")
+    got = subst.substitute_spans([m("1"), m("2")])
+    assert got == ["<PERSON:Mary>", "<PHONE_NUMBER:555 555>",
+                   "<PERSON:John>", "<EMAIL_ADDRESS:a@b.com>"]
+
+
+def test50_transform():
+    """
+    Test that the transformer gives the same result on a list of entities
+    (with entities marked for removal)
+    """
+    doc = LocalSrcDocumentFile(DATADIR / "minidoc-example-seq-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / "minidoc-example-seq-ignore-pii.json")
+    trf = PiiTransformer()
+    exp = [c.data for c in trf(doc, pii)]
+    got = [c.data for c in trf.iter_transform(doc, pii.pii)]
+    assert got == exp
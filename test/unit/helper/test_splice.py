@@ -0,0 +1,59 @@
+"""
+Test the SplicedText class
+"""
+
+from io import StringIO
+
+import pii_transform.helper.splice as mod
+
+
+TEXT = "My name is John Smith and my phone is 555-1234"
+EDITS = [(11, 21, "<PERSON>"), (38, 46, "<PHONE_NUMBER>")]
+
+
+def test10_constructor():
+    """
+    Test constructing the object
+    """
+    m = mod.SplicedText(TEXT, EDITS)
+    assert str(m) == "My name is <PERSON> and my phone is <PHONE_NUMBER>"
+    assert repr(m) == "<SplicedText #46 edits=2>"
+
+
+def test20_unchanged():
+    """
+    Test an unchanged text: no copy is made
+    """
+    m = mod.SplicedText(TEXT)
+    assert m.changed() is False
+    assert str(m) is TEXT
+    assert len(m) == len(TEXT)
+
+
+def test30_len():
+    """
+    Test computing the length without materialising
+    """
+    m = mod.SplicedText(TEXT, EDITS)
+    assert len(m) == len(str(mod.SplicedText(TEXT, EDITS)))
+    assert m._str is None
+
+
+def test40_write():
+    """
+    Test streaming the edits to a file
+    """
+    m = mod.SplicedText(TEXT, EDITS)
+    out = StringIO()
+    n = m.write(out)
+    assert out.getvalue() == "My name is <PERSON> and my phone is <PHONE_NUMBER>"
+    assert n == len(m)
+    assert m._str is None
+
+
+def test60_materialise():
+    """
+    Test the materialise function
+    """
+    assert mod.materialise(mod.SplicedText("abc", [(0, 1, "X")])) == "Xbc"
+    assert mod.materialise(12) == 12
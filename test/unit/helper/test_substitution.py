@@ -2,6 +2,7 @@
 Test the PiiSubstitutionValue class
 """
 
+import json
 import random
 import pytest
 
@@ -10,6 +11,7 @@ from pii_data.types import PiiEnum, PiiEntity
 
 from pii_transform import defs
 import pii_transform.helper.substitution as mod
+from pii_transform.helper.dictionary import build_dictionary
 
 
 
@@ -273,3 +275,206 @@ def test210_reset():
     for pii, exp in uc:
         pii = PiiEntity.build(pii, "1234 5678", "43", 23, lang="en")
         assert m(pii) == exp
+
+
+def test190_synthetic_table():
+    """
+    Test the table-based synthetic engine
+    """
+    config = {
+        defs.FMT_CONFIG_TRANSFORM: {
+            "seed": 1234,
+            "synthetic_engine": "table"
+        }
+    }
+    m = mod.PiiSubstitutionValue(default_policy="synthetic", config=config)
+    pii = PiiEntity.build(PiiEnum.PERSON, "John Smith", "43", 23, lang="en")
+    value = m(pii)
+    assert value != "John Smith" and len(value.split()) == 2
+
+    # A type without provider falls back to the default policy
+    pii = PiiEntity.build(PiiEnum.MEDICAL, "1234", "43", 23, lang="en")
+    assert m(pii) == "<MEDICAL>"
+
+    # Engine given as a policy argument
+    m = mod.PiiSubstitutionValue(default_policy={"name": "synthetic",
+                                                 "engine": "table"})
+    assert m(pii) == "<MEDICAL>"
+
+    with pytest.raises(InvArgException):
+        mod.PiiSubstitutionValue(default_policy={"name": "synthetic",
+                                                 "engine": "other"})
+
+
+def test300_batch():
+    """
+    Test batch substitution, with a mix of policies
+    """
+    config = {
+        defs.FMT_CONFIG_TRANSFORM: {
+            "policy": {
+                PiiEnum.CREDIT_CARD: {"name": "hash", "key": "abcde"},
+                PiiEnum.PERSON: "annotate",
+                PiiEnum.GOV_ID: {"name": "custom",
+                                 "template": "{type}@{chunkid}"}
+            }
+        }
+    }
+    m = mod.PiiSubstitutionValue(config=config)
+
+    entities = [
+        PiiEntity.build(PiiEnum.CREDIT_CARD, "1234 5678", "43", 23, lang="en"),
+        PiiEntity.build(PiiEnum.PERSON, "John", "43", 3, lang="en"),
+        PiiEntity.build(PiiEnum.GOV_ID, "1234", "43", 3),
+        PiiEntity.build(PiiEnum.BANK_ACCOUNT, "5678", "43", 3),
+        PiiEntity.build(PiiEnum.PERSON, "John", "44", 3, lang="en"),
+        PiiEntity.build(PiiEnum.GOV_ID, "1234", "44", 3),
+        PiiEntity.build(PiiEnum.CREDIT_CARD, "1234 5678", "45", 0, lang="en"),
+    ]
+    exp = [
+        "9d88a82f-5cd3fca6-fec5af44-71b67293",
+        "<PERSON:John>",
+        "GOV_ID@43",
+        "<BANK_ACCOUNT>",
+        "<PERSON:John>",
+        "GOV_ID@44",
+        "9d88a82f-5cd3fca6-fec5af44-71b67293"
+    ]
+    assert m.substitute_batch(entities) == exp
+    assert [m(pii) for pii in entities] == exp
+
+
+def test310_batch_synthetic():
+    """
+    Test batch substitution, synthetic table engine
+    """
+    m = mod.PiiSubstitutionValue(default_policy={"name": "synthetic",
+                                                 "engine": "table"})
+    names = ["John Smith", "Jane Doe", "John Smith", "Mary Major", "Jane Doe"]
+    entities = [PiiEntity.build(PiiEnum.PERSON, n, "1", 0, lang="en")
+                for n in names]
+    got = m.substitute_batch(entities)
+    assert len(set(got)) <= 3
+    assert got[0] == got[2] and got[1] == got[4]
+
+    # Consistent with single substitutions
+    assert [m(pii) for pii in entities] == got
+
+
+def test400_memo():
+    """
+    Test the substitution memo
+    """
+    policy = {"name": "hash", "key": "abcde"}
+    m = mod.PiiSubstitutionValue(default_policy=policy)
+    for n in range(4):
+        pii = PiiEntity.build(PiiEnum.PERSON, "John", "43", n, lang="en")
+        assert m(pii) == "b1bd5730-7132d96c-1f0670ed-163c58cb"
+    stats = m.stats()
+    assert stats["memo_hits"] == 3
+    assert stats["memo_misses"] == 1
+    assert stats["memo_hit_rate"] == 0.75
+    assert stats["memo_size"] == 1
+
+    m.reset()
+    assert m.stats()["memo_size"] == 0
+
+
+def test410_memo_custom():
+    """
+    Test the substitution memo: templates using position fields are not
+    memoized
+    """
+    policy = {"name": "custom", "template": "{type}@{start}"}
+    m = mod.PiiSubstitutionValue(default_policy=policy)
+    for n in range(3):
+        pii = PiiEntity.build(PiiEnum.PERSON, "John", "43", n, lang="en")
+        assert m(pii) == f"PERSON@{n}"
+    assert m.stats()["memo_size"] == 0
+
+
+def test420_memo_disabled():
+    """
+    Test disabling the substitution memo
+    """
+    config = {defs.FMT_CONFIG_TRANSFORM: {"memo": False}}
+    m = mod.PiiSubstitutionValue(config=config)
+    pii = PiiEntity.build(PiiEnum.PERSON, "John", "43", 0, lang="en")
+    assert m(pii) == "<PERSON>"
+    assert m.stats()["memo_size"] is None
+
+
+@pytest.mark.parametrize("policy", ["placeholder", "synthetic"])
+def test500_state(policy):
+    """
+    Test saving & restoring the substitution state
+    """
+    config = {defs.FMT_CONFIG_TRANSFORM: {"seed": 1234}}
+    m = mod.PiiSubstitutionValue(default_policy=policy, config=config)
+
+    def subst(obj, num, offset):
+        return [obj(PiiEntity.build(PiiEnum.PERSON, f"Name{offset+n}", "1",
+                                    n, lang="en"))
+                for n in range(num)]
+
+    subst(m, 5, 0)
+    state = json.loads(json.dumps(m.get_state()))
+    exp = subst(m, 5, 3)
+
+    m2 = mod.PiiSubstitutionValue(default_policy=policy, config=config)
+    m2.set_state(state)
+    assert subst(m2, 5, 3) == exp
+
+    m3 = mod.PiiSubstitutionValue(default_policy="redact")
+    with pytest.raises(InvArgException):
+        m3.set_state(state)
+
+
+def test600_dictionary(tmp_path):
+    """
+    Test the dictionary policy, with its fallback
+    """
+    src = tmp_path / "dict.csv"
+    src.write_text("PERSON,John,Peter\nLOCATION,Paris,Rome\n", encoding="utf-8")
+    dictfile = tmp_path / "dict.piid"
+    build_dictionary(src, dictfile)
+
+    policy = {"name": "dictionary", "path": str(dictfile),
+              "fallback": "label"}
+    m = mod.PiiSubstitutionValue(default_policy=policy)
+    entities = [PiiEntity.build(PiiEnum.PERSON, v, "43", 0, lang="en")
+                for v in ("John", "Paris", "Mary", "John")]
+    exp = ["Peter", "<PERSON>", "<PERSON>", "Peter"]
+    assert [m(pii) for pii in entities] == exp
+    assert m.substitute_batch(entities) == exp
+    stats = m.stats()
+    assert stats["dictionary_hits"] == 4
+    assert stats["dictionary_misses"] == 2
+    m.close()
+
+    with pytest.raises(InvArgException):
+        mod.PiiSubstitutionValue(default_policy={"name": "dictionary"})
+    with pytest.raises(InvArgException):
+        mod.PiiSubstitutionValue(default_policy={**policy, "fallback": policy})
+
+
+def test430_memo_batch():
+    """
+    Test the memo statistics and size limit for batches
+    """
+    config = {defs.FMT_CONFIG_TRANSFORM: {"memo_size": 3}}
+    m = mod.PiiSubstitutionValue(config=config)
+    entities = [PiiEntity.build(PiiEnum.PERSON, v, "43", 0, lang="en")
+                for v in ("John", "Mary", "John", "John")]
+    assert m.substitute_batch(entities) == ["<PERSON>"] * 4
+    stats = m.stats()
+    assert (stats["memo_hits"], stats["memo_misses"]) == (2, 2)
+    assert stats["memo_size"] == 2
+
+    entities = [PiiEntity.build(PiiEnum.PERSON, f"Name{n}", "43", 0,
+                                lang="en") for n in range(5)]
+    m.substitute_batch(entities)
+    assert m.stats()["memo_size"] <= 3
+
+    m = mod.PiiSubstitutionValue()
+    assert m._memo_size == mod.DEFAULT_MEMO_SIZE
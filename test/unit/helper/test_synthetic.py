@@ -184,3 +184,18 @@ def test90_location():
 
     pii = PiiEntity.build(PiiEnum.LOCATION, "Toledo", "43", 23, lang="de")
     assert m(pii) == "Frauenkirchen"
+
+
+def test100_deterministic():
+    """
+    Test deterministic mode: same key & value, same synthetic value,
+    regardless of the assignment order or the object instance
+    """
+    piis = [PiiEntity.build(PiiEnum.PERSON, f"John Smith {n}", "43", 23,
+                            lang="en") for n in range(5)]
+    m1 = mod.SyntheticValue({"deterministic_key": "secret"})
+    r1 = [m1(p) for p in piis]
+    m2 = mod.SyntheticValue(key="secret")
+    r2 = [m2(p) for p in reversed(piis)]
+    assert r1 == r2[::-1]
+    assert len(set(r1)) > 1
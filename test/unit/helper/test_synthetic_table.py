@@ -0,0 +1,116 @@
+"""
+Test the TableSyntheticValue class
+"""
+
+import re
+
+import pytest
+
+from pii_data.types import PiiEnum, PiiEntity
+from pii_data.helper.exception import UnimplementedException
+
+import pii_transform.helper.synthetic_table as mod
+
+
+def test10_constructor():
+    """
+    Test constructing the object
+    """
+    m = mod.TableSyntheticValue()
+    assert str(m) == "<TableSyntheticValue #21>"
+
+
+def test20_value_person():
+    """
+    Test person value, and cache consistency
+    """
+    m = mod.TableSyntheticValue({"seed": 12345})
+
+    pii = PiiEntity.build(PiiEnum.PERSON, "John Smith", "43", 23, lang="en",
+                          country="gb")
+    v1 = m(pii)
+    assert len(v1.split()) == 2
+
+    # Repeat: we get the same (from the cache)
+    pii = PiiEntity.build(PiiEnum.PERSON, "John Smith", "43", 23, lang="en",
+                          country="gb")
+    assert m(pii) == v1
+
+    # Same seed, same values
+    m2 = mod.TableSyntheticValue({"seed": 12345})
+    assert m2(pii) == v1
+
+
+def test30_batch():
+    """
+    Test batch generation
+    """
+    m = mod.TableSyntheticValue({"seed": 1234})
+
+    v = m.generate(PiiEnum.EMAIL_ADDRESS, "es", "es", 20)
+    assert len(v) == 20
+    for email in v:
+        assert re.match(r"^[a-z0-9._]+@example\.(com|net|org)$", email)
+
+    v = m.generate(PiiEnum.CREDIT_CARD, num=10)
+    for card in v:
+        assert mod.luhn_digit(card[:-1]) == card[-1]
+
+
+def test40_govid():
+    """
+    Test government id values
+    """
+    m = mod.TableSyntheticValue({"seed": 1234})
+    for v in m.generate(PiiEnum.GOV_ID, "es", "es", 10):
+        assert "TRWAGMYFPDXBNJZSQVHLCKE"[int(v[:-1]) % 23] == v[-1]
+    for v in m.generate(PiiEnum.GOV_ID, "en", "us", 10):
+        assert re.match(r"^\d{3}-\d{2}-\d{4}$", v)
+    assert mod._check_rut("30.686.957", None) == "30.686.957-4"
+
+
+def test50_iban():
+    """
+    Test IBAN values
+    """
+    m = mod.TableSyntheticValue({"seed": 1234, "iban": True})
+    for v in m.generate(PiiEnum.BANK_ACCOUNT, "es", "es", 10):
+        assert v.startswith("ES") and len(v) == 24
+        num = "".join(str(int(c, 36)) for c in v[4:] + v[:4])
+        assert int(num) % 97 == 1
+
+
+def test55_phone():
+    """
+    Test phone values
+    """
+    m = mod.TableSyntheticValue({"seed": 1234})
+    for v in m.generate(PiiEnum.PHONE_NUMBER, "fr", "fr", 10):
+        assert re.match(r"^(\+33 (\(0\))?\d|0\d)( ?\d\d){4}$", v)
+
+
+def test60_unavailable():
+    """
+    Test unavailable types or languages
+    """
+    m = mod.TableSyntheticValue()
+    with pytest.raises(UnimplementedException):
+        m.generate(PiiEnum.MEDICAL)
+    with pytest.raises(UnimplementedException):
+        m.generate(PiiEnum.PERSON, "xx")
+
+
+def test70_deterministic():
+    """
+    Test deterministic mode: same key & value, same synthetic value,
+    regardless of the assignment order or the object instance
+    """
+    piis = [PiiEntity.build(t, f"value {n}", "43", 23, lang="es")
+            for n in range(5)
+            for t in (PiiEnum.PERSON, PiiEnum.PHONE_NUMBER, PiiEnum.GOV_ID)]
+    m1 = mod.TableSyntheticValue({"deterministic_key": "secret"})
+    r1 = [m1(p) for p in piis]
+    m2 = mod.TableSyntheticValue({"seed": 1}, key="secret")
+    assert m2.substitute_batch(piis[::-1]) == r1[::-1]
+    m3 = mod.TableSyntheticValue(key="other")
+    assert m3.substitute_batch(piis) != r1
@@ -0,0 +1,96 @@
+"""
+Test the PiiVault class
+"""
+
+import pytest
+
+from pii_data.helper.exception import InvArgException, FileException
+
+import pii_transform.helper.vault as mod
+
+
+def test10_constructor(tmp_path):
+    """
+    Test constructing the object
+    """
+    m = mod.PiiVault(tmp_path / "vault")
+    assert str(m) == f"<PiiVault {tmp_path / 'vault'}>"
+    assert len(m) == 0
+    with pytest.raises(FileException):
+        mod.PiiVault(tmp_path / "other", "r")
+    with pytest.raises(InvArgException):
+        mod.PiiVault(tmp_path / "vault", "w")
+    with pytest.raises(InvArgException):
+        m.add(None, "1", [(0, 4, "Ann", "Mary")])
+
+
+def test20_add_lookup(tmp_path):
+    """
+    Test recording & looking up substitutions, with batched writes
+    """
+    with mod.PiiVault(tmp_path, batch_size=3) as m:
+        for n in range(10):
+            m.add("doc1", str(n), [(0, 4, "Ann", f"Name{n}")])
+        assert (tmp_path / "index.jsonl").is_file()
+        assert len(m._buffer) == 1
+
+    m = mod.PiiVault(tmp_path, "r")
+    assert len(m) == 10
+    assert m.lookup("doc1", "4") == [(0, 4, "Ann", "Name4")]
+    assert m.lookup("doc2", "4") is None
+    got = m.lookup_many(("doc1", str(n)) for n in (7, 3, 12))
+    assert got == {("doc1", "7"): [(0, 4, "Ann", "Name7")],
+                   ("doc1", "3"): [(0, 4, "Ann", "Name3")]}
+
+
+def test30_segments(tmp_path):
+    """
+    Test segment rotation & append-only sessions
+    """
+    with mod.PiiVault(tmp_path, batch_size=2, segment_size=100) as m:
+        for n in range(6):
+            m.add("doc1", str(n), [(0, 3, "Ann", "Bob")])
+    with mod.PiiVault(tmp_path) as m:
+        m.add("doc1", "0", [(0, 3, "Ann", "Joe")])
+    segments = sorted(p.name for p in tmp_path.glob("segment-*"))
+    assert len(segments) == 4
+
+    m = mod.PiiVault(tmp_path, "r")
+    assert len(m) == 6
+    assert m.lookup("doc1", "0") == [(0, 3, "Ann", "Joe")]
+    assert m.lookup("doc1", "5") == [(0, 3, "Ann", "Bob")]
+
+
+def test40_hash_index(tmp_path):
+    """
+    Test that the hash index is kept up to date with the journal, and rebuilt
+    if missing
+    """
+    with mod.PiiVault(tmp_path, batch_size=2) as m:
+        for n in range(5):
+            m.add("doc1", str(n), [(0, 3, "Ann", "Bob")])
+    index = tmp_path / mod.HASH_INDEX_NAME
+    assert index.is_file()
+
+    # Appending updates the index incrementally, also on lookups
+    with mod.PiiVault(tmp_path) as m:
+        m.add("doc2", "0", [(0, 3, "Ann", "Eve")])
+        m.add("doc1", "1", [(0, 3, "Ann", "Joe")])
+        assert len(m) == 6
+        assert m.lookup("doc2", "0") == [(0, 3, "Ann", "Eve")]
+        m.add("doc2", "1", [(0, 3, "Ann", "Sue")])
+        assert m.lookup("doc2", "1") == [(0, 3, "Ann", "Sue")]
+
+    m = mod.PiiVault(tmp_path, "r")
+    assert len(m) == 7
+    assert m.lookup("doc1", "1") == [(0, 3, "Ann", "Joe")]
+    assert m.lookup("doc1", "9") is None
+    m.close()
+
+    # A vault without a hash index gets a new one
+    index.unlink()
+    m = mod.PiiVault(tmp_path, "r")
+    assert m.lookup("doc1", "4") == [(0, 3, "Ann", "Bob")]
+    assert len(m) == 7
+    assert index.is_file()
+    m.close()
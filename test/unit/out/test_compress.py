@@ -0,0 +1,102 @@
+"""
+Test block-parallel compressed output
+"""
+
+import gzip
+from pathlib import Path
+
+import pytest
+
+from pii_data.helper.exception import InvArgException, MissingDependency
+from pii_data.types.doc import LocalSrcDocumentFile
+from pii_data.types.piicollection import PiiCollectionLoader
+
+from pii_transform.api import PiiTransformer
+from pii_transform.out import DocumentWriter
+import pii_transform.out.compress as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+TEXT = "".join(f"line {n} ñ\n" for n in range(3000))
+
+
+def transform(name: str):
+    doc = LocalSrcDocumentFile(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    return PiiTransformer()(doc, pii)
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_write(tmp_path):
+    """
+    Test writing a gzip stream in blocks
+    """
+    outname = tmp_path / "out.txt.gz"
+    with mod.open_compressed(outname, {"block_size": 1000, "threads": 3}) as f:
+        f.write(TEXT)
+    with gzip.open(outname, "rt", encoding="utf-8") as f:
+        assert f.read() == TEXT
+
+    with pytest.raises(InvArgException):
+        mod.open_compressed(outname, "lz4")
+
+
+def test20_index(tmp_path):
+    """
+    Test the block index: blocks start at line boundaries
+    """
+    outname = str(tmp_path / "out.txt.gz")
+    with mod.open_compressed(outname, {"block_size": 1000, "level": 1,
+                                       "index": True}) as f:
+        f.write(TEXT)
+
+    offsets = mod.block_offsets(outname)
+    assert len(offsets) > 30
+    data = TEXT.encode("utf-8")
+    assert all(data[n-1:n] == b"\n" for n in offsets[1:])
+
+    got = b"".join(mod.iter_blocks(outname, offsets[10]))
+    assert got == data[offsets[10]:]
+    got = b"".join(mod.iter_blocks(outname, 12345))
+    assert got == data[12345:]
+
+
+@pytest.mark.parametrize("name,ext", [("table", "csv"), ("tree", "yaml")])
+def test30_document(name, ext, tmp_path):
+    """
+    Test writing a document with block compression
+    """
+    outname = tmp_path / f"out.{ext}.gz"
+    DocumentWriter(transform(name)).dump(str(outname), None,
+                                         compress={"block_size": 100})
+    plain = tmp_path / f"out.{ext}"
+    DocumentWriter(transform(name)).dump(str(plain), None)
+    with gzip.open(outname, "rt", encoding="utf-8") as f:
+        assert f.read() == plain.read_text(encoding="utf-8")
+
+
+@pytest.mark.skipif(mod.zstandard is not None, reason="zstandard is installed")
+def test40_zstd_missing(tmp_path):
+    """
+    Test zstd compression without the zstandard package
+    """
+    with pytest.raises(MissingDependency):
+        mod.open_compressed(tmp_path / "out.txt.zst")
+
+
+@pytest.mark.skipif(mod.zstandard is None, reason="zstandard not installed")
+def test50_zstd(tmp_path):
+    """
+    Test zstd compression
+    """
+    outname = tmp_path / "out.yaml.zst"
+    DocumentWriter(transform("seq")).dump(str(outname), None,
+                                          compress={"block_size": 50})
+    data = mod.zstandard.ZstdDecompressor().stream_reader(outname.open("rb")).read()
+    plain = tmp_path / "out.yaml"
+    DocumentWriter(transform("seq")).dump(str(plain), None)
+    assert data.decode("utf-8") == plain.read_text(encoding="utf-8")
@@ -0,0 +1,94 @@
+"""
+Test patch output & application
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from pii_data.helper.io import load_yaml
+from pii_data.helper.exception import ProcException
+from pii_data.types.piicollection import PiiCollectionLoader
+from pii_data.types.doc import LocalSrcDocumentFile
+
+from pii_transform.api import PiiTransformer
+from pii_transform.out import DocumentWriter
+from pii_transform.app.transform import main
+import pii_transform.out.patch as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def load(name: str):
+    doc = LocalSrcDocumentFile(DATADIR / f"minidoc-example-{name}-orig.yaml")
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    return doc, pii
+
+
+# -----------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test10_roundtrip(name, tmp_path):
+    """
+    Test writing a patch and applying it to the original document
+    """
+    doc, pii = load(name)
+    result = PiiTransformer().iter_transform(doc, pii, lazy=True)
+    outname = tmp_path / "out.patch"
+    num = mod.write_patch(outname, doc.metadata, result)
+
+    with open(outname, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0]["format"] == mod.FMT_PATCH
+    assert len(lines) == num + 2
+    assert lines[-1]["summary"]["chunks"] == num
+
+    got = mod.apply_patch(doc, str(outname))
+    DocumentWriter(got).dump(tmp_path / "got.yaml", format=None)
+    exp = DATADIR / f"minidoc-example-{name}-repl.yaml"
+    assert load_yaml(tmp_path / "got.yaml") == load_yaml(exp)
+
+
+def test20_errors(tmp_path):
+    """
+    Test applying invalid patches
+    """
+    doc, pii = load("seq")
+    outname = tmp_path / "out.patch"
+    mod.write_patch(outname, doc.metadata,
+                    PiiTransformer().iter_transform(doc, pii, lazy=True))
+    lines = outname.read_text(encoding="utf-8").splitlines()
+
+    # Truncated
+    outname.write_text("\n".join(lines[:-1]), encoding="utf-8")
+    with pytest.raises(ProcException):
+        mod.load_patch(str(outname))
+
+    # Patch for a different document
+    other, _ = load("table")
+    header = json.loads(lines[0])["header"]
+    with pytest.raises(ProcException):
+        list(mod.iter_apply_patch(other, (header, {})))
+
+    # Chunk length mismatch & unknown chunks
+    with pytest.raises(ProcException):
+        list(mod.iter_apply_patch(doc, (header, {"1": (3, [(0, 1, "X")])})))
+    with pytest.raises(ProcException):
+        list(mod.iter_apply_patch(doc, (header, {"99": (3, [(0, 1, "X")])})))
+
+
+def test30_cli(tmp_path):
+    """
+    Test the command-line patch output & application
+    """
+    orig = str(DATADIR / "minidoc-example-table-orig.yaml")
+    patch = str(tmp_path / "out.patch")
+    main([orig, str(DATADIR / "minidoc-example-table-pii.json"), patch,
+          "--output-format", "patch", "--stream-doc", "-q"])
+    main(["apply-patch", orig, patch, str(tmp_path / "out.yaml")])
+    exp = DATADIR / "minidoc-example-table-repl.yaml"
+    assert load_yaml(tmp_path / "out.yaml") == load_yaml(exp)
@@ -0,0 +1,131 @@
+"""
+Test the ShardedWriter class
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from pii_data.helper.io import load_yaml
+from pii_data.helper.exception import InvArgException
+from pii_data.types.piicollection import PiiCollectionLoader
+
+from pii_transform.api import PiiTransformer
+from pii_transform.helper.docstream import StreamSrcDocumentFile
+import pii_transform.out.shard as mod
+
+
+DATADIR = Path(__file__).parents[2] / "data"
+
+
+def transform(name: str):
+    doc = StreamSrcDocumentFile(str(DATADIR / f"minidoc-example-{name}-orig.yaml"))
+    pii = PiiCollectionLoader()
+    pii.load_json(DATADIR / f"minidoc-example-{name}-pii.json")
+    return doc.metadata, PiiTransformer().iter_transform(doc, pii, lazy=True)
+
+
+def merge(outdir: Path, manifest: dict) -> list:
+    """
+    Read back all shards, and return their chunks in sorted order
+    """
+    chunks = []
+    for shard in manifest["shards"]:
+        doc = load_yaml(outdir / shard["file"])
+        assert doc["header"] == manifest["header"]
+        chunks += doc["chunks"]
+    return sorted(chunks, key=lambda c: c["id"])
+
+
+# -----------------------------------------------------------------------
+
+
+def test10_constructor(tmp_path):
+    """
+    Test constructing the object
+    """
+    m = mod.ShardedWriter(str(tmp_path / "out.yaml"), {}, limit=10)
+    assert str(m) == "<ShardedWriter rows>"
+
+    with pytest.raises(InvArgException):
+        mod.ShardedWriter(str(tmp_path / "out.yaml"), {}, mode="hash")
+    with pytest.raises(InvArgException):
+        mod.ShardedWriter(str(tmp_path / "out.yaml"), {}, mode="size")
+    with pytest.raises(InvArgException):
+        mod.ShardedWriter(str(tmp_path / "out.yaml"), {}, mode="other")
+
+
+def test20_names():
+    """
+    Test shard & manifest file names
+    """
+    f = mod.shard_names("dir/out.yaml.gz")
+    assert f(3) == "dir/out-00003.yaml.gz"
+    assert mod.shard_names("out-{n:02d}.jsonl")(3) == "out-03.jsonl"
+    assert mod.manifest_name("dir/out.yaml.gz") == "dir/out.manifest.json"
+    assert mod.manifest_name("out-{n}.jsonl") == "out.manifest.json"
+
+
+@pytest.mark.parametrize("name", ["seq", "tree", "table"])
+def test30_rows(name, tmp_path):
+    """
+    Test sharding by number of rows: the shards contain the full document
+    """
+    meta, chunks = transform(name)
+    manifest = mod.write_shards(str(tmp_path / "out.yaml"), meta, chunks,
+                                mode="rows", limit=1)
+    assert manifest["format"] == mod.FMT_MANIFEST
+    assert all(s["units"] == 1 for s in manifest["shards"])
+
+    with open(tmp_path / "out.manifest.json", encoding="utf-8") as f:
+        assert json.load(f) == manifest
+
+    exp = load_yaml(DATADIR / f"minidoc-example-{name}-repl.yaml")
+    assert merge(tmp_path, manifest) == sorted(exp["chunks"],
+                                               key=lambda c: c["id"])
+
+
+def test40_size(tmp_path):
+    """
+    Test sharding by size
+    """
+    meta, chunks = transform("seq")
+    manifest = mod.write_shards(str(tmp_path / "out.yaml"), meta, chunks,
+                                mode="size", limit=100)
+    shards = manifest["shards"]
+    assert [s["units"] for s in shards] == [2, 1, 1]
+    assert sum(s["chunks"] for s in shards) == 4
+
+
+def test50_hash(tmp_path):
+    """
+    Test sharding by hash: the assignment is stable
+    """
+    outname = str(tmp_path / "out-{n}.jsonl")
+    meta, chunks = transform("table")
+    m1 = mod.write_shards(outname, meta, chunks, mode="hash", shards=4,
+                          key="row")
+    assert len(m1["shards"]) == 4
+    assert sum(s["units"] for s in m1["shards"]) == 3
+    assert m1["output_format"] == "jsonl"
+
+    meta, chunks = transform("table")
+    m2 = mod.write_shards(outname, meta, chunks, mode="hash", shards=4,
+                          key="row")
+    assert m1 == m2
+
+
+def test60_error(tmp_path):
+    """
+    Test an error while producing chunks: no manifest is written
+    """
+    def chunks():
+        yield from transform("seq")[1]
+        raise ValueError("failed")
+
+    meta, _ = transform("seq")
+    with pytest.raises(ValueError):
+        mod.write_shards(str(tmp_path / "out.yaml"), meta, chunks(),
+                         mode="rows", limit=2)
+    assert not (tmp_path / "out.manifest.json").exists()
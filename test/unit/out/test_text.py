@@ -0,0 +1,28 @@
+"""
+Test writing documents as plain text
+"""
+
+from io import StringIO
+
+import pytest
+
+import pii_transform.out.text as mod
+
+
+@pytest.mark.parametrize("fragments", [
+    ["a\r\nb", "\r\n\r\nc"],
+    ["a\r", "\nb\r", "", "\n\r\nc\n"],
+    ["a\x85b ", "\n", "", "c"],
+])
+def test10_line_writer(fragments):
+    """
+    Check that text fragments are written as the lines of the joined text,
+    wherever the fragments are split
+    """
+    out = StringIO()
+    w = mod._LineWriter(out, "  ")
+    for f in fragments:
+        w.write(f)
+    w.close()
+    exp = "".join(f"  {line}\n" for line in "".join(fragments).splitlines())
+    assert out.getvalue() == exp